@@ -0,0 +1,339 @@
+# bench/fake_live.py
+
+"""
+Offline stand-ins for the Live model and the knowledge base, used by the load
+test (bench/load_test.py).
+
+`install()` patches main.py in-process: `Runner` is replaced by
+FakeLiveRunner, whose run_live() behaves like a voice model (it waits for the
+client to stop sending audio, "thinks", optionally calls one of the real RAG
+tools, then streams transcription and 24 kHz PCM at a realistic rate), and the
+retrieval pipeline is replaced by FakeRetriever, which sleeps instead of
+calling an embedding API. Everything between the two - the WebSocket endpoint,
+protocol, schedulers, frame pipeline, tool executor and caches - is real.
+
+With `replay` (bench/replay.py), ReplayLiveRunner is used instead: it
+re-emits the model side of recorded sessions (server/recorder.py).
+
+It also adds GET /bench/stats with event-loop lag, RSS and CPU time.
+
+Run the patched server on its own:
+    python -m bench.fake_live --port 8765
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import resource
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from google.adk.events import Event
+from google.genai.types import Blob, Content, FunctionCall, FunctionResponse, Part
+from langchain_core.documents import Document
+
+OUTPUT_SAMPLE_RATE = 24000
+
+
+@dataclass
+class FakeModelProfile:
+    """Timing of the simulated model. Defaults approximate a native-audio Live model."""
+    end_of_speech_ms: int = 300  # silence after the last audio chunk before a turn starts (VAD)
+    think_ms: int = 250  # delay before the first output (transcription/audio)
+    response_audio_ms: int = 3000  # length of each spoken answer
+    audio_chunk_ms: int = 40  # size of each PCM chunk the model emits
+    realtime_factor: float = 1.5  # audio is generated this much faster than real time
+    tool_every: int = 3  # every Nth turn calls a RAG tool first (0 disables)
+    retrieval_ms: int = 80  # simulated embedding + search latency per retrieval miss
+
+
+TOOL_CALLS = [
+    ("get_product_information", "question", "What is the cure time of Loctite ESB 5100 at {} C?"),
+    ("get_meeting_briefing", "client_name", "Client {}"),
+    ("get_competitor_comparison", "product_name", "Competitor gasket {}"),
+]
+
+
+class FakeRetriever:
+    """Blocking retriever with a fixed latency (runs on the tool executor like the real one)."""
+
+    def __init__(self, latency_ms: int = 80):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def search_for_tool(self, tool_name: str, query: str) -> list[Document]:
+        return self.search_batch([(tool_name, query)])[0]
+
+    def search_batch(self, requests: list[tuple[str, str]]) -> list[list[Document]]:
+        # One batched embedding call + one matrix search: the latency is paid once per batch.
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        return [[Document(page_content=f"{tool_name} result {i} for '{query}'. " * 8, metadata={"source": "bench"})
+                 for i in range(3)] for tool_name, query in requests]
+
+
+class FakeLiveRunner:
+    """Drop-in for google.adk Runner exposing only what main.py uses."""
+
+    profile = FakeModelProfile()
+
+    def __init__(self, app_name=None, agent=None, session_service=None, **kwargs):
+        self.session_service = session_service
+
+    async def close(self):
+        await self.session_service.flush()
+
+    async def run_live(self, *, session, live_request_queue, run_config, **kwargs):
+        events = asyncio.Queue()
+        reader = asyncio.create_task(self._read_requests(live_request_queue, events))
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            reader.cancel()
+
+    async def _read_requests(self, live_request_queue, events: asyncio.Queue):
+        profile = self.profile
+        turns = itertools.count(1)
+        speaking = False
+        responder = None
+        while True:
+            try:
+                timeout = profile.end_of_speech_ms / 1000 if speaking else None
+                request = await asyncio.wait_for(live_request_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                # Silence after speech: the simulated VAD ends the user's turn.
+                speaking = False
+                responder = asyncio.create_task(self._respond(next(turns), events))
+                continue
+            if request.close:
+                if responder is not None:
+                    responder.cancel()
+                await events.put(None)
+                return
+            if request.blob is not None and request.blob.mime_type.startswith("audio/"):
+                if not speaking and responder is not None and not responder.done():
+                    responder.cancel()  # barge-in
+                    await events.put(Event(author="CatalystAgent", interrupted=True))
+                speaking = True
+            elif request.content is not None:
+                responder = asyncio.create_task(self._respond(next(turns), events))
+
+    async def _respond(self, turn: int, events: asyncio.Queue):
+        profile = self.profile
+        author = "CatalystAgent"
+        await events.put(Event(author="user", content=Content(role="user", parts=[Part.from_text(text=f"question {turn}")])))
+        await asyncio.sleep(profile.think_ms / 1000)
+
+        if profile.tool_every and turn % profile.tool_every == 0:
+            import tools.sales_tools as sales_tools
+            name, arg, template = TOOL_CALLS[(turn // profile.tool_every) % len(TOOL_CALLS)]
+            args = {arg: template.format(turn % 20)}
+            await events.put(Event(author=author, content=Content(role="model", parts=[
+                Part(function_call=FunctionCall(name=name, args=args))])))
+            result = await getattr(sales_tools, name)(**args)
+            await events.put(Event(author=author, content=Content(role="user", parts=[
+                Part(function_response=FunctionResponse(name=name, response=result))])))
+
+        chunk_bytes = OUTPUT_SAMPLE_RATE * 2 * profile.audio_chunk_ms // 1000
+        chunk = bytes(chunk_bytes)
+        chunks = max(1, profile.response_audio_ms // profile.audio_chunk_ms)
+        interval = profile.audio_chunk_ms / 1000 / profile.realtime_factor
+        for index in range(chunks):
+            if index % 10 == 0:
+                await events.put(Event(author=author, partial=True, content=Content(role="model", parts=[
+                    Part.from_text(text=f"answer {turn} part {index // 10}")])))
+            await events.put(Event(author=author, content=Content(role="model", parts=[
+                Part(inline_data=Blob(mime_type="audio/pcm;rate=24000", data=chunk))])))
+            await asyncio.sleep(interval)
+        await events.put(Event(author=author, turn_complete=True))
+
+
+class ReplayLiveRunner(FakeLiveRunner):
+    """
+    Replays the model events of recorded sessions on their recorded timeline
+    (divided by `speed`). Session "replay-<i>" replays recordings[i]. Recorded
+    tool calls run the real tool, whose result replaces the recorded response;
+    client requests are read and discarded until the client closes.
+    """
+
+    recordings: list[list] = []
+    speed: float = 1.0
+
+    async def run_live(self, *, session, live_request_queue, run_config, **kwargs):
+        lines = self.recordings[int(session.id.split("-")[1])]
+        closed = asyncio.Event()
+        reader = asyncio.create_task(self._drain(live_request_queue, closed))
+        started = time.perf_counter()
+        try:
+            for line in lines:
+                if line[1] != "out" or any(part[0] == "response" for part in line[2]["parts"]):
+                    continue  # responses come from running the tool below
+                delay = started + line[0] / 1000 / self.speed - time.perf_counter()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(closed.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                if closed.is_set():
+                    return
+                event = self._event(line[2])
+                yield event
+                for call in event.get_function_calls():
+                    yield await self._call_tool(event.author, call)
+            await closed.wait()
+        finally:
+            reader.cancel()
+
+    @staticmethod
+    def _event(record: dict) -> Event:
+        parts = []
+        for part in record["parts"]:
+            if part[0] == "text":
+                parts.append(Part.from_text(text=part[1]))
+            elif part[0] == "audio":
+                parts.append(Part(inline_data=Blob(mime_type=part[1], data=bytes(part[2]))))
+            elif part[0] == "call":
+                parts.append(Part(function_call=FunctionCall(name=part[1], args=part[2])))
+        flags = {flag: True for flag in ("partial", "turn_complete", "interrupted") if record.get(flag)}
+        content = Content(role=record["role"], parts=parts) if parts else None
+        return Event(author=record["author"], content=content, **flags)
+
+    @staticmethod
+    async def _call_tool(author: str, call) -> Event:
+        import tools.sales_tools as sales_tools
+        result = getattr(sales_tools, call.name)(**(call.args or {}))
+        if asyncio.iscoroutine(result):
+            result = await result
+        return Event(author=author, content=Content(role="user", parts=[
+            Part(function_response=FunctionResponse(name=call.name, response=result))]))
+
+    @staticmethod
+    async def _drain(live_request_queue, closed: asyncio.Event):
+        while not (await live_request_queue.get()).close:
+            pass
+        closed.set()
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes up from a fixed sleep."""
+
+    def __init__(self, interval: float = 0.05, max_samples: int = 20000):
+        self.interval = interval
+        self.samples = deque(maxlen=max_samples)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, (time.perf_counter() - started - self.interval) * 1000))
+
+    def reset(self):
+        self.samples.clear()
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux /proc; falls back to peak RSS elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def install(profile: FakeModelProfile | None = None, replay: list[str] | None = None, speed: float = 1.0):
+    """
+    Patches main.py for offline benchmarking and returns the FastAPI app.
+    `replay` lists session recordings to replay instead of the scripted model.
+    """
+    os.environ.setdefault("EMBEDDING_PROVIDER", "hashing")
+    os.environ.setdefault("EMBEDDING_CACHE_PATH", "")
+    os.environ.setdefault("SESSION_BACKEND", "memory")
+    os.environ.setdefault("RAG_WARMUP", "0")
+    os.environ.setdefault("LIVE_MAX_SESSIONS", "100000")
+
+    import main
+    from rag.cache import RetrievalCache
+    from rag.embeddings import create_embeddings
+    from rag.registry import DEFAULT_INDEX, IndexHandle, IndexRegistry
+
+    FakeLiveRunner.profile = profile or FakeModelProfile()
+    main.Runner = FakeLiveRunner
+    if replay:
+        from server.recorder import read_recording
+        ReplayLiveRunner.recordings = [read_recording(path) for path in replay]
+        ReplayLiveRunner.speed = speed
+        main.Runner = ReplayLiveRunner
+
+    rag = main.rag
+    rag.embeddings = create_embeddings("hashing", cache_path="")
+    retriever = FakeRetriever(FakeLiveRunner.profile.retrieval_ms)
+    rag.indexes = IndexRegistry(
+        lambda name, path: IndexHandle(name, path, retriever, RetrievalCache(max_entries=512, ttl_seconds=600)),
+        {DEFAULT_INDEX: "bench"},
+    )
+    rag.state = "ready"
+
+    lag = LoopLagMonitor()
+    app_lifespan = main.app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan_with_lag_monitor(app):
+        lag.start()
+        async with app_lifespan(app):
+            yield
+
+    main.app.router.lifespan_context = lifespan_with_lag_monitor
+
+    @main.app.get("/bench/stats")
+    async def bench_stats(reset: bool = False):
+        from server.outbound import percentile
+        samples = list(lag.samples)
+        times = os.times()
+        stats = {
+            "rss_bytes": rss_bytes(),
+            "cpu_seconds": times.user + times.system,
+            "loop_lag_ms_p50": percentile(samples, 0.50),
+            "loop_lag_ms_p99": percentile(samples, 0.99),
+            "loop_lag_ms_max": round(max(samples), 2) if samples else None,
+            "retrieval_calls": retriever.calls,
+            "sessions": main.live_sessions.stats(),
+        }
+        if reset:
+            lag.reset()
+        return stats
+
+    return main.app
+
+
+def serve():
+    parser = argparse.ArgumentParser(description="Run main.py against the offline fake Live model.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--think-ms", type=int, default=FakeModelProfile.think_ms)
+    parser.add_argument("--response-audio-ms", type=int, default=FakeModelProfile.response_audio_ms)
+    parser.add_argument("--tool-every", type=int, default=FakeModelProfile.tool_every)
+    parser.add_argument("--retrieval-ms", type=int, default=FakeModelProfile.retrieval_ms)
+    parser.add_argument("--replay", nargs="+", help="session recordings to replay instead of the scripted model")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up factor")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = install(FakeModelProfile(think_ms=args.think_ms, response_audio_ms=args.response_audio_ms,
+                                   tool_every=args.tool_every, retrieval_ms=args.retrieval_ms),
+                  replay=args.replay, speed=args.speed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", ws_max_size=16 * 1024 * 1024)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,238 @@
+# bench/load_test.py
+
+"""
+Offline load test for the /ws/{session_id} endpoint.
+
+Starts main.py against the fake Live model and fake retriever
+(bench/fake_live.py) in a subprocess, then drives N simulated clients. Each
+client streams 16 kHz PCM (or 8 kHz mu-law with --audio-codec pcmu) in real
+time for one utterance, goes quiet, waits for the spoken answer, and repeats;
+it also sends a 720p JPEG camera frame every second. Reported:
+
+    throughput            turns/s, WebSocket messages/s and bytes/s received
+    time to first audio   end of the client's utterance -> first audio frame
+                          (includes the fake model's VAD + think time, printed
+                          alongside as the floor)
+    event-loop lag        p50/p99/max on the server
+    memory per session    (RSS under load - RSS before connecting) / sessions
+    CPU per session       server CPU time / wall time / sessions
+
+Exit status is 1 when a --max-* threshold is exceeded, so it can gate releases:
+
+    python -m bench.load_test --sessions 50 --duration 60 --max-ttfa-p99-ms 1500
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import websockets
+from PIL import Image, ImageDraw
+
+from bench.fake_live import FakeModelProfile
+from server.outbound import percentile
+from server.protocol import KIND_AUDIO_PCM, KIND_AUDIO_PCMU, KIND_IMAGE_JPEG, encode_frame
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+INPUT_SAMPLE_RATE = 16000
+MULAW_SAMPLE_RATE = 8000
+MULAW_SILENCE = 0xFF
+
+
+def make_jpeg(label: str, size=(1280, 720)) -> bytes:
+    image = Image.new("RGB", size, (235, 235, 235))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((80, 80, 80 + 40 * len(label), 300), fill=(30, 30, 120))
+    draw.text((100, 400), label, fill=(0, 0, 0))
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=80)
+    return out.getvalue()
+
+
+class ClientStats:
+    def __init__(self):
+        self.ttfa_ms = []
+        self.turns = 0
+        self.messages = 0
+        self.bytes_received = 0
+        self.failed = 0
+
+
+async def run_client(url: str, index: int, args, stats: ClientStats, deadline: float, frames: list[bytes]):
+    chunk_ms = 40
+    if args.audio_codec == "pcmu":
+        pcm = encode_frame(KIND_AUDIO_PCMU, bytes([MULAW_SILENCE]) * (MULAW_SAMPLE_RATE * chunk_ms // 1000))
+    else:
+        pcm = encode_frame(KIND_AUDIO_PCM, bytes(INPUT_SAMPLE_RATE * 2 * chunk_ms // 1000))
+    turn_done = asyncio.Event()
+    state = {"end_of_speech": None}
+
+    try:
+        async with websockets.connect(f"{url}/ws/bench-{index}?is_audio=true&binary=true&audio_codec={args.audio_codec}", max_size=None) as ws:
+            async def receive():
+                async for message in ws:
+                    stats.messages += 1
+                    stats.bytes_received += len(message)
+                    if isinstance(message, bytes):
+                        if state["end_of_speech"] is not None:
+                            stats.ttfa_ms.append((time.perf_counter() - state["end_of_speech"]) * 1000)
+                            state["end_of_speech"] = None
+                    elif '"turn_complete": true' in message:
+                        turn_done.set()
+
+            async def send_frames():
+                for count in range(10 ** 9):
+                    # The scene changes every 10 s; in between the frames are identical.
+                    await ws.send(encode_frame(KIND_IMAGE_JPEG, frames[(count // 10) % len(frames)]))
+                    await asyncio.sleep(args.frame_interval)
+
+            receiver = asyncio.create_task(receive())
+            sender = asyncio.create_task(send_frames()) if args.frame_interval > 0 else None
+            try:
+                while time.perf_counter() < deadline:
+                    turn_done.clear()
+                    for _ in range(args.utterance_ms // chunk_ms):
+                        await ws.send(pcm)
+                        last_chunk_sent = time.perf_counter()
+                        await asyncio.sleep(chunk_ms / 1000)
+                    state["end_of_speech"] = last_chunk_sent
+                    try:
+                        await asyncio.wait_for(turn_done.wait(), args.turn_timeout)
+                        stats.turns += 1
+                    except asyncio.TimeoutError:
+                        stats.failed += 1
+                    await asyncio.sleep(args.pause_ms / 1000)
+            finally:
+                for task in (receiver, sender):
+                    if task is not None:
+                        task.cancel()
+    except Exception as e:
+        stats.failed += 1
+        print(f"Client {index} failed: {type(e).__name__}: {e}")
+
+
+def http_json(url: str) -> dict:
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def start_server(args) -> subprocess.Popen:
+    command = [sys.executable, "-m", "bench.fake_live", "--port", str(args.port),
+               "--think-ms", str(args.think_ms), "--tool-every", str(args.tool_every),
+               "--retrieval-ms", str(args.retrieval_ms)]
+    server = subprocess.Popen(command, cwd=REPO_ROOT, env={**os.environ, "PYTHONUNBUFFERED": "1"},
+                              stdout=subprocess.DEVNULL if not args.server_logs else None)
+    for _ in range(300):
+        try:
+            http_json(f"http://127.0.0.1:{args.port}/healthz")
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("Benchmark server exited during startup.")
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Benchmark server did not start within 30 s.")
+
+
+async def run(args) -> dict:
+    http_url = args.url or f"http://127.0.0.1:{args.port}"
+    ws_url = http_url.replace("http", "ws", 1)
+    frames = [make_jpeg("meeting notes"), make_jpeg("product sheet ESB 5100")]
+
+    baseline = await asyncio.to_thread(http_json, f"{http_url}/bench/stats?reset=true")
+    stats = ClientStats()
+    started = time.perf_counter()
+    deadline = started + args.ramp_seconds + args.duration
+    clients = []
+    for index in range(args.sessions):
+        clients.append(asyncio.create_task(run_client(ws_url, index, args, stats, deadline, frames)))
+        await asyncio.sleep(args.ramp_seconds / max(1, args.sessions))
+
+    # Sample the server while every client is connected.
+    await asyncio.sleep(min(args.duration / 2, 5))
+    under_load = await asyncio.to_thread(http_json, f"{http_url}/bench/stats")
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - started
+    final = await asyncio.to_thread(http_json, f"{http_url}/bench/stats")
+
+    sessions = max(1, args.sessions)
+    return {
+        "sessions": args.sessions,
+        "audio_codec": args.audio_codec,
+        "elapsed_s": round(elapsed, 1),
+        "turns": stats.turns,
+        "failed": stats.failed,
+        "turns_per_s": round(stats.turns / elapsed, 2),
+        "messages_per_s": round(stats.messages / elapsed, 1),
+        "received_kbytes_per_s": round(stats.bytes_received / elapsed / 1024, 1),
+        "ttfa_ms_p50": percentile(stats.ttfa_ms, 0.50),
+        "ttfa_ms_p99": percentile(stats.ttfa_ms, 0.99),
+        "ttfa_floor_ms": FakeModelProfile.end_of_speech_ms + args.think_ms,  # fake VAD + think time
+        "loop_lag_ms_p50": final["loop_lag_ms_p50"],
+        "loop_lag_ms_p99": final["loop_lag_ms_p99"],
+        "loop_lag_ms_max": final["loop_lag_ms_max"],
+        "memory_per_session_kb": round((under_load["rss_bytes"] - baseline["rss_bytes"]) / sessions / 1024, 1),
+        "cpu_percent_per_session": round((final["cpu_seconds"] - baseline["cpu_seconds"]) / elapsed / sessions * 100, 3),
+        "server_under_load": under_load["sessions"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline WebSocket load test against a fake Live model.")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of steady load after ramp-up")
+    parser.add_argument("--ramp-seconds", type=float, default=5)
+    parser.add_argument("--utterance-ms", type=int, default=1500)
+    parser.add_argument("--pause-ms", type=int, default=1000, help="client pause between turns")
+    parser.add_argument("--frame-interval", type=float, default=1.0, help="seconds between JPEG frames (0 disables)")
+    parser.add_argument("--turn-timeout", type=float, default=30)
+    parser.add_argument("--audio-codec", choices=("pcm", "pcmu"), default="pcm",
+                        help="audio on the wire: raw PCM or 8 kHz mu-law transcoded by the server")
+    parser.add_argument("--think-ms", type=int, default=250)
+    parser.add_argument("--tool-every", type=int, default=3)
+    parser.add_argument("--retrieval-ms", type=int, default=80)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="use an already running bench.fake_live server instead of starting one")
+    parser.add_argument("--server-logs", action="store_true", help="show the server's stdout")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-ttfa-p99-ms", type=float)
+    parser.add_argument("--max-loop-lag-p99-ms", type=float)
+    parser.add_argument("--max-memory-per-session-kb", type=float)
+    parser.add_argument("--max-failed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = None if args.url else start_server(args)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    limits = [
+        ("ttfa_ms_p99", args.max_ttfa_p99_ms),
+        ("loop_lag_ms_p99", args.max_loop_lag_p99_ms),
+        ("memory_per_session_kb", args.max_memory_per_session_kb),
+        ("failed", args.max_failed),
+    ]
+    failures = [f"{name}={report[name]} > {limit}" for name, limit in limits
+                if limit is not None and report[name] is not None and report[name] > limit]
+    if failures:
+        print("FAILED: " + ", ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
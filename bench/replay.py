@@ -0,0 +1,194 @@
+# bench/replay.py
+
+"""
+Replays recorded sessions (SESSION_RECORDING=1, see server/recorder.py)
+against the offline server, to reproduce and profile slow turns.
+
+    python -m bench.replay recordings/rep-42-1760000000000.ndjson --speed 4
+
+Starts bench.fake_live with ReplayLiveRunner, which re-emits each recording's
+model events on the recorded timeline and runs the real tools where the
+recording called them (against the fake retriever). One client per recording
+sends the recorded client frames at the recorded times: silence of the
+recorded size for audio, a generated JPEG per distinct image, the recorded
+text. The replay server records too, and both recordings are summarized:
+
+    turn latency    last user input (transcription or text) -> first model audio
+    tool latency    per call, from time_tool's timings
+    event-loop lag  p50/p99/max on the server
+
+With --speed N every delay is divided by N, so the replayed turn latencies
+are compared with the original ones divided by N.
+"""
+
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from bench.load_test import REPO_ROOT, http_json, make_jpeg
+from server.outbound import percentile
+from server.protocol import KIND_BY_MIME, encode_frame
+from server.recorder import read_recording
+
+MULAW_SILENCE = 0xFF
+
+
+def summarize(lines: list[list]) -> dict:
+    """Turn and tool latencies of a recording."""
+    turn_ms, tools, user_input_at = [], {}, None
+    for t, kind, *fields in lines:
+        if kind == "in" and fields[0] == "text/plain":
+            user_input_at = t
+        elif kind == "out":
+            record = fields[0]
+            if record.get("role") == "user" and any(part[0] == "text" for part in record["parts"]):
+                user_input_at = t
+            elif user_input_at is not None and any(part[0] == "audio" for part in record["parts"]):
+                turn_ms.append(round(t - user_input_at, 1))
+                user_input_at = None
+        elif kind == "tool":
+            name, _, _, timings = fields
+            tools.setdefault(name, []).append(timings["duration_ms"])
+    return {
+        "turns": len(turn_ms),
+        "turn_ms": turn_ms,
+        "turn_ms_p50": percentile(turn_ms, 0.50),
+        "turn_ms_p99": percentile(turn_ms, 0.99),
+        "tool_ms": {name: {"calls": len(durations), "p50": percentile(durations, 0.50),
+                           "max": round(max(durations), 2)} for name, durations in tools.items()},
+    }
+
+
+def synthetic_frame(mime_type: str, size: int, detail, images: dict) -> bytes | str:
+    """A stand-in for a recorded client frame (its content was not recorded)."""
+    if mime_type == "text/plain":
+        return detail
+    if mime_type.startswith("image/"):
+        if detail not in images:
+            images[detail] = make_jpeg(f"recorded frame {detail}")
+        return images[detail]
+    return bytes([MULAW_SILENCE]) * size if mime_type == "audio/pcmu" else bytes(size)
+
+
+async def replay_client(url: str, index: int, lines: list[list], speed: float, stats: dict):
+    header = lines[0][2]
+    binary = bool(header.get("binary"))
+    params = (f"is_audio={str(bool(header.get('is_audio'))).lower()}&binary={str(binary).lower()}"
+              f"&audio_codec={header.get('audio_codec') or 'pcm'}")
+    images = {}
+    async with websockets.connect(f"{url}/ws/replay-{index}?{params}", max_size=None) as ws:
+        async def receive():
+            async for message in ws:
+                stats["messages"] += 1
+                stats["bytes_received"] += len(message)
+
+        receiver = asyncio.create_task(receive())
+        started = time.perf_counter()
+        try:
+            for t, kind, *fields in lines:
+                if kind != "in":
+                    continue
+                await asyncio.sleep(max(0.0, started + t / 1000 / speed - time.perf_counter()))
+                mime_type, size, detail = fields
+                payload = synthetic_frame(mime_type, size, detail, images)
+                if mime_type == "text/plain":
+                    await ws.send(json.dumps({"mime_type": mime_type, "data": payload}))
+                elif binary and mime_type in KIND_BY_MIME:
+                    await ws.send(encode_frame(KIND_BY_MIME[mime_type], payload))
+                else:
+                    await ws.send(json.dumps({"mime_type": mime_type, "data": base64.b64encode(payload).decode()}))
+                stats["frames_sent"] += 1
+            # Let the remaining model events play out before hanging up.
+            await asyncio.sleep(max(0.0, started + lines[-1][0] / 1000 / speed - time.perf_counter()) + 1.0)
+        finally:
+            receiver.cancel()
+
+
+def start_server(paths: list[str], args, recording_dir: str) -> subprocess.Popen:
+    command = [sys.executable, "-m", "bench.fake_live", "--port", str(args.port),
+               "--retrieval-ms", str(args.retrieval_ms), "--speed", str(args.speed), "--replay", *paths]
+    env = {**os.environ, "PYTHONUNBUFFERED": "1", "SESSION_RECORDING": "1", "RECORDING_DIR": recording_dir}
+    server = subprocess.Popen(command, cwd=REPO_ROOT, env=env,
+                              stdout=subprocess.DEVNULL if not args.server_logs else None)
+    for _ in range(300):
+        try:
+            http_json(f"http://127.0.0.1:{args.port}/healthz")
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("Replay server exited during startup.")
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Replay server did not start within 30 s.")
+
+
+async def run(args) -> dict:
+    paths = [os.path.abspath(path) for path in args.recordings]
+    recordings = [read_recording(path) for path in paths]
+    for path, lines in zip(paths, recordings):
+        if not lines or lines[0][1] != "session":
+            raise SystemExit(f"{path} is not a session recording.")
+
+    with tempfile.TemporaryDirectory() as recording_dir:
+        server = start_server(paths, args, recording_dir)
+        try:
+            url = f"ws://127.0.0.1:{args.port}"
+            await asyncio.to_thread(http_json, f"http://127.0.0.1:{args.port}/bench/stats?reset=true")
+            stats = {"messages": 0, "bytes_received": 0, "frames_sent": 0}
+            started = time.perf_counter()
+            await asyncio.gather(*(replay_client(url, index, lines, args.speed, stats)
+                                   for index, lines in enumerate(recordings)))
+            elapsed = time.perf_counter() - started
+            server_stats = await asyncio.to_thread(http_json, f"http://127.0.0.1:{args.port}/bench/stats")
+        finally:
+            server.terminate()
+            server.wait(timeout=10)  # the recorder flushes at exit
+
+        sessions = []
+        for index, (path, lines) in enumerate(zip(paths, recordings)):
+            replayed = sorted(glob.glob(os.path.join(recording_dir, f"replay-{index}-*.ndjson")))
+            original = summarize(lines)
+            replay = summarize(read_recording(replayed[-1])) if replayed else None
+            if replay is not None:
+                replay["expected_turn_ms"] = [round(ms / args.speed, 1) for ms in original["turn_ms"]]
+            sessions.append({"recording": path, "original": original, "replay": replay})
+
+    return {
+        "speed": args.speed,
+        "elapsed_s": round(elapsed, 1),
+        **stats,
+        "loop_lag_ms_p50": server_stats["loop_lag_ms_p50"],
+        "loop_lag_ms_p99": server_stats["loop_lag_ms_p99"],
+        "loop_lag_ms_max": server_stats["loop_lag_ms_max"],
+        "sessions": sessions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sessions against the offline server.")
+    parser.add_argument("recordings", nargs="+", help="session recordings (RECORDING_DIR/*.ndjson)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--retrieval-ms", type=int, default=80, help="fake retriever latency per retrieval miss")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--server-logs", action="store_true", help="show the server's stdout")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,90 @@
 # create_index.py
 
 import os
-from langchain_google_vertexai import VertexAIEmbeddings
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
+import argparse
+from rag.embeddings import create_embeddings
+from rag.indexing import build_index
 
 # Make sure your PDFs are in a folder named 'docs'
 PDFS_PATH = "docs/"
 INDEX_PATH = "faiss_index"
+# Optional CRM export (account_name,contact_name,contact_email,contact_role) for name resolution
+CRM_EXPORT_PATH = os.getenv("CRM_EXPORT_PATH", "docs/crm_export.csv")
 
-def create_vector_index():
+def create_vector_index(pdfs_path: str = PDFS_PATH, index_path: str = INDEX_PATH, incremental: bool = True, workers: int | None = None,
+                        batch_size: int = 64, max_concurrency: int = 4,
+                        index_format: str = "mmap", index_type: str = "flat", dtype: str = "float16",
+                        crm_path: str | None = CRM_EXPORT_PATH, pages_per_task: int = 16,
+                        checkpoint_interval: float = 30.0):
     """
-    This function reads all PDFs in the specified directory,
-    splits them into chunks, creates embeddings, and saves them
-    to a local FAISS vector store.
+    This function reads the PDFs in the specified directory, splits them into
+    chunks, creates embeddings, and saves them to a local vector store.
+    In incremental mode only new or changed PDFs are parsed and embedded.
+    PDFs are streamed page range by page range, and an interrupted build
+    resumes from its last checkpoint.
     """
-    print("Starting PDF loading...")
-    # Make sure your project is authenticated via `gcloud auth application-default login`
-    loader = PyPDFDirectoryLoader(PDFS_PATH)
-    documents = loader.load()
-    print(f"Loaded {len(documents)} document pages.")
-
-    print("Splitting documents into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    docs = text_splitter.split_documents(documents)
-    print(f"Split into {len(docs)} chunks.")
-
     print("Initializing embeddings model...")
-    # Using the standard Vertex AI embeddings model
-    embeddings = VertexAIEmbeddings(model_name="text-embedding-005")
+    # Uses EMBEDDING_PROVIDER (default: vertex). For Vertex, make sure your project is
+    # authenticated via `gcloud auth application-default login`
+    embeddings = create_embeddings()
+    print(f"Using embedding model '{embeddings.model_id}'.")
+
+    summary = build_index(
+        pdfs_path, index_path, embeddings,
+        incremental=incremental,
+        workers=workers,
+        batch_size=batch_size,
+        max_concurrency=max_concurrency,
+        index_format=index_format,
+        index_type=index_type,
+        dtype=dtype,
+        crm_path=crm_path,
+        pages_per_task=pages_per_task,
+        checkpoint_interval=checkpoint_interval,
+    )
+    print(f"--- Index at '{index_path}' is ready: {summary} ---")
 
-    print("Creating and saving the FAISS vector store...")
-    db = FAISS.from_documents(docs, embeddings)
-    db.save_local(INDEX_PATH)
-    print(f"--- Index created successfully at '{INDEX_PATH}' ---")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the FAISS index from the PDFs in docs/.")
+    parser.add_argument("--docs", default=PDFS_PATH, help="Directory with the PDFs to index.")
+    parser.add_argument("--index", default=INDEX_PATH,
+                        help="Index directory to build, e.g. indexes/emea for a named index (see RAG_INDEXES).")
+    parser.add_argument("--full", action="store_true", help="Rebuild from scratch instead of incrementally.")
+    parser.add_argument("--workers", type=int, default=None, help="PDF parsing processes (default: CPU count).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts per embedding request.")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Concurrent embedding requests.")
+    parser.add_argument("--format", choices=["mmap", "faiss"], default="mmap",
+                        help="mmap: memory-mapped vectors + SQLite docs (default); faiss: legacy pickled FAISS store.")
+    parser.add_argument("--index-type", choices=["flat", "ivfpq", "hnsw"], default="flat",
+                        help="ANN index for the mmap format.")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16",
+                        help="Stored vector precision for the mmap format.")
+    parser.add_argument("--crm", default=CRM_EXPORT_PATH,
+                        help="CRM export CSV with accounts and contacts for name resolution (skipped if missing).")
+    parser.add_argument("--pages-per-task", type=int, default=16,
+                        help="PDF pages parsed per worker task (bounds memory per in-flight task).")
+    parser.add_argument("--checkpoint-interval", type=float, default=30.0,
+                        help="Seconds between build checkpoints; an interrupted build resumes from the last one.")
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
     # Create a 'docs' folder in your project root and place your two PDFs inside it.
-    if not os.path.exists(PDFS_PATH):
-        os.makedirs(PDFS_PATH)
-        print(f"Created '{PDFS_PATH}' directory. Please add your PDF files there and run again.")
+    if not os.path.exists(args.docs):
+        os.makedirs(args.docs)
+        print(f"Created '{args.docs}' directory. Please add your PDF files there and run again.")
     else:
-        create_vector_index()
+        create_vector_index(
+            pdfs_path=args.docs,
+            index_path=args.index,
+            incremental=not args.full,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            max_concurrency=args.max_concurrency,
+            index_format=args.format,
+            index_type=args.index_type,
+            dtype=args.dtype,
+            crm_path=args.crm,
+            pages_per_task=args.pages_per_task,
+            checkpoint_interval=args.checkpoint_interval,
+        )
@@ -2,8 +2,9 @@
 * app.js: Frontend logic for the Henkel Sales Dashboard Assistant.
 * Merged version with multi-view dashboard UI, multi-modal chat, and enhanced Dev Mode.
 */
-import { startAudioPlayerWorklet } from "./audio-player.js";
+import { startAudioPlayerWorklet, playPCMFrame, playMulaw } from "./audio-player.js";
 import { startAudioRecorderWorklet, stopMicrophone } from "./audio-recorder.js";
+import { FrameKind, KIND_BY_MIME, decodeFrameHeader, encodeFrame } from "./ws-protocol.js";
 class MediaHandler {
   constructor() {
       this.videoElement = null;
@@ -53,7 +54,8 @@ class MediaHandler {
           this.videoElement.srcObject = null;
       }
   }
-  startFrameCapture(onFrame) {
+  // In binary mode frames are delivered as JPEG ArrayBuffers instead of base64 strings.
+  startFrameCapture(onFrame, binary = false) {
       if (this.frameCaptureInterval) {
           this.stopFrameCapture();
       }
@@ -64,6 +66,10 @@ class MediaHandler {
           canvas.height = this.videoElement.videoHeight;
           const context = canvas.getContext('2d');
           context.drawImage(this.videoElement, 0, 0, canvas.width, canvas.height);
+          if (binary) {
+              canvas.toBlob((blob) => blob && blob.arrayBuffer().then(onFrame), 'image/jpeg', 0.8);
+              return;
+          }
           const base64Image = canvas.toDataURL('image/jpeg', 0.8).split(',')[1];
           onFrame(base64Image);
       }, 1000);
@@ -86,7 +92,10 @@ const state = {
   mediaHandler: new MediaHandler(),
   audio: { playerNode: null, playerContext: null, recorderNode: null, recorderContext: null, micStream: null, },
   currentInviteDetails: null, // To store invite data for the updated card
-  isAudioActive: true // Default to true for AI Actions mode
+  isAudioActive: true, // Default to true for AI Actions mode
+  binaryProtocol: true, // Audio/image as binary WebSocket frames instead of base64 JSON
+  requestedAudioCodec: "pcmu", // 8 kHz mu-law (64 kbit/s) instead of raw PCM; "pcm" to opt out
+  audioCodec: "pcm" // What the server confirmed for this connection (see applyAudioConfig)
 };
 // ▲▲▲ END OF MODIFIED STATE OBJECT ▲▲▲
 const DOMElements = {
@@ -279,9 +288,10 @@ function connectWebsocket() {
   const selectedLang = DOMElements.languageSelector.value;
   const isDevMode = DOMElements.devModeToggle.checked;
   // Use the new state variable to control the audio parameter
-  let fullWsUrl = `${wsUrl}?is_audio=${state.isAudioActive}&lang=${selectedLang}&dev_mode=true`;
+  let fullWsUrl = `${wsUrl}?is_audio=${state.isAudioActive}&lang=${selectedLang}&dev_mode=true&binary=${state.binaryProtocol}&audio_codec=${state.requestedAudioCodec}`;
   console.log("Connecting to:", fullWsUrl);
   state.websocket = new WebSocket(fullWsUrl);
+  state.websocket.binaryType = "arraybuffer";
   state.websocket.onopen = onWsOpen;
   state.websocket.onmessage = onWsMessage;
   state.websocket.onclose = onWsClose;
@@ -317,15 +327,24 @@ function onWsError(error) {
   updateConnectionStatus("Error", "error");
 }
 function onWsMessage(event) {
+  if (event.data instanceof ArrayBuffer) {
+      handleBinaryFrame(event.data);
+      return;
+  }
   try {
       const message = JSON.parse(event.data);
       // console.log("Received data:", message); // <-- You can uncomment this line to debug
+      if (message.interrupted) {
+          // The user barged in: drop audio already buffered for playback (the server flushed its queue too).
+          state.audio.playerNode?.port.postMessage({ command: 'clear' });
+          return;
+      }
       if (message.turn_complete) {
           finalizeAndDisplayMessages();
           state.currentTurnType = null;
           return;
       }
-      const isAgentMessage = ["tool_call", "tool_result", "audio/pcm", "text/transcription", "text/plain", "application/json"].includes(message.mime_type);
+      const isAgentMessage = ["tool_call", "tool_result", "audio/pcm", "audio/pcmu", "text/transcription", "text/plain", "application/json"].includes(message.mime_type);
       if (isAgentMessage && state.userTranscriptionBuffer) {
           displayFinalUserMessage();
       }
@@ -358,6 +377,9 @@ function onWsMessage(event) {
           "tool_result": handleToolResult,
           "text/input_transcription": handleUserTranscription,
           "audio/pcm": playAudioChunk,
+          "audio/pcmu": playAudioChunk,
+          "audio/config": applyAudioConfig,
+          "text/throttled": handleThrottledText,
           "text/transcription": (msg) => {
               state.agentTranscriptionBuffer = msg.data;
           },
@@ -372,6 +394,19 @@ function onWsMessage(event) {
       console.error("Error processing incoming message:", error);
   }
 }
+function handleBinaryFrame(frame) {
+  const header = decodeFrameHeader(frame);
+  if (!header) {
+      console.warn("Dropping malformed binary frame.");
+      return;
+  }
+  if (header.kind === FrameKind.AUDIO_PCM || header.kind === FrameKind.AUDIO_PCMU) {
+      if (state.userTranscriptionBuffer) {
+          displayFinalUserMessage();
+      }
+      playAudioFrame(frame, header);
+  }
+}
 function handleToolResult(msg) {
   displayDevMessage(msg);
   const toolResponse = msg.data?.response;
@@ -503,14 +538,14 @@ async function setupAudio() {
   DOMElements.aiActionsBtn.classList.add('ai-recording');
   try {
       if (!state.audio.playerNode) {
-          [state.audio.playerNode, state.audio.playerContext] = await startAudioPlayerWorklet();
+          [state.audio.playerNode, state.audio.playerContext] = await startAudioPlayerWorklet(state.audioCodec);
           if (state.audio.playerContext && state.audio.playerContext.state === 'suspended') {
               await state.audio.playerContext.resume();
               console.log("AudioContext resumed successfully.");
           }
       }
       if (!state.audio.recorderNode) {
-          [state.audio.recorderNode, state.audio.recorderContext, state.audio.micStream] = await startAudioRecorderWorklet(audioRecorderHandler);
+          [state.audio.recorderNode, state.audio.recorderContext, state.audio.micStream] = await startAudioRecorderWorklet(audioRecorderHandler, state.binaryProtocol, state.audioCodec);
       }
       updateButtonStates();
   } catch (error) {
@@ -544,17 +579,17 @@ async function startMedia(mediaType) {
       }
       DOMElements.videoFeedContainer.classList.remove('hidden');
       if (!state.audio.playerNode) {
-          [state.audio.playerNode, state.audio.playerContext] = await startAudioPlayerWorklet();
+          [state.audio.playerNode, state.audio.playerContext] = await startAudioPlayerWorklet(state.audioCodec);
           if (state.audio.playerContext && state.audio.playerContext.state === 'suspended') {
               await state.audio.playerContext.resume();
           }
       }
       // This existing check correctly handles starting the mic only if it's not already on.
       if (!state.audio.recorderNode) {
-          [state.audio.recorderNode, state.audio.recorderContext, state.audio.micStream] = await startAudioRecorderWorklet(audioRecorderHandler);
+          [state.audio.recorderNode, state.audio.recorderContext, state.audio.micStream] = await startAudioRecorderWorklet(audioRecorderHandler, state.binaryProtocol, state.audioCodec);
           state.isAudioMode = true;
       }
-      state.mediaHandler.startFrameCapture(videoFrameHandler);
+      state.mediaHandler.startFrameCapture(videoFrameHandler, state.binaryProtocol);
       DOMElements.chatAppContainer.classList.add('video-active');
       updateButtonStates();
   } catch (error) {
@@ -588,7 +623,12 @@ function handleImageUpload(e) {
       const base64Image = event.target.result.split(',')[1];
       if (base64Image) {
           displayUserImageMessage(base64Image, file.type);
-          sendMessage({ mime_type: file.type, data: base64Image });
+          const kind = KIND_BY_MIME[file.type];
+          if (state.binaryProtocol && kind) {
+              file.arrayBuffer().then((buffer) => sendFrame(encodeFrame(kind, buffer)));
+          } else {
+              sendMessage({ mime_type: file.type, data: base64Image });
+          }
       }
   };
   reader.onerror = function (error) {
@@ -597,9 +637,13 @@ function handleImageUpload(e) {
   reader.readAsDataURL(file);
   e.target.value = '';
 }
-function videoFrameHandler(base64Image) {
+function videoFrameHandler(image) {
   if (state.isVideoMode) {
-      sendMessage({ mime_type: "image/jpeg", data: base64Image });
+      if (image instanceof ArrayBuffer) {
+          sendFrame(encodeFrame(FrameKind.IMAGE_JPEG, image));
+      } else {
+          sendMessage({ mime_type: "image/jpeg", data: image });
+      }
   }
 }
 function audioRecorderHandler(pcmData) {
@@ -607,7 +651,13 @@ function audioRecorderHandler(pcmData) {
       if (state.currentTurnType !== 'audio') {
           state.currentTurnType = 'audio';
       }
-      sendMessage({ mime_type: "audio/pcm", data: arrayBufferToBase64(pcmData) });
+      if (state.binaryProtocol) {
+          // The recorder already wrote the PCM into a binary frame.
+          sendFrame(pcmData);
+      } else {
+          const mimeType = state.audioCodec === "pcmu" ? "audio/pcmu" : "audio/pcm";
+          sendMessage({ mime_type: mimeType, data: arrayBufferToBase64(pcmData) });
+      }
   }
 }
 // UPDATED to prevent audio playback in chat mode
@@ -615,12 +665,56 @@ function playAudioChunk(message) {
   // Only play audio if the main chat UI is NOT visible (i.e., in 'AI Actions' mode).
   if (!DOMElements.chatAppContainer.classList.contains('visible')) {
       if (state.audio.playerNode && state.audio.playerContext?.state === 'running') {
-          state.audio.playerNode.port.postMessage(base64ToArray(message.data));
+          if (message.mime_type === "audio/pcmu") {
+              playMulaw(state.audio.playerNode, base64ToArray(message.data));
+          } else {
+              state.audio.playerNode.port.postMessage(base64ToArray(message.data));
+          }
       } else {
           console.warn("Could not play audio because player is not ready or context is not running.");
       }
   }
 }
+function playAudioFrame(frame, header) {
+  if (!DOMElements.chatAppContainer.classList.contains('visible')) {
+      if (state.audio.playerNode && state.audio.playerContext?.state === 'running') {
+          if (header.kind === FrameKind.AUDIO_PCMU) {
+              playMulaw(state.audio.playerNode, frame, header.payloadOffset);
+          } else {
+              playPCMFrame(state.audio.playerNode, frame);
+          }
+      } else {
+          console.warn("Could not play audio because player is not ready or context is not running.");
+      }
+  }
+}
+// The server confirms the audio codec of each connection (PCM when compressed audio is disabled there).
+function applyAudioConfig(message) {
+  const codec = message.data?.codec || "pcm";
+  if (codec === state.audioCodec) return;
+  state.audioCodec = codec;
+  // The worklets run at the codec's sample rate, so recreate them.
+  const wasRecording = state.isAudioMode;
+  stopMicrophoneAndState();
+  state.audio.recorderContext?.close();
+  state.audio.recorderContext = null;
+  state.audio.playerContext?.close();
+  state.audio.playerNode = null;
+  state.audio.playerContext = null;
+  if (wasRecording) {
+      setupAudio();
+  }
+}
+// The server rate-limits typed messages; tell the user this one was not sent.
+function handleThrottledText(message) {
+  const seconds = Math.ceil((message.data?.retry_after_ms || 1000) / 1000);
+  showSnackbar(`Message not sent: you're sending too fast. Try again in ${seconds} s.`);
+}
+function sendFrame(frame) {
+  if (state.websocket && state.websocket.readyState === WebSocket.OPEN) {
+      state.websocket.send(frame);
+  }
+}
 function sendMessage(message) {
   if (state.websocket && state.websocket.readyState === WebSocket.OPEN) {
       state.websocket.send(JSON.stringify(message));
@@ -3,9 +3,13 @@
  * Audio Player Worklet
  */
 
-export async function startAudioPlayerWorklet() {
+import { HEADER_SIZE } from "./ws-protocol.js";
+import { MULAW_SAMPLE_RATE, decodeMulaw } from "./mulaw.js";
+
+// With `codec` "pcmu" the server sends 8 kHz mu-law instead of 24 kHz PCM.
+export async function startAudioPlayerWorklet(codec = "pcm") {
     const audioContext = new AudioContext({
-        sampleRate: 24000
+        sampleRate: codec === "pcmu" ? MULAW_SAMPLE_RATE : 24000
     });
     
     // The path for pcm-player-processor.js is relative to audio-player.js
@@ -18,3 +22,17 @@ export async function startAudioPlayerWorklet() {
 
     return [audioPlayerNode, audioContext];
 }
+
+// Hands the PCM payload of a binary frame to the player worklet. The frame
+// buffer is viewed in place and transferred, so nothing is copied here.
+export function playPCMFrame(audioPlayerNode, frame) {
+  const samples = new Int16Array(frame, HEADER_SIZE, (frame.byteLength - HEADER_SIZE) >> 1);
+  audioPlayerNode.port.postMessage(samples, [frame]);
+}
+
+// Decodes the mu-law payload of a binary frame (or of a base64 JSON message,
+// as an ArrayBuffer) and hands the PCM to the player worklet.
+export function playMulaw(audioPlayerNode, buffer, offset = 0) {
+  const samples = decodeMulaw(new Uint8Array(buffer, offset));
+  audioPlayerNode.port.postMessage(samples, [samples.buffer]);
+}
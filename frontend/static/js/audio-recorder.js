@@ -3,10 +3,17 @@
  * Audio Recorder Worklet
  */
 
+import { FrameKind, HEADER_SIZE, allocateFrame } from "./ws-protocol.js";
+import { MULAW_SAMPLE_RATE, encodeMulaw } from "./mulaw.js";
+
 let micStream;
 
-export async function startAudioRecorderWorklet(audioRecorderHandler) {
-  const audioRecorderContext = new AudioContext({ sampleRate: 16000 });
+// When `binaryFrames` is true the handler receives ready-to-send binary frames
+// (PCM written directly after the frame header) instead of bare PCM buffers.
+// With `codec` "pcmu" the microphone is captured at 8 kHz and mu-law encoded.
+export async function startAudioRecorderWorklet(audioRecorderHandler, binaryFrames = false, codec = "pcm") {
+  const compressed = codec === "pcmu";
+  const audioRecorderContext = new AudioContext({ sampleRate: compressed ? MULAW_SAMPLE_RATE : 16000 });
   console.log("AudioContext sample rate:", audioRecorderContext.sampleRate);
 
   // The path for pcm-recorder-processor.js is relative to audio-recorder.js
@@ -25,7 +32,16 @@ export async function startAudioRecorderWorklet(audioRecorderHandler) {
 
   source.connect(audioRecorderNode);
   audioRecorderNode.port.onmessage = (event) => {
-    const pcmData = convertFloat32ToPCM(event.data);
+    let pcmData;
+    if (compressed) {
+      pcmData = binaryFrames
+        ? convertFloat32ToMulawFrame(event.data)
+        : encodeMulaw(event.data, new Uint8Array(event.data.length)).buffer;
+    } else {
+      pcmData = binaryFrames
+        ? convertFloat32ToPCMFrame(event.data)
+        : convertFloat32ToPCM(event.data);
+    }
     audioRecorderHandler(pcmData);
   };
   return [audioRecorderNode, audioRecorderContext, micStream];
@@ -43,3 +59,18 @@ function convertFloat32ToPCM(inputData) {
   }
   return pcm16.buffer;
 }
+
+function convertFloat32ToPCMFrame(inputData) {
+  const frame = allocateFrame(FrameKind.AUDIO_PCM, inputData.length * 2);
+  const pcm16 = new Int16Array(frame, HEADER_SIZE, inputData.length);
+  for (let i = 0; i < inputData.length; i++) {
+    pcm16[i] = inputData[i] * 0x7fff;
+  }
+  return frame;
+}
+
+function convertFloat32ToMulawFrame(inputData) {
+  const frame = allocateFrame(FrameKind.AUDIO_PCMU, inputData.length);
+  encodeMulaw(inputData, new Uint8Array(frame, HEADER_SIZE, inputData.length));
+  return frame;
+}
@@ -0,0 +1,45 @@
+// frontend/static/js/mulaw.js
+/**
+ * G.711 mu-law codec for the compressed audio mode (mirrors server/audio.py).
+ * One byte per sample at 8 kHz: 64 kbit/s instead of 256 kbit/s (16 kHz PCM)
+ * to the server and 384 kbit/s (24 kHz PCM) from it.
+ */
+
+export const MULAW_SAMPLE_RATE = 8000;
+
+const BIAS = 0x84;
+const CLIP = 32635;
+
+// Decoding is a table lookup: mu-law byte -> PCM16 sample.
+const DECODE_TABLE = new Int16Array(256);
+for (let i = 0; i < 256; i++) {
+  const code = ~i & 0xff;
+  const exponent = (code >> 4) & 0x07;
+  const magnitude = ((((code & 0x0f) << 3) + BIAS) << exponent) - BIAS;
+  DECODE_TABLE[i] = code & 0x80 ? -magnitude : magnitude;
+}
+
+function encodeSample(sample) {
+  const sign = sample < 0 ? 0x80 : 0;
+  const magnitude = Math.min(Math.abs(sample), CLIP) + BIAS;
+  const exponent = 31 - Math.clz32(magnitude) - 7;
+  const mantissa = (magnitude >> (exponent + 3)) & 0x0f;
+  return ~(sign | (exponent << 4) | mantissa) & 0xff;
+}
+
+// Encodes Float32 samples in [-1, 1] into `out` (a Uint8Array of the same length).
+export function encodeMulaw(float32Samples, out) {
+  for (let i = 0; i < float32Samples.length; i++) {
+    out[i] = encodeSample(Math.round(float32Samples[i] * 0x7fff));
+  }
+  return out;
+}
+
+// Decodes mu-law bytes (a Uint8Array) into a new Int16Array.
+export function decodeMulaw(bytes) {
+  const pcm16 = new Int16Array(bytes.length);
+  for (let i = 0; i < bytes.length; i++) {
+    pcm16[i] = DECODE_TABLE[bytes[i]];
+  }
+  return pcm16;
+}
@@ -21,8 +21,8 @@ class PCMPlayerProcessor extends AudioWorkletProcessor {
          return;
        }
        // ▲▲▲ END OF MODIFIED BLOCK ▲▲▲
-        // Decode the base64 data to int16 array.
-       const int16Samples = new Int16Array(event.data);
+        // Binary frames arrive as an Int16Array view; legacy messages as an ArrayBuffer.
+       const int16Samples = event.data instanceof Int16Array ? event.data : new Int16Array(event.data);
         // Add the audio data to the buffer
        this._enqueue(int16Samples);
      };
@@ -0,0 +1,50 @@
+// frontend/static/js/ws-protocol.js
+/**
+ * Binary WebSocket frame protocol (mirrors server/protocol.py).
+ * Frame layout: [kind: uint8][version: uint8][payload...]
+ * The 2-byte header keeps 16-bit PCM payloads aligned.
+ */
+
+export const PROTOCOL_VERSION = 1;
+export const HEADER_SIZE = 2;
+
+export const FrameKind = {
+  AUDIO_PCM: 0x01,
+  IMAGE_JPEG: 0x02,
+  IMAGE_PNG: 0x03,
+  AUDIO_PCMU: 0x04, // G.711 mu-law, 8 kHz (audio_codec=pcmu, see mulaw.js)
+};
+
+export const KIND_BY_MIME = {
+  "audio/pcm": FrameKind.AUDIO_PCM,
+  "image/jpeg": FrameKind.IMAGE_JPEG,
+  "image/png": FrameKind.IMAGE_PNG,
+  "audio/pcmu": FrameKind.AUDIO_PCMU,
+};
+
+// Allocates a frame with the header written; the caller fills the payload.
+export function allocateFrame(kind, payloadByteLength) {
+  const frame = new ArrayBuffer(HEADER_SIZE + payloadByteLength);
+  const header = new Uint8Array(frame, 0, HEADER_SIZE);
+  header[0] = kind;
+  header[1] = PROTOCOL_VERSION;
+  return frame;
+}
+
+// Wraps an existing payload (ArrayBuffer or typed array) in a frame.
+export function encodeFrame(kind, payload) {
+  const bytes = payload instanceof ArrayBuffer
+    ? new Uint8Array(payload)
+    : new Uint8Array(payload.buffer, payload.byteOffset, payload.byteLength);
+  const frame = allocateFrame(kind, bytes.byteLength);
+  new Uint8Array(frame, HEADER_SIZE).set(bytes);
+  return frame;
+}
+
+// Returns { kind, payloadOffset } for a received frame, or null if invalid.
+export function decodeFrameHeader(frame) {
+  if (frame.byteLength < HEADER_SIZE) return null;
+  const header = new Uint8Array(frame, 0, HEADER_SIZE);
+  if (header[1] !== PROTOCOL_VERSION) return null;
+  return { kind: header[0], payloadOffset: HEADER_SIZE };
+}
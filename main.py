@@ -1,10 +1,15 @@
 # main.py
 
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import json
 import asyncio
+import logging
 import base64
 from pathlib import Path
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 from google.genai.types import (
@@ -17,32 +22,82 @@ from google.genai import types as genai_types
 from google.adk.runners import Runner
 from google.adk.agents import LiveRequestQueue
 from google.adk.agents.run_config import RunConfig, StreamingMode
-from google.adk.sessions.in_memory_session_service import InMemorySessionService
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
 
 from agents.catalyst_agent import catalyst_agent 
 # from agents.root_agent import root_agent
 
-from tools.sales_tools import session_context
+from tools.sales_tools import session_context, get_cache_stats, initialize_resources, prefetcher, rag
+from tools.batch import run_batch
+from rag.registry import DEFAULT_INDEX
+from server.protocol import FrameError, decode_frame
+from server.outbound import PRIORITY_DEV, InboundRateLimiter, OutboundScheduler
+from server.frames import FramePipeline
+from server import metrics
+from server.sessions import PersistentSessionService, create_session_service
+from server.live_sessions import LiveSession, LiveSessionManager
+from server.recorder import start_recording, stop_recording
 
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger("catalyst")
+
 # --- Application Setup ---
 APP_NAME = "Sales Catalyst"
 STATIC_DIR = Path("frontend/static")
-session_service = InMemorySessionService()
+# Audio codecs a client may request per connection ("pcmu": 8 kHz mu-law, see server/audio.py).
+AUDIO_CODECS = {codec.strip() for codec in os.getenv("AUDIO_CODECS", "pcm,pcmu").split(",")} | {"pcm"}
+BATCH_MAX_RECORDS = int(os.getenv("BATCH_MAX_RECORDS", "1000"))
+# JSON client messages whose `data` is base64 media (decoded once on receipt).
+BASE64_MIME_TYPES = ("audio/pcm", "audio/pcmu", "image/jpeg")
+# Sessions persist in SQLite or Redis (SESSION_BACKEND) so a reconnect can land on any worker.
+session_service = create_session_service()
+live_sessions = LiveSessionManager(
+    session_service,
+    APP_NAME,
+    max_sessions=int(os.getenv("LIVE_MAX_SESSIONS", "200")),
+    idle_seconds=float(os.getenv("LIVE_IDLE_SECONDS", "900")),
+    resume_seconds=float(os.getenv("SESSION_RESUME_SECONDS", "1800")),
+    # Persistent backends expire sessions themselves (SESSION_TTL_SECONDS).
+    expire_sessions=not isinstance(session_service, PersistentSessionService),
+)
+
+# Scrape-time gauges for /metrics.
+for _stat, _help in [
+    ("active_sessions", "Live WebSocket sessions on this worker."),
+    ("active_tasks", "Running per-connection tasks."),
+    ("live_queue_depth", "Requests queued for the model across live sessions."),
+    ("outbound_queued_audio_bytes", "Audio bytes queued for clients."),
+    ("outbound_queued_control", "Control/text messages queued for clients."),
+]:
+    metrics.register_gauges(f"catalyst_{_stat}", _help, lambda stat=_stat: {(): live_sessions.stats().get(stat, 0)})
+metrics.register_gauges(
+    "catalyst_rag_index_bytes", "On-disk size of each loaded knowledge-base index (counted against RAG_INDEX_MEMORY_MB).",
+    lambda: {(name,): index["size_bytes"] for name, index in rag.indexes.stats()["loaded"].items()}, ("index",))
 
-async def start_agent_session(session_id: str, is_audio: bool = False):
-    """Starts an agent session asynchronously."""
-    session = await session_service.create_session(
+async def start_agent_session(session_id: str, websocket: WebSocket, is_audio: bool = False, binary: bool = False,
+                              audio_codec: str = "pcm") -> LiveSession:
+    """Starts an agent session asynchronously, resuming the stored session if there is one."""
+    session = await session_service.get_session(
         app_name=APP_NAME,
         user_id=session_id,
         session_id=session_id,
     )
+    if session is None:
+        session = await session_service.create_session(
+            app_name=APP_NAME,
+            user_id=session_id,
+            session_id=session_id,
+        )
     runner = Runner(
         app_name=APP_NAME,
         agent=catalyst_agent,
@@ -51,7 +106,7 @@ async def start_agent_session(session_id: str, is_audio: bool = False):
     )
 
     if is_audio:
-        print("Starting agent in AUDIO mode.")
+        logger.debug("Starting agent in AUDIO mode.")
         run_config = RunConfig(
             speech_config=genai_types.SpeechConfig(
                 # language_code="en-US",
@@ -78,32 +133,82 @@ async def start_agent_session(session_id: str, is_audio: bool = False):
             input_audio_transcription=genai_types.AudioTranscriptionConfig(),
         )
     else:
-        print("Starting agent in TEXT mode.")
+        logger.debug("Starting agent in TEXT mode.")
         run_config = RunConfig(
             response_modalities=['TEXT'], 
             streaming_mode=StreamingMode.BIDI,
         )
 
+    transcoder = None
+    if audio_codec == "pcmu":
+        from server.audio import AudioTranscoder  # imports numpy; only needed for compressed audio
+        transcoder = AudioTranscoder()
+
     live_request_queue = LiveRequestQueue()
     live_events = runner.run_live(
         session=session,
         live_request_queue=live_request_queue,
         run_config=run_config,
     )
-    return live_events, live_request_queue, session
+    return LiveSession(
+        session_id=session_id,
+        websocket=websocket,
+        runner=runner,
+        live_events=live_events,
+        live_request_queue=live_request_queue,
+        session=session,
+        outbound=OutboundScheduler(
+            websocket,
+            binary=binary,
+            max_audio_buffer_ms=int(os.getenv("OUTBOUND_AUDIO_BUFFER_MS", "5000")),
+            audio_frame_ms=int(os.getenv("OUTBOUND_AUDIO_FRAME_MS", "200")),
+            transcoder=transcoder,
+        ),
+        inbound=InboundRateLimiter(
+            audio_bytes_per_second=float(os.getenv("INBOUND_AUDIO_BYTES_PER_SEC", "64000")),
+            image_fps=float(os.getenv("INBOUND_IMAGE_FPS", "2")),
+            text_per_second=float(os.getenv("INBOUND_TEXT_PER_SEC", "5")),
+        ),
+        frames=FramePipeline(
+            live_request_queue,
+            max_size=int(os.getenv("FRAME_MAX_SIZE", "768")),
+            dedupe_distance=int(os.getenv("FRAME_DEDUPE_DISTANCE", "6")),
+            burst_interval=float(os.getenv("FRAME_BURST_INTERVAL", "0.5")),
+            idle_interval=float(os.getenv("FRAME_IDLE_INTERVAL", "4")),
+        ),
+        audio=transcoder,
+    )
 
-async def agent_to_client_messaging(websocket: WebSocket, live_events, dev_mode: bool = False):
-    """Handles sending messages from the agent to the client websocket."""
-    async for event in live_events:
+async def agent_to_client_messaging(live: LiveSession, dev_mode: bool = False):
+    """Handles sending messages from the agent to the client websocket.
+
+    Messages are handed to the connection's OutboundScheduler (see
+    server/outbound.py), which sends control and text first, then audio
+    (coalesced, as binary frames when negotiated), then dev-mode payloads.
+    """
+    outbound = live.outbound
+    async for event in live.live_events:
+        live.touch()
+        if live.recorder is not None:
+            live.recorder.event(event)
         if event.turn_complete or event.interrupted:
-            await websocket.send_text(json.dumps({
+            if event.interrupted:
+                outbound.interrupt()
+            else:
+                outbound.turn_complete()
+            outbound.send_json({
                 "turn_complete": event.turn_complete, 
                 "interrupted": event.interrupted
-            }))
+            })
             continue
 
         if event.content and event.content.parts:
             author = event.content.role
+            if author == 'user' or event.get_function_calls():
+                # The user is talking or a tool is running: forward camera frames at the burst rate.
+                live.frames.note_activity()
+            if author == 'user':
+                outbound.mark_user_input()
             for part in event.content.parts:
                 if part.text:
                     mime_type = "text/plain"
@@ -112,16 +217,14 @@ async def agent_to_client_messaging(websocket: WebSocket, live_events, dev_mode:
                     elif event.partial:
                         mime_type = "text/transcription"
                     
-                    await websocket.send_text(json.dumps({
+                    outbound.send_json({
                         "mime_type": mime_type,
                         "data": part.text
-                    }))
+                    })
 
                 elif part.inline_data and part.inline_data.mime_type.startswith("audio/"):
-                    await websocket.send_text(json.dumps({
-                        "mime_type": "audio/pcm", 
-                        "data": base64.b64encode(part.inline_data.data).decode("ascii")
-                    }))
+                    outbound.send_audio(part.inline_data.data)
+                    continue
                 
                 # --- NEW DEV MODE LOGIC ADDED ---
                 # This block sends the "behind-the-scenes" tool data to the frontend
@@ -130,13 +233,13 @@ async def agent_to_client_messaging(websocket: WebSocket, live_events, dev_mode:
                     if part.function_call:
                         # Send what tool the agent is GOING to call
                         args_dict = {key: value for key, value in part.function_call.args.items()}
-                        await websocket.send_text(json.dumps({
+                        outbound.send_json({
                             "mime_type": "tool_call",
                             "data": {
                                 "name": part.function_call.name,
                                 "args": args_dict
                             }
-                        }))
+                        }, priority=PRIORITY_DEV)
                     elif part.function_response:
                         # Send the raw JSON data the tool RETURNED
                         response_dict = {}
@@ -144,33 +247,121 @@ async def agent_to_client_messaging(websocket: WebSocket, live_events, dev_mode:
                              for key, value in part.function_response.response.items():
                                 response_dict[key] = value
 
-                        await websocket.send_text(json.dumps({
+                        outbound.send_json({
                             "mime_type": "tool_result",
                             "data": {
                                 "name": part.function_response.name,
                                 "response": response_dict
                             }
-                        }))
+                        }, priority=PRIORITY_DEV)
+
+    # The model stream ended; let the client receive what is still queued.
+    await outbound.drain()
 
-async def client_to_agent_messaging(websocket: WebSocket, live_request_queue: LiveRequestQueue):
+async def client_to_agent_messaging(websocket: WebSocket, live: LiveSession):
     """Handles receiving messages from the client and sending them to the agent."""
+    live_request_queue = live.live_request_queue
     while True:
-        message_json = await websocket.receive_text()
-        message = json.loads(message_json)
+        ws_message = await websocket.receive()
+        if ws_message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(ws_message.get("code", 1000))
+        live.touch()
+
+        # Binary frames carry raw audio/image payloads (see server/protocol.py).
+        frame = ws_message.get("bytes")
+        if frame is not None:
+            metrics.WS_MESSAGES.inc(1, "in", "binary")
+            metrics.WS_BYTES.inc(len(frame), "in", "binary")
+            try:
+                mime_type, payload = decode_frame(frame)
+            except FrameError as e:
+                logger.debug("Dropping malformed binary frame: %s", e)
+                continue
+            if live.recorder is not None:
+                live.recorder.inbound(mime_type, payload)
+            if mime_type == "audio/pcmu":
+                await send_compressed_audio(live, payload)
+                continue
+            if not live.inbound.allow(mime_type, payload.nbytes, live.queue_depth()):
+                continue
+            if mime_type.startswith("image/"):
+                live.frames.submit(payload.tobytes(), mime_type)  # deduplicated/downsized by server/frames.py
+            else:
+                live_request_queue.send_realtime(Blob(data=payload.tobytes(), mime_type=mime_type))
+            continue
+
+        metrics.WS_MESSAGES.inc(1, "in", "text")
+        metrics.WS_BYTES.inc(len(ws_message["text"]), "in", "text")
+        message = json.loads(ws_message["text"])
         mime_type = message.get("mime_type")
         data = message.get("data")
+        # Only the media types handled below are decoded, once; anything else is ignored as before.
+        payload = base64.b64decode(data or "") if mime_type in BASE64_MIME_TYPES else None
+        if live.recorder is not None and (payload is not None or mime_type == "text/plain"):
+            live.recorder.inbound(mime_type, data if payload is None else payload)
+        if mime_type == "audio/pcmu":
+            await send_compressed_audio(live, payload)
+            continue
+        size = len(payload) if payload is not None else len(data) if isinstance(data, str) else 0
+        if mime_type and not live.inbound.allow(mime_type, size, live.queue_depth()):
+            if mime_type == "text/plain":
+                # Tell the user their message was not sent (audio and camera frames are simply superseded).
+                live.outbound.send_json({"mime_type": "text/throttled",
+                                         "data": {"text": data, "retry_after_ms": live.inbound.retry_after_ms(mime_type)}})
+            continue
         
         if mime_type == "text/plain":
+            live.frames.note_activity()
+            live.outbound.mark_user_input()
             live_request_queue.send_content(content=Content(role="user", parts=[Part.from_text(text=data)]))
         
         # --- UPDATED TO HANDLE IMAGES ---
         # Both audio and image frames are sent as realtime binary data.
-        elif mime_type in ["audio/pcm", "image/jpeg"]:
-            live_request_queue.send_realtime(Blob(data=base64.b64decode(data), mime_type=mime_type))
+        elif mime_type == "audio/pcm":
+            live_request_queue.send_realtime(Blob(data=payload, mime_type=mime_type))
+        elif mime_type == "image/jpeg":
+            live.frames.submit(payload, mime_type)
 
+async def send_compressed_audio(live: LiveSession, payload):
+    """Decodes client mu-law to the 16 kHz PCM the model expects (off the event loop, see server/audio.py)."""
+    if live.audio is None:
+        logger.debug("Dropping mu-law audio: compressed audio was not negotiated for this session.")
+        return
+    if not live.inbound.allow("audio/pcm", live.audio.pcm_size(len(payload)), live.queue_depth()):
+        return
+    pcm = await live.audio.decode(payload)
+    live.live_request_queue.send_realtime(Blob(data=pcm, mime_type="audio/pcm"))
+
+
+# --- Startup Lifecycle ---
+startup_report = {"app_import_ms": round((time.perf_counter() - _IMPORT_STARTED) * 1000, 2)}
+
+def _initialize_in_background():
+    """Loads the embedding client and index (plus optional warm-up) and prints a timing report."""
+    started = time.perf_counter()
+    timings = initialize_resources(warm_up=os.getenv("RAG_WARMUP", "1") == "1")
+    startup_report["rag_phases_ms"] = timings
+    startup_report["rag_total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    phases = ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items())
+    logger.info(f"[STARTUP] app import {startup_report['app_import_ms']:.0f} ms; RAG ({rag.state}): {phases}; "
+          f"total {startup_report['rag_total_ms']:.0f} ms")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start accepting connections immediately; heavy RAG resources load off the event loop.
+    # Tool calls that arrive first wait for the same initialization.
+    init_task = asyncio.get_running_loop().run_in_executor(None, _initialize_in_background)
+    live_sessions.start()
+    yield
+    if not init_task.done():
+        init_task.cancel()
+    await live_sessions.shutdown()
+    # Write back any buffered session changes before the worker exits.
+    if hasattr(session_service, "close"):
+        await session_service.close()
 
 # --- FastAPI App Setup ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -185,31 +376,150 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 @app.get("/")
 async def root(): return FileResponse(os.path.join(STATIC_DIR, "index.html"))
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: 200 once the embedding client and default index are loaded, 503 until then
+    (also while "degraded": up, but without the default index). Probes start the retry when due.
+    """
+    if rag.retry_due():
+        asyncio.get_running_loop().run_in_executor(None, rag.initialize)
+    status = rag.status()
+    return JSONResponse(status, status_code=200 if rag.ready else 503)
+
+@app.get("/startup")
+async def startup_timings():
+    """Per-phase startup timing report."""
+    return startup_report
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters and estimated latency saved by the retrieval caches."""
+    return get_cache_stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition: tool/RAG phase latency, turn latency, WebSocket bytes, queue depths."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/indexes")
+async def indexes():
+    """Knowledge-base indexes: available names, loaded ones (size, uses), reloads and LRU evictions."""
+    return rag.indexes.stats()
+
+@app.get("/sessions/stats")
+async def sessions_stats():
+    """Gauges for live sessions, their tasks and queued live requests on this worker."""
+    return live_sessions.stats()
+
+
+class MeetingNotes(BaseModel):
+    """One meeting's notes, as the agent would collect them for get_meeting_recap."""
+    id: str | None = None
+    client_name: str
+    discussion_points: list[str]
+    action_items: list[str]
+    follow_up_date: str
+    product: str | None = None  # the product the invite and email are about (default: the focus product)
+
+
+class BatchRequest(BaseModel):
+    records: list[MeetingNotes]
+
+
+@app.post("/batch/recaps")
+async def batch_recaps(request: BatchRequest, index: str = ""):
+    """
+    Recap, follow-up invite and email for each record (tools/batch.py), streamed as NDJSON in
+    completion order: one line per record with its `index`, then {"done": true, ...}.
+    """
+    if index and not rag.indexes.exists(index):
+        return JSONResponse({"error": f"Unknown knowledge base '{index}'"}, status_code=404)
+    if len(request.records) > BATCH_MAX_RECORDS:
+        return JSONResponse({"error": f"At most {BATCH_MAX_RECORDS} records per batch"}, status_code=413)
+    records = [record.model_dump() for record in request.records]
+
+    async def lines():
+        started, failed = time.perf_counter(), 0
+        async for result in run_batch(records, index or DEFAULT_INDEX):
+            failed += result["status"] != "success"
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"done": True, "records": len(records), "failed": failed,
+                          "seconds": round(time.perf_counter() - started, 2)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 
 @app.websocket("/ws/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str, is_audio: bool = False, dev_mode: bool = False):
-    """Handles the WebSocket connection for a client session."""
+async def websocket_endpoint(websocket: WebSocket, session_id: str, is_audio: bool = False, dev_mode: bool = False, binary: bool = False,
+                             index: str = "", audio_codec: str = "pcm"):
+    """
+    Handles the WebSocket connection for a client session. `index` selects the knowledge base
+    (default: faiss_index); `audio_codec=pcmu` requests compressed audio (server/audio.py).
+    """
     await websocket.accept()
-    print(f"Client #{session_id} connected. Audio mode: {is_audio}, Dev mode: {dev_mode}")
+    if index and not rag.indexes.exists(index):
+        logger.warning("Rejecting client #%s: unknown knowledge base '%s'.", session_id, index)
+        await websocket.close(code=1008, reason=f"Unknown knowledge base '{index}'")
+        return
+    if not await live_sessions.admit(session_id):
+        logger.warning("Rejecting client #%s: %d live sessions already open.", session_id, live_sessions.max_sessions)
+        await websocket.close(code=1013, reason="Server is at capacity, try again later")
+        return
+    # Compressed audio falls back to PCM when this deployment does not allow it (AUDIO_CODECS).
+    if audio_codec not in AUDIO_CODECS:
+        audio_codec = "pcm"
+    logger.info("Client #%s connected. Audio mode: %s, Dev mode: %s, Binary: %s, Audio codec: %s",
+                session_id, is_audio, dev_mode, binary, audio_codec)
+    live = None
 
     async def run_tasks_with_context():
-        live_events, live_request_queue, session_object = await start_agent_session(session_id, is_audio)
-        session_context.set(session_object)
+        nonlocal live
+        live = await start_agent_session(session_id, websocket, is_audio, binary, audio_codec)
+        live_sessions.register(live)
+        # Opt-in (SESSION_RECORDING=1): frames, model events and tool calls for bench/replay.py.
+        live.recorder = start_recording(session_id, is_audio=is_audio, binary=binary, audio_codec=audio_codec,
+                                        index=index or None)
+        # Tells the client which codec to send and expect (sent before any audio).
+        live.outbound.send_json({"mime_type": "audio/config", "data": {"codec": audio_codec}})
+        session_context.set(live.session)
+        if index:
+            # The retrieval tools search the knowledge base selected for this session (see rag/registry.py).
+            live.session.state["knowledge_base"] = index
         
-        tasks = [
-            asyncio.create_task(agent_to_client_messaging(websocket, live_events, dev_mode)),
-            asyncio.create_task(client_to_agent_messaging(websocket, live_request_queue)),
+        live.tasks = [
+            asyncio.create_task(agent_to_client_messaging(live, dev_mode)),
+            asyncio.create_task(live.outbound.run()),
+            asyncio.create_task(live.frames.run()),
+            asyncio.create_task(client_to_agent_messaging(websocket, live)),
         ]
-        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-        
-        for task in pending:
-            task.cancel()
+        done, pending = await asyncio.wait(live.tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled():
+                task.result()  # re-raises WebSocketDisconnect or the task's error
 
     try:
         await run_tasks_with_context()
     except WebSocketDisconnect:
-        print(f"Client #{session_id} disconnected cleanly.")
+        logger.info("Client #%s disconnected cleanly.", session_id)
     except Exception as e:
-        print(f"An error occurred in the websocket endpoint for client #{session_id}: {e}")
+        logger.exception("An error occurred in the websocket endpoint for client #%s: %s", session_id, e)
     finally:
-        print(f"Connection for client #{session_id} closed.")
+        # Cancel this session's speculative tool calls, unless a reconnect superseded this
+        # connection: the prefetches for the ID then belong to the new connection.
+        if live_sessions.is_current(session_id, live):
+            prefetcher.drop_session(session_id)
+        if live is not None:
+            stop_recording(live.recorder)
+        # Closes the live queue, awaits the cancelled tasks and closes the runner
+        # (shielded, so cleanup completes even if this handler is being cancelled).
+        if live is not None:
+            await asyncio.shield(live_sessions.close(live))
+        else:
+            live_sessions.release(session_id)
+        logger.debug("Connection for client #%s closed.", session_id)
@@ -0,0 +1 @@
+# rag/__init__.py
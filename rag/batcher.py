@@ -0,0 +1,130 @@
+# rag/batcher.py
+
+"""
+Micro-batching in front of the retrieval pipeline.
+
+When many reps ask for the same briefing at once, every tool call used to
+embed and search on its own. RetrievalBatcher collects the retrievals that
+arrive within `window_ms` of each other (or until `max_batch` distinct queries
+are waiting) and hands them to one blocking `run_batch(requests)` call on the
+tool executor:
+
+    * identical queries (same tool, same normalized text) are single-flighted:
+      one computation, every caller awaits the same future;
+    * distinct queries are embedded in one batched provider call and searched
+      with one matrix search (see RetrievalPipeline.search_batch).
+
+A caller that is cancelled (e.g. its session disconnected) stops waiting but
+never cancels the shared computation other callers depend on.
+
+The executor queue wait and execution time are measured once per batch and
+added to every waiter's timing dict (the `timing` context variable, see
+time_tool), so per-tool queue-wait metrics still cover batched retrievals.
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+
+from rag.keys import normalize_query
+from server.metrics import RAG_BATCH_SIZE, RAG_COALESCED
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalBatcher:
+    """Coalesces concurrent (tool_name, query) retrievals into batched calls."""
+
+    def __init__(self, run_batch, run=None, window_ms: float = 3.0, max_batch: int = 32,
+                 timing: contextvars.ContextVar | None = None):
+        self.run_batch = run_batch  # blocking: list[(tool_name, query)] -> list[result]
+        self.run = run  # async run(func, *args) on an executor; defaults to the loop's executor
+        self.timing = timing  # caller's {"queue_wait_ms", "execution_ms"} dict, if any
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+        self._pending: list[tuple[tuple[str, str], str, str]] = []
+        self._flush_handle = None
+        self.counters = {"requests": 0, "coalesced": 0, "batches": 0, "batched_queries": 0,
+                         "max_batch_size": 0, "errors": 0}
+
+    async def retrieve(self, tool_name: str, query: str):
+        """Returns the retrieval result for `query`, sharing work with concurrent callers."""
+        loop = asyncio.get_running_loop()
+        key = (tool_name, normalize_query(query))
+        self.counters["requests"] += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
+            RAG_COALESCED.inc()
+        else:
+            future = self._inflight[key] = loop.create_future()
+            self._pending.append((key, tool_name, query))
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.window, self._flush)
+        result, batch_timing = await asyncio.shield(future)
+        caller_timing = self.timing.get() if self.timing is not None else None
+        if caller_timing is not None:
+            for name, ms in batch_timing.items():
+                caller_timing[name] = caller_timing.get(name, 0.0) + ms
+        return result
+
+    def stats(self) -> dict:
+        batches = self.counters["batches"]
+        return {
+            **self.counters,
+            "avg_batch_size": round(self.counters["batched_queries"] / batches, 2) if batches else 0.0,
+            "inflight": len(self._inflight),
+        }
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # A fresh context: the batch serves many callers, so it must not inherit
+            # (and report its timings into) the context of whichever one triggered it.
+            contextvars.Context().run(asyncio.get_running_loop().create_task, self._execute(batch))
+
+    async def _execute(self, batch: list[tuple[tuple[str, str], str, str]]):
+        self.counters["batches"] += 1
+        self.counters["batched_queries"] += len(batch)
+        self.counters["max_batch_size"] = max(self.counters["max_batch_size"], len(batch))
+        RAG_BATCH_SIZE.observe(len(batch))
+        requests = [(tool_name, query) for _, tool_name, query in batch]
+        timing = {"queue_wait_ms": 0.0, "execution_ms": 0.0}
+        submitted_at = time.perf_counter()
+
+        def run_batch(requests):
+            started_at = time.perf_counter()
+            try:
+                return self.run_batch(requests)
+            finally:
+                timing["queue_wait_ms"] = (started_at - submitted_at) * 1000
+                timing["execution_ms"] = (time.perf_counter() - started_at) * 1000
+
+        try:
+            if self.run is not None:
+                results = await self.run(run_batch, requests)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(None, run_batch, requests)
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batched retrieval returned {len(results)} results for {len(batch)} queries.")
+            for (key, _, _), result in zip(batch, results):
+                self._inflight.pop(key).set_result((result, timing))
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning("Batched retrieval of %d queries failed: %s", len(batch), e)
+            for key, _, _ in batch:
+                future = self._inflight.pop(key, None)
+                if future is not None:
+                    future.set_exception(e)
+        finally:
+            for key, _, _ in batch:  # only left over when this task itself was cancelled
+                future = self._inflight.pop(key, None)
+                if future is not None:
+                    future.cancel()
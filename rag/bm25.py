@@ -0,0 +1,90 @@
+# rag/bm25.py
+
+"""
+Sparse BM25 index built alongside the vector index.
+
+Embeddings handle exact product codes ("ESB 5100") and competitor SKUs poorly,
+so the tokenizer also emits letter+digit joins ("esb5100") to make such codes
+match regardless of spacing or hyphenation in the query.
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+
+BM25_FILE = "bm25.json"
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or our that the their this to was were with "
+    "provide detailed".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens plus joined letter/digit pairs for product codes."""
+    words = _TOKEN.findall(text.lower())
+    tokens = [word for word in words if word not in _STOPWORDS]
+    for first, second in zip(words, words[1:]):
+        if first.isalpha() != second.isalpha() and (first.isdigit() or second.isdigit()):
+            tokens.append(first + second)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over chunk texts, addressed by chunk ID."""
+
+    def __init__(self, chunk_ids: list[str], doc_lengths: list[int], postings: dict[str, list[list[int]]],
+                 k1: float = 1.5, b: float = 0.75):
+        self.chunk_ids = chunk_ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        count = len(chunk_ids)
+        self.idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+
+    @classmethod
+    def build(cls, records) -> "BM25Index":
+        """Builds from an iterable of (chunk_id, text) pairs."""
+        chunk_ids, doc_lengths, postings = [], [], {}
+        for doc_index, (chunk_id, text) in enumerate(records):
+            tokens = tokenize(text)
+            chunk_ids.append(chunk_id)
+            doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings.setdefault(term, []).append([doc_index, frequency])
+        return cls(chunk_ids, doc_lengths, postings)
+
+    def search(self, query: str, k: int = 20) -> list[tuple[str, float]]:
+        """Returns up to `k` (chunk_id, score) pairs, best first."""
+        scores = Counter()
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_index, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / (self.avg_length or 1))
+                scores[doc_index] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return [(self.chunk_ids[doc_index], score) for doc_index, score in scores.most_common(k)]
+
+    def save(self, index_path: str):
+        tmp_path = os.path.join(index_path, BM25_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"chunk_ids": self.chunk_ids, "doc_lengths": self.doc_lengths,
+                       "postings": self.postings, "k1": self.k1, "b": self.b}, f, separators=(",", ":"))
+        os.replace(tmp_path, os.path.join(index_path, BM25_FILE))
+
+    @classmethod
+    def load(cls, index_path: str) -> "BM25Index | None":
+        try:
+            with open(os.path.join(index_path, BM25_FILE)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(data["chunk_ids"], data["doc_lengths"], data["postings"], data["k1"], data["b"])
@@ -0,0 +1,314 @@
+# rag/cache.py
+
+"""
+Tiered caching in front of the retriever.
+
+* RetrievalCache: exact-match LRU/TTL cache keyed on normalized query text,
+  with an optional semantic tier that serves a cached result when a new query
+  embedding is within a cosine-similarity threshold of a cached one.
+* CachedEmbeddings: wraps any LangChain embeddings model so the same string
+  is never sent to the remote embedding endpoint twice. An optional
+  persistent store (see rag/embeddings.py) backs the in-process LRU.
+
+Both expose hit/miss counters and an estimate of the latency saved.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag.keys import directory_fingerprint, normalize_query
+
+
+def cache_key(namespace: str, query: str) -> str:
+    return f"{namespace}\x00{normalize_query(query)}"
+
+
+class CacheStats:
+    """Hit/miss counters with an estimate of the latency saved by hits."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.miss_latency_ms = 0.0
+        self.saved_latency_ms = 0.0
+
+    def record_hit(self, count: int = 1):
+        self.hits += count
+        if self.misses:
+            self.saved_latency_ms += count * self.miss_latency_ms / self.misses
+
+    def record_miss(self, latency_ms: float, count: int = 1):
+        self.misses += count
+        self.miss_latency_ms += latency_ms
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "avg_miss_latency_ms": round(self.miss_latency_ms / self.misses, 2) if self.misses else 0.0,
+            "saved_latency_ms": round(self.saved_latency_ms, 2),
+        }
+
+
+class _Entry:
+    __slots__ = ("value", "vector", "expires_at")
+
+    def __init__(self, value, vector, expires_at):
+        self.value = value
+        self.vector = vector
+        self.expires_at = expires_at
+
+
+class RetrievalCache:
+    """Exact + semantic result cache, invalidated when `watch_dir` changes."""
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_seconds: float = 600.0,
+        semantic_threshold: float | None = None,
+        watch_dir: str | None = None,
+        check_interval: float = 5.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self.watch_dir = watch_dir
+        self.check_interval = check_interval
+        self.exact_stats = CacheStats()
+        self.semantic_stats = CacheStats()
+        self.invalidations = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._matrix = None  # Stacked vectors for the semantic tier, rebuilt lazily.
+        self._matrix_keys: list[str] = []
+        self._lock = threading.Lock()
+        self._fingerprint = directory_fingerprint(watch_dir) if watch_dir else None
+        self._next_check = time.monotonic() + check_interval
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold is not None
+
+    def get_or_compute(self, query: str, compute, embed=None, namespace: str = ""):
+        """
+        Returns the cached result for `query`, or calls `compute()` and caches it.
+        `embed(query)` is only used when the semantic tier is enabled. Entries in
+        different namespaces (e.g. tools with different filters) never match each other.
+        """
+        key = cache_key(namespace, query)
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        vector = None
+        if self.semantic_enabled and embed is not None:
+            vector = _unit(embed(query))
+            value = self.get_semantic(vector, namespace)
+            if value is not None:
+                self.put(key, value, vector)
+                return value
+
+        start_time = time.perf_counter()
+        value = compute()
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        with self._lock:
+            self.exact_stats.record_miss(latency_ms)
+            if self.semantic_enabled:
+                self.semantic_stats.record_miss(latency_ms)
+        self.put(key, value, vector)
+        return value
+
+    def get_or_compute_many(self, items: list[tuple[str, str]], compute_many, embed_many=None) -> list:
+        """
+        Batched get_or_compute over (namespace, query) pairs. The pairs that miss
+        both tiers are passed to `compute_many(pairs)` in one call, which must
+        return their results in the same order.
+        """
+        keys = [cache_key(namespace, query) for namespace, query in items]
+        values = [self.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        vectors = {}
+        if missing and self.semantic_enabled and embed_many is not None:
+            for i, vector in zip(missing, embed_many([items[i][1] for i in missing])):
+                vectors[i] = _unit(vector)
+                values[i] = self.get_semantic(vectors[i], items[i][0])
+                if values[i] is not None:
+                    self.put(keys[i], values[i], vectors[i])
+            missing = [i for i in missing if values[i] is None]
+        if not missing:
+            return values
+
+        start_time = time.perf_counter()
+        computed = compute_many([items[i] for i in missing])
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        with self._lock:
+            self.exact_stats.record_miss(latency_ms, count=len(missing))
+            if self.semantic_enabled:
+                self.semantic_stats.record_miss(latency_ms, count=len(missing))
+        for i, value in zip(missing, computed):
+            values[i] = value
+            self.put(keys[i], value, vectors.get(i))
+        return values
+
+    def get(self, key: str):
+        """Exact-match lookup on an already normalized key."""
+        with self._lock:
+            self._check_invalidation()
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.exact_stats.record_hit()
+            return entry.value
+
+    def get_semantic(self, vector, namespace: str = ""):
+        """Returns the value of the most similar cached query in `namespace` above the threshold."""
+        with self._lock:
+            if not self._entries:
+                return None
+            if self._matrix is None:
+                self._rebuild_matrix()
+            if not self._matrix_keys:
+                return None
+            prefix = f"{namespace}\x00"
+            scores = np.where([key.startswith(prefix) for key in self._matrix_keys], self._matrix @ vector, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] < self.semantic_threshold:
+                return None
+            entry = self._entries.get(self._matrix_keys[best])
+            if entry is None or entry.expires_at < time.monotonic():
+                return None
+            self.semantic_stats.record_hit()
+            return entry.value
+
+    def put(self, key: str, value, vector=None):
+        with self._lock:
+            self._entries[key] = _Entry(value, vector, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "invalidations": self.invalidations,
+                "exact": self.exact_stats.as_dict(),
+                "semantic": self.semantic_stats.as_dict() if self.semantic_enabled else None,
+            }
+
+    def _rebuild_matrix(self):
+        now = time.monotonic()
+        live = [(key, entry.vector) for key, entry in self._entries.items()
+                if entry.vector is not None and entry.expires_at >= now]
+        self._matrix_keys = [key for key, _ in live]
+        self._matrix = np.vstack([vector for _, vector in live]) if live else np.empty((0, 0))
+
+    def _check_invalidation(self):
+        if self.watch_dir is None or time.monotonic() < self._next_check:
+            return
+        self._next_check = time.monotonic() + self.check_interval
+        fingerprint = directory_fingerprint(self.watch_dir)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._entries.clear()
+            self._matrix = None
+            self.invalidations += 1
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    In-process LRU cache around an embeddings model, optionally backed by a
+    persistent store. Query and document embeddings are cached separately
+    since some models (e.g. Vertex) embed them with different task types.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries: int = 4096,
+                 model_id: str | None = None, store=None):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.model_id = model_id or type(embeddings).__name__
+        self.store = store
+        self.stats_ = CacheStats()
+        self.store_hits = 0
+        self._vectors: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed("query", [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed("document", texts, self.embeddings.embed_documents)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Embeds several queries; the uncached ones go to the provider in one batched call when supported."""
+        return self._embed("query", texts, self._compute_queries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"model": self.model_id, "entries": len(self._vectors),
+                    "store_hits": self.store_hits, **self.stats_.as_dict()}
+
+    def _embed(self, kind: str, texts: list[str], compute) -> list[list[float]]:
+        with self._lock:
+            vectors = [self._lookup((kind, text)) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if not missing:
+            return vectors
+
+        store_model = f"{self.model_id}:{kind}"
+        found = self.store.get_many(store_model, missing) if self.store else {}
+        to_compute = [text for text in missing if text not in found]
+        computed = {}
+        if to_compute:
+            start_time = time.perf_counter()
+            computed = dict(zip(to_compute, compute(to_compute)))
+            latency_ms = (time.perf_counter() - start_time) * 1000
+            if self.store:
+                self.store.put_many(store_model, computed)
+        with self._lock:
+            if to_compute:
+                self.stats_.record_miss(latency_ms, count=len(to_compute))
+            if found:
+                self.stats_.record_hit(len(found))
+                self.store_hits += len(found)
+            for text, vector in {**found, **computed}.items():
+                self._store((kind, text), vector)
+        resolved = {**found, **computed}
+        return [vector if vector is not None else resolved[text] for text, vector in zip(texts, vectors)]
+
+    def _compute_queries(self, texts: list[str]) -> list[list[float]]:
+        embed_queries = getattr(self.embeddings, "embed_queries", None)
+        if embed_queries is not None:
+            return embed_queries(texts)
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    def _lookup(self, key: tuple[str, str]):
+        vector = self._vectors.get(key)
+        if vector is not None:
+            self._vectors.move_to_end(key)
+            self.stats_.record_hit()
+        return vector
+
+    def _store(self, key: tuple[str, str], vector: list[float]):
+        self._vectors[key] = vector
+        while len(self._vectors) > self.max_entries:
+            self._vectors.popitem(last=False)
+
+
+def _unit(vector) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
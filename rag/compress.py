@@ -0,0 +1,146 @@
+# rag/compress.py
+
+"""
+Response shaping for the retrieval tools.
+
+Returning three ~1000-character chunks verbatim pushes thousands of tokens
+into the live model's context on every tool call, and neighbouring chunks
+repeat the text they overlap on. `compress()` turns the retrieved passages
+into a short list of facts:
+
+    1. passages are split into sentences (and "Label: value" lines);
+    2. sentences already contained in another one, "Label: value" lines
+       repeating another line's value, headings and the text cut off at the
+       end of a chunk are dropped - this removes the chunk overlap;
+    3. sentences are scored by IDF-weighted overlap with the query, a prior
+       for the passage's retrieval rank and a bonus for "Label: value" facts;
+    4. the best sentences are kept until the tool's token budget is spent and
+       returned in document order, with the sources they came from.
+
+Token counts are estimated at ~4 characters per token.
+"""
+
+import math
+import os
+import re
+
+from rag.bm25 import tokenize
+
+# Approximate token budget of the facts returned by each tool (RAG_TOKEN_BUDGET overrides all).
+TOOL_TOKEN_BUDGETS = {
+    "get_meeting_briefing": 300,
+    "get_competitor_comparison": 350,
+    "get_product_information": 250,
+}
+DEFAULT_TOKEN_BUDGET = 250
+CHARS_PER_TOKEN = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+_LABELLED = re.compile(r"^[A-Z][\w ()/&-]{1,40}:\s+\S")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+MIN_SENTENCE_CHARS = 12
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, round(len(text) / CHARS_PER_TOKEN))
+
+
+def token_budget(tool_name: str) -> int:
+    override = os.getenv("RAG_TOKEN_BUDGET")
+    return int(override) if override else TOOL_TOKEN_BUDGETS.get(tool_name, DEFAULT_TOKEN_BUDGET)
+
+
+def split_sentences(text: str) -> list[str]:
+    sentences = []
+    for line in text.splitlines():
+        for sentence in _SENTENCE_END.split(line.strip()):
+            sentence = sentence.strip()
+            if len(sentence) >= MIN_SENTENCE_CHARS:
+                sentences.append(sentence)
+    return sentences
+
+
+def _key(sentence: str) -> str:
+    return _NON_WORD.sub(" ", sentence.lower()).strip()
+
+
+def _complete(sentence: str) -> bool:
+    return sentence[-1] in ".!?)\"'" or bool(_LABELLED.match(sentence))
+
+
+def _informative(sentence: str) -> bool:
+    """False for headings ("Key Differentiators:", "Client Meeting Briefings")."""
+    if _LABELLED.match(sentence):
+        return True
+    return not sentence.endswith(":") and (sentence[-1] in ".!?" or len(sentence.split()) >= 6)
+
+
+def source_of(metadata: dict) -> dict:
+    """The citation fields of a chunk: file name, page (when known) and chunk ID."""
+    source = {"source": os.path.basename(str(metadata.get("source") or "")) or None, "page": metadata.get("page")}
+    if metadata.get("chunk_id"):
+        source["chunk_id"] = metadata["chunk_id"]
+    return {key: value for key, value in source.items() if value is not None}
+
+
+def compress(query: str, passages: list[tuple[str, dict]], budget: int) -> dict:
+    """
+    Selects the sentences of `passages` ((text, metadata) pairs in retrieval
+    order) most relevant to `query`, within `budget` tokens. Returns facts,
+    the sources they came from, and the token counts before and after.
+    """
+    candidates = []  # (passage rank, position, sentence)
+    for rank, (text, _) in enumerate(passages):
+        sentences = split_sentences(text)
+        if len(sentences) > 1 and not _complete(sentences[-1]):
+            sentences.pop()  # cut off by the chunk splitter
+        candidates += [(rank, position, sentence) for position, sentence in enumerate(sentences)
+                       if _informative(sentence)]
+    original_tokens = sum(estimate_tokens(text) for text, _ in passages)
+    if not candidates:
+        return {"facts": [], "sources": [], "tokens": 0, "original_tokens": original_tokens}
+
+    # Drop sentences contained in a longer (or identical, earlier) one: chunk overlap and cut-off fragments.
+    keys = [_key(sentence) for _, _, sentence in candidates]
+    values = [_key(sentence.split(":", 1)[1]) if _LABELLED.match(sentence) else None for _, _, sentence in candidates]
+    kept: list[int] = []
+    for index in sorted(range(len(candidates)), key=lambda i: (-len(keys[i]), i)):
+        if keys[index] and not any(keys[index] in keys[other] or (values[index] and values[index] == values[other])
+                                   for other in kept):
+            kept.append(index)
+
+    terms = [set(tokenize(candidates[index][2])) for index in kept]
+    document_frequency = {}
+    for sentence_terms in terms:
+        for term in sentence_terms:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    query_terms = set(tokenize(query))
+    scored = []
+    for index, sentence_terms in zip(kept, terms):
+        rank, _, sentence = candidates[index]
+        overlap = sum(math.log(1 + len(kept) / document_frequency[term]) for term in query_terms & sentence_terms)
+        score = overlap / math.sqrt(len(sentence_terms) + 1) + 0.3 / (1 + rank)
+        if _LABELLED.match(sentence):
+            score += 0.2
+        scored.append((score, index))
+
+    selected, used = [], 0
+    for _, index in sorted(scored, key=lambda item: item[0], reverse=True):
+        cost = estimate_tokens(candidates[index][2])
+        if used + cost <= budget:
+            selected.append(index)
+            used += cost
+    if not selected:  # even the best sentence is over budget: truncate it
+        _, best = max(scored)
+        rank, position, sentence = candidates[best]
+        candidates[best] = (rank, position, sentence[:budget * CHARS_PER_TOKEN].rsplit(" ", 1)[0] + "...")
+        selected, used = [best], budget
+
+    selected.sort(key=lambda index: candidates[index][:2])
+    sources = {}
+    for rank in dict.fromkeys(candidates[index][0] for index in selected):
+        source = source_of(passages[rank][1])
+        identity = (source["source"], source.get("page")) if "source" in source else source.get("chunk_id")
+        sources.setdefault(identity, source)
+    return {"facts": [candidates[index][2] for index in selected], "sources": list(sources.values()),
+            "tokens": used, "original_tokens": original_tokens}
@@ -0,0 +1,165 @@
+# rag/embeddings.py
+
+"""
+Embedding providers selected by configuration.
+
+* vertex  - Vertex AI text embeddings (default, needs credentials and network)
+* local   - a sentence-transformers model running on CPU
+* hashing - a deterministic feature-hashing embedder for tests and benchmarks
+
+Every provider is wrapped in CachedEmbeddings, backed by an optional on-disk
+SQLite cache keyed by (model, text hash), and shared by the index builder and
+the retriever.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag.cache import CachedEmbeddings
+
+DEFAULT_MODELS = {
+    "vertex": "text-embedding-005",
+    "local": "sentence-transformers/all-MiniLM-L6-v2",
+    "hashing": "hashing-384",
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic signed feature hashing over word unigrams and bigrams."""
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def _embed(self, text: str) -> list[float]:
+        tokens = _TOKEN.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in features:
+            h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vector[h % self.dimensions] += 1.0 if h >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+class LocalEmbeddings(Embeddings):
+    """A sentence-transformers model on CPU (optional dependency)."""
+
+    def __init__(self, model_name: str, batch_size: int = 32):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "EMBEDDING_PROVIDER=local requires sentence-transformers: pip install sentence-transformers"
+            ) from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+
+class VertexEmbeddings(Embeddings):
+    """Vertex AI text embeddings with a batched query call (one request for many queries)."""
+
+    def __init__(self, model_name: str):
+        from langchain_google_vertexai import VertexAIEmbeddings
+        self.client = VertexAIEmbeddings(model_name=model_name)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.client.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.client.embed_query(text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self.client.embed(texts, embeddings_task_type="RETRIEVAL_QUERY")
+
+
+class PersistentEmbeddingCache:
+    """SQLite-backed embedding cache keyed by (model, kind, sha256(text))."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get_many(self, model: str, texts: list[str]) -> dict[str, list[float]]:
+        hashes = {self.text_hash(text): text for text in texts}
+        found = {}
+        with self._lock:
+            keys = list(hashes)
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[hashes[text_hash]] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, vectors: dict[str, list[float]]):
+        rows = [(model, self.text_hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+                for text, vector in vectors.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+
+def create_embeddings(provider: str | None = None, model: str | None = None,
+                      cache_path: str | None = None) -> CachedEmbeddings:
+    """
+    Builds the configured embedding provider. Defaults come from the
+    EMBEDDING_PROVIDER, EMBEDDING_MODEL and EMBEDDING_CACHE_PATH env vars.
+    """
+    provider = (provider or os.getenv("EMBEDDING_PROVIDER", "vertex")).lower()
+    if provider not in DEFAULT_MODELS:
+        raise ValueError(f"Unknown EMBEDDING_PROVIDER '{provider}'. Expected one of: {', '.join(DEFAULT_MODELS)}")
+    model = model or os.getenv("EMBEDDING_MODEL") or DEFAULT_MODELS[provider]
+    if cache_path is None:
+        cache_path = os.getenv("EMBEDDING_CACHE_PATH", ".embedding_cache.sqlite")
+
+    if provider == "vertex":
+        inner = VertexEmbeddings(model)
+    elif provider == "local":
+        inner = LocalEmbeddings(model)
+    else:
+        dimensions = int(model.rsplit("-", 1)[-1]) if model.rsplit("-", 1)[-1].isdigit() else 384
+        inner = HashingEmbeddings(dimensions)
+
+    store = PersistentEmbeddingCache(cache_path) if cache_path else None
+    return CachedEmbeddings(inner, model_id=f"{provider}:{model}", store=store)
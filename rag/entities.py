@@ -0,0 +1,356 @@
+# rag/entities.py
+
+"""
+Fuzzy resolution of client, contact and product names.
+
+Speech recognition garbles proper nouns ("Olta", "Walter", "Ulta" for Volta
+Motors), and the model passes whatever it heard to the tools. EntityIndex maps
+such a name to a known entity in well under a millisecond, before retrieval:
+
+    * candidates come from a character-trigram inverted index and an exact
+      phonetic-key index, so lookups stay cheap with thousands of accounts;
+    * each candidate is scored on trigram overlap, edit distance and the edit
+      distance of phonetic codes, comparing distinctive parts only ("volta"
+      for "Volta Motors"), so a shared "Motors" or "Industries" never counts;
+    * a shorter name whose words all match words of a known name (each
+      exactly or as a prefix: "ESB 5100" for "Loctite ESB 5100") scores high
+      too, so common shorthand resolves;
+    * a match must clear `threshold` and beat the runner-up by `margin`,
+      otherwise the name is left as heard.
+
+The index is built by create_index.py from the names declared in the
+documents ("Client Name:", "Product Name:", "Key Contacts:") plus an optional
+CRM export CSV, and saved as entities.json in the index directory. The build
+checks that the known ASR variants (KNOWN_ALIASES) of names in the index
+still resolve, and reports the ones that do not.
+
+CRM export columns (header row required; only account_name is mandatory):
+
+    account_name,contact_name,contact_email,contact_role
+"""
+
+import csv
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+
+from rag.keys import normalize_query
+from rag.materialize import ENTITY_PATTERNS, find_entities
+
+ENTITIES_FILE = "entities.json"
+ENTITIES_VERSION = 1
+KINDS = ("client", "contact", "product")
+
+# Words that do not distinguish one account from another.
+GENERIC_WORDS = {"motors", "motor", "inc", "corp", "corporation", "co", "company", "gmbh", "ag", "ltd", "llc",
+                 "group", "industries", "automotive", "systems", "technologies", "the"}
+
+_WORD = re.compile(r"[a-z0-9]+")
+_CONTACTS = re.compile(r"^\s*Key Contacts:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE)
+_CONTACT = re.compile(r"\s*([^,(]+?)\s*(?:\(([^)]*)\))?\s*(?:,|$)")
+
+# Sound classes: letters that ASR confuses map to the same symbol. Vowels, h, w
+# and y only count at the start of a word, where they collapse into "A".
+_SOUND_CLASSES = {
+    **dict.fromkeys("bp", "P"), **dict.fromkeys("fv", "F"), **dict.fromkeys("cgkqx", "K"),
+    **dict.fromkeys("sz", "S"), **dict.fromkeys("dt", "T"), **dict.fromkeys("mn", "N"),
+    "l": "L", "r": "R", "j": "J",
+}
+_WEAK_ONSETS = {"A", "F"}  # a leading vowel or v/w/f is often dropped or swapped by ASR
+
+# Misrecognitions seen in live sessions; the agent instruction used to list these.
+KNOWN_ALIASES = {
+    ("client", "Volta Motors"): ["Olta", "Walter", "Olda", "Ulta", "Walta", "Walter Motors"],
+    ("product", "Loctite ESB 5100"): ["ESB 5100", "Loctite ESB", "Loctite 5100"],
+}
+
+
+@dataclass
+class Entity:
+    kind: str  # client | contact | product
+    name: str
+    account: str | None = None  # the client a contact belongs to
+    email: str | None = None
+    role: str | None = None
+
+
+@dataclass
+class Resolution:
+    entity: Entity
+    score: float
+    exact: bool
+
+
+def phonetic_code(word: str) -> str:
+    """
+    Coarse phonetic code of one word, without its (often misheard) onset or a
+    final r after a vowel ("Walter" and "Volta" both code as "LT").
+    """
+    code = []
+    for index, char in enumerate(word):
+        if char.isdigit():
+            symbol = char
+        elif char in "aeiouhwy":
+            if index > 0:
+                continue
+            symbol = "F" if char == "w" else "A"
+        elif char == "p" and word[index + 1:index + 2] == "h":
+            symbol = "F"
+        else:
+            symbol = _SOUND_CLASSES.get(char, "")
+        if symbol and (not code or code[-1] != symbol):
+            code.append(symbol)
+    if len(code) > 1 and code[-1] == "R" and len(word) > 2 and word[-2] in "aeiouy" and word[-1] == "r":
+        code = code[:-1]
+    if len(code) > 1 and code[0] in _WEAK_ONSETS:
+        code = code[1:]
+    return "".join(code)
+
+
+def phonetic_key(text: str) -> str:
+    return " ".join(phonetic_code(word) for word in _WORD.findall(text.lower()))
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance (two-row dynamic programming)."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def _similarity(a: str, b: str) -> float:
+    longest = max(len(a), len(b))
+    return 1.0 - edit_distance(a, b) / longest if longest else 1.0
+
+
+def key_form(name: str) -> str:
+    """The normalized name without generic words ("volta" for "Volta Motors"), if anything is left."""
+    full = " ".join(_WORD.findall(name.lower()))
+    return " ".join(word for word in full.split() if word not in GENERIC_WORDS) or full
+
+
+def respelled(text: str) -> str:
+    """
+    The name as ASR often hears it the other way round: a leading w as v and
+    a final "er" as "a" ("walter" -> "valta"), scored as a second spelling.
+    """
+    words = []
+    for word in text.split():
+        if len(word) > 3 and word.endswith("er"):
+            word = word[:-2] + "a"
+        if word.startswith("w"):
+            word = "v" + word[1:]
+        words.append(word)
+    return " ".join(words)
+
+
+def _partial_match(query_words: list[str], words: list[str]) -> float:
+    """
+    How well a shorter name matches part of a longer one: every query word must
+    equal, or be a prefix (3+ characters) of, a distinct word of the name.
+    """
+    if not query_words or len(query_words) >= len(words):
+        return 0.0
+    remaining = list(words)
+    for word in query_words:
+        match = next((other for other in remaining
+                      if other == word or (len(word) >= 3 and other.startswith(word))), None)
+        if match is None:
+            return 0.0
+        remaining.remove(match)
+    return 0.9
+
+
+class _Form:
+    __slots__ = ("text", "trigrams", "phonetic", "words")
+
+    def __init__(self, text: str, full: str | None = None):
+        self.text = text
+        self.trigrams = trigrams(text)
+        self.phonetic = phonetic_key(text)
+        self.words = (full or text).split()  # all words of the name, generic ones included
+
+
+class EntityIndex:
+    """Phonetic + trigram + edit-distance index over known entity names."""
+
+    def __init__(self, entities: list[Entity], threshold: float = 0.55, margin: float = 0.05,
+                 max_candidates: int = 50):
+        self.entities = entities
+        self.threshold = threshold
+        self.margin = margin
+        self.max_candidates = max_candidates
+        self._exact: dict[tuple[str, str], int] = {}
+        self._forms: list[_Form] = []  # one per entity, same order
+        self._by_trigram: dict[str, list[int]] = {}
+        self._by_phonetic: dict[str, list[int]] = {}
+        for entity_id, entity in enumerate(entities):
+            self._exact.setdefault((entity.kind, normalize_query(entity.name)), entity_id)
+            form = _Form(key_form(entity.name), " ".join(_WORD.findall(entity.name.lower())))
+            self._forms.append(form)
+            for trigram in form.trigrams:
+                self._by_trigram.setdefault(trigram, []).append(entity_id)
+            self._by_phonetic.setdefault(form.phonetic, []).append(entity_id)
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def resolve(self, text: str, kind: str | None = None) -> Resolution | None:
+        """The best matching entity of `kind` (any kind if None), or None when nothing is close enough."""
+        if not text or not text.strip():
+            return None
+        entity_id = self._exact.get((kind, normalize_query(text))) if kind else None
+        if entity_id is not None:
+            return Resolution(self.entities[entity_id], 1.0, True)
+
+        query = key_form(text)
+        query_trigrams, query_phonetic = trigrams(query), phonetic_key(query)
+        spellings = [(query, query_trigrams)]
+        if respelled(query) != query:
+            spellings.append((respelled(query), trigrams(respelled(query))))
+        best_id, score, runner_up = None, 0.0, 0.0
+        for entity_id in self._candidates(query_trigrams, query_phonetic):
+            if kind is not None and self.entities[entity_id].kind != kind:
+                continue
+            candidate = max(self._score(spelling, spelling_trigrams, query_phonetic, self._forms[entity_id])
+                            for spelling, spelling_trigrams in spellings)
+            if candidate > score:
+                best_id, score, runner_up = entity_id, candidate, score
+            elif candidate > runner_up:
+                runner_up = candidate
+        if best_id is None:
+            return None
+        if score < self.threshold or score - runner_up < self.margin:
+            return None
+        return Resolution(self.entities[best_id], round(score, 3), score >= 0.999)
+
+    def canonical(self, text: str, kind: str) -> str:
+        """The resolved entity name, or `text` unchanged when it cannot be resolved."""
+        resolution = self.resolve(text, kind)
+        return resolution.entity.name if resolution is not None else text
+
+    def contacts_for(self, account: str) -> list[Entity]:
+        key = normalize_query(account)
+        return [entity for entity in self.entities
+                if entity.kind == "contact" and entity.account and normalize_query(entity.account) == key]
+
+    def _candidates(self, query_trigrams: set[str], query_phonetic: str) -> list[int]:
+        counts: dict[int, int] = {}
+        for trigram in query_trigrams:
+            for entity_id in self._by_trigram.get(trigram, ()):
+                counts[entity_id] = counts.get(entity_id, 0) + 1
+        for entity_id in self._by_phonetic.get(query_phonetic, ()):
+            counts[entity_id] = counts.get(entity_id, 0) + len(query_trigrams)  # a phonetic match always qualifies
+        if len(counts) <= self.max_candidates:
+            return list(counts)
+        return sorted(counts, key=counts.get, reverse=True)[:self.max_candidates]
+
+    @staticmethod
+    def _score(query: str, query_trigrams: set[str], query_phonetic: str, form: _Form) -> float:
+        overlap = len(query_trigrams & form.trigrams) / len(query_trigrams | form.trigrams)
+        fuzzy = 0.3 * overlap + 0.3 * _similarity(query, form.text) + 0.4 * _similarity(query_phonetic, form.phonetic)
+        return max(fuzzy, _partial_match(query.split(), form.words))
+
+    # --- Persistence ---
+
+    def save(self, index_path: str):
+        path = os.path.join(index_path, ENTITIES_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"version": ENTITIES_VERSION, "entities": [asdict(entity) for entity in self.entities]}, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_path: str) -> "EntityIndex | None":
+        try:
+            with open(os.path.join(index_path, ENTITIES_FILE)) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if data.get("version") != ENTITIES_VERSION:
+            return None
+        return cls([Entity(**entity) for entity in data["entities"]])
+
+
+def entities_from_texts(texts) -> list[Entity]:
+    """Clients, products and key contacts declared in the knowledge-base chunks."""
+    texts = list(texts)
+    found = find_entities(texts)
+    entities = [Entity("client", name) for name in found["client"].values()]
+    entities += [Entity("product", name) for name in found["product"].values()]
+    for text in texts:
+        clients = [(match.start(), match.group(1)) for match in ENTITY_PATTERNS["client"].finditer(text)]
+        for match in _CONTACTS.finditer(text):
+            account = next((name for start, name in reversed(clients) if start < match.start()), None)
+            for contact in _CONTACT.finditer(match.group(1)):
+                if contact.group(1):
+                    entities.append(Entity("contact", contact.group(1), account=account, role=contact.group(2)))
+    return entities
+
+
+def entities_from_crm(path: str) -> list[Entity]:
+    """Accounts and contacts from a CRM export CSV (see the module docstring for the columns)."""
+    entities = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            account = (row.get("account_name") or "").strip()
+            contact = (row.get("contact_name") or "").strip()
+            if account:
+                entities.append(Entity("client", account))
+            if contact:
+                entities.append(Entity("contact", contact, account=account or None,
+                                       email=(row.get("contact_email") or "").strip() or None,
+                                       role=(row.get("contact_role") or "").strip() or None))
+    return entities
+
+
+def merge_entities(entities: list[Entity]) -> list[Entity]:
+    """De-duplicates by (kind, normalized name, account), keeping the first spelling and filling in details."""
+    merged: dict[tuple, Entity] = {}
+    for entity in entities:
+        account = normalize_query(entity.account) if entity.account and entity.kind == "contact" else None
+        key = (entity.kind, normalize_query(entity.name), account)
+        existing = merged.get(key)
+        if existing is None:
+            merged[key] = Entity(**asdict(entity))
+            continue
+        existing.email = existing.email or entity.email
+        existing.role = existing.role or entity.role
+    return list(merged.values())
+
+
+def unresolved_aliases(index: EntityIndex, aliases: dict = KNOWN_ALIASES) -> list[tuple[str, str]]:
+    """(alias, expected name) pairs of known names in the index that no longer resolve to that name."""
+    known = {(entity.kind, normalize_query(entity.name)) for entity in index.entities}
+    misses = []
+    for (kind, name), variants in aliases.items():
+        if (kind, normalize_query(name)) not in known:
+            continue
+        misses += [(alias, name) for alias in variants if index.canonical(alias, kind) != name]
+    return misses
+
+
+def build_entity_index(index_path: str, texts, crm_path: str | None = None) -> dict:
+    """
+    Builds entities.json from the indexed chunks and (if it exists) the CRM
+    export. Returns counts, and the known aliases that do not resolve.
+    """
+    entities = entities_from_texts(texts)
+    if crm_path and os.path.exists(crm_path):
+        entities += entities_from_crm(crm_path)
+    index = EntityIndex(merge_entities(entities))
+    index.save(index_path)
+    counts = {kind: sum(entity.kind == kind for entity in index.entities) for kind in KINDS}
+    counts["unresolved_aliases"] = unresolved_aliases(index)
+    return counts
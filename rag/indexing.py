@@ -0,0 +1,296 @@
+# rag/indexing.py
+
+"""
+Incremental, streaming index builder used by create_index.py.
+
+A manifest (manifest.json inside the index directory) records the SHA-256 of
+every PDF and the IDs of the chunks it produced. On each build only new or
+changed PDFs are parsed and embedded; chunks of changed or deleted files are
+removed from the index before the new ones are appended. New PDFs are
+streamed through parsing, splitting and embedding into the store with
+bounded memory and resumable checkpoints (see rag/ingest.py). After every build
+the briefing/comparison answers for the clients and products named in the
+documents are precomputed (see rag/materialize.py) and the name-resolution
+index is rebuilt (see rag/entities.py).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from langchain_community.vectorstores import FAISS
+
+from rag.bm25 import BM25Index
+from rag.entities import build_entity_index
+from rag.ingest import (CHECKPOINT_FILE, CHUNK_OVERLAP, CHUNK_SIZE, PAGES_PER_TASK, Progress, advance_cursor,
+                        build_plan, load_checkpoint, save_checkpoint, stream_embedded_batches)
+from rag.materialize import MATERIALIZED_FILE, build_materializations
+from rag.pipeline import load_pipeline
+from rag.store import MmapVectorStore, StoreWriter, is_mmap_store
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2  # v2: chunks carry a `doc_type` and the index has a BM25 companion.
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(index_path: str) -> dict:
+    try:
+        with open(os.path.join(index_path, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"version": MANIFEST_VERSION, "files": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "files": {}}
+    return manifest
+
+
+def save_manifest(index_path: str, manifest: dict):
+    """Writes the manifest atomically so a crash never leaves it half-written."""
+    path = os.path.join(index_path, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def chunk_id_for(sha256: str, index: int) -> str:
+    """Deterministic chunk ID derived from the file content hash and the chunk's position in the file."""
+    return f"{sha256[:16]}-{index}"
+
+
+def chunk_ids_for(sha256: str, count: int) -> list[str]:
+    return [chunk_id_for(sha256, i) for i in range(count)]
+
+
+def _index_exists(index_path: str, index_format: str) -> bool:
+    if index_format == "mmap":
+        return is_mmap_store(index_path)
+    return os.path.exists(os.path.join(index_path, "index.faiss"))
+
+
+def _swap_directory(build_path: str, index_path: str):
+    """Moves a finished build into place, replacing the previous index directory."""
+    old_path = index_path + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(index_path):
+        os.rename(index_path, old_path)
+    os.rename(build_path, index_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def _stream_to_mmap_store(index_path: str, embeddings, stream, files, retain_existing: bool, stale_ids: list[str],
+                          index_type: str, dtype: str, plan: str, checkpoint_interval: float, progress) -> dict:
+    """
+    Writes a new mmap store next to the current one (copying over every chunk
+    that is not stale, without re-embedding it), appends the streamed chunks
+    with periodic checkpoints, and swaps it into place. Resumes a build of the
+    same plan left behind by a crash. Returns the manifest entries of `files`.
+    """
+    build_path = index_path + ".building"
+    checkpoint = load_checkpoint(build_path, plan)
+    if checkpoint is not None:
+        writer = StoreWriter(build_path, dtype=dtype)
+        writer.rewind(checkpoint["rows"], checkpoint["dimensions"])
+        done, cursor = checkpoint["done"], checkpoint["cursor"]
+        print(f"Resuming the interrupted build: {len(done)} PDFs done, {writer.count} chunks already stored.")
+    else:
+        shutil.rmtree(build_path, ignore_errors=True)
+        writer = StoreWriter(build_path, dtype=dtype)
+        if retain_existing:
+            stale = set(stale_ids)
+            previous = MmapVectorStore.load(index_path, embeddings)
+            for chunk_ids, old_texts, old_metadatas, old_vectors in previous.iter_records():
+                keep = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in stale]
+                if keep:
+                    writer.append([chunk_ids[i] for i in keep], [old_texts[i] for i in keep],
+                                  [old_metadatas[i] for i in keep], old_vectors[keep])
+            previous.close()
+        done, cursor = {}, None
+        writer.checkpoint()
+        save_checkpoint(build_path, plan, writer.count, writer.dimensions, done, cursor)
+
+    progress.files_done = len(done)
+    next_checkpoint = time.monotonic() + checkpoint_interval
+    for records, finished, vectors in stream([file for file in files if file[0] not in done], cursor=cursor):
+        if records:
+            ids = [chunk_id_for(record.sha256, record.index) for record in records]
+            writer.append(ids, [record.text for record in records],
+                          [{**record.metadata, "chunk_id": chunk_id} for record, chunk_id in zip(records, ids)],
+                          vectors)
+        cursor = advance_cursor(cursor, records)
+        for file in finished:
+            done[file.name] = {"sha256": file.sha256, "chunk_ids": chunk_ids_for(file.sha256, file.chunks)}
+            cursor = None if cursor and cursor["name"] == file.name else cursor
+            progress.files_done += 1
+        progress.tick()
+        if time.monotonic() >= next_checkpoint:
+            writer.checkpoint()
+            save_checkpoint(build_path, plan, writer.count, writer.dimensions, done, cursor)
+            next_checkpoint = time.monotonic() + checkpoint_interval
+
+    meta = writer.finalize(index_type)
+    os.remove(os.path.join(build_path, CHECKPOINT_FILE))
+    _swap_directory(build_path, index_path)
+    print(f"Wrote {meta['count']} chunks ({meta['dtype']}, {meta['index_type']} index).")
+    return done
+
+
+def _stream_to_faiss(index_path: str, embeddings, stream, files, retain_existing: bool, stale_ids: list[str],
+                     progress) -> dict | None:
+    """
+    Appends the streamed chunks to the legacy FAISS store. That format is
+    pickled whole, so it is held in memory and not checkpointed. Returns the
+    manifest entries of `files`, or None when there was nothing to index.
+    """
+    db = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True) if retain_existing else None
+    if db is not None and stale_ids:
+        db.delete(stale_ids)
+    done = {}
+    for records, finished, vectors in stream(files):
+        if records:
+            ids = [chunk_id_for(record.sha256, record.index) for record in records]
+            text_embeddings = [(record.text, vector) for record, vector in zip(records, vectors)]
+            metadatas = [{**record.metadata, "chunk_id": chunk_id} for record, chunk_id in zip(records, ids)]
+            if db is None:
+                db = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        for file in finished:
+            done[file.name] = {"sha256": file.sha256, "chunk_ids": chunk_ids_for(file.sha256, file.chunks)}
+            progress.files_done += 1
+        progress.tick()
+    if db is None:
+        return None
+    db.save_local(index_path)
+    return done
+
+
+def _iter_chunks(index_path: str, embeddings, index_format: str):
+    """Yields (chunk_id, text) for every chunk now in the store."""
+    if index_format == "mmap":
+        store = MmapVectorStore.load(index_path, embeddings)
+        try:
+            for chunk_ids, texts, _, _ in store.iter_records():
+                yield from zip(chunk_ids, texts)
+        finally:
+            store.close()
+    else:
+        db = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        for doc_id, doc in db.docstore._dict.items():
+            yield doc_id, doc.page_content
+
+
+def _build_bm25(index_path: str, embeddings, index_format: str):
+    """Rebuilds the BM25 companion index from the chunks now in the store (no re-embedding)."""
+    bm25 = BM25Index.build(_iter_chunks(index_path, embeddings, index_format))
+    bm25.save(index_path)
+    print(f"Built BM25 index over {len(bm25.chunk_ids)} chunks.")
+
+
+def _materialize(index_path: str, embeddings, index_format: str):
+    """Precomputes the briefing/comparison answers for every client and product in the index."""
+    pipeline = load_pipeline(index_path, embeddings)
+    counts = build_materializations(index_path, pipeline, _iter_chunks(index_path, embeddings, index_format))
+    if index_format == "mmap":
+        pipeline.store.close()
+    print(f"Materialized {counts['entries']} tool answers ({counts['client']} clients, {counts['product']} products).")
+
+
+def _build_entities(index_path: str, embeddings, index_format: str, crm_path: str | None):
+    """Rebuilds the name-resolution index from the documents and the CRM export (see rag/entities.py)."""
+    counts = build_entity_index(
+        index_path, (text for _, text in _iter_chunks(index_path, embeddings, index_format)), crm_path)
+    print(f"Entity index: {counts['client']} clients, {counts['contact']} contacts, {counts['product']} products.")
+    for alias, name in counts["unresolved_aliases"]:
+        print(f"Warning: known alias '{alias}' no longer resolves to '{name}' (see KNOWN_ALIASES in rag/entities.py).")
+
+
+def build_index(pdfs_path: str, index_path: str, embeddings, incremental: bool = True,
+                workers: int | None = None, batch_size: int = 64, max_concurrency: int = 4,
+                index_format: str = "mmap", index_type: str = "flat", dtype: str = "float16",
+                crm_path: str | None = None, pages_per_task: int = PAGES_PER_TASK,
+                checkpoint_interval: float = 30.0) -> dict:
+    """
+    Builds or updates the index at `index_path` from the PDFs in `pdfs_path`.
+    `index_format` is "mmap" (see rag/store.py) or the legacy pickled "faiss"
+    format; `index_type` and `dtype` only apply to the mmap format, which is
+    also the only format checkpointed every `checkpoint_interval` seconds.
+    Accounts and contacts from the CRM export at `crm_path` (if given) are
+    added to the entity index. Returns a summary of what changed.
+    """
+    index_exists = _index_exists(index_path, index_format)
+    model_id = getattr(embeddings, "model_id", type(embeddings).__name__)
+    store_settings = {"format": index_format, "index_type": index_type, "dtype": dtype} \
+        if index_format == "mmap" else {"format": index_format}
+    manifest = load_manifest(index_path) if incremental and index_exists else {"version": MANIFEST_VERSION, "files": {}}
+    if manifest["files"] and manifest.get("embedding_model") != model_id:
+        print(f"Embedding model changed ({manifest.get('embedding_model')} -> {model_id}); rebuilding from scratch.")
+        manifest = {"version": MANIFEST_VERSION, "files": {}}
+    settings_changed = manifest.get("store") != store_settings
+    manifest["embedding_model"] = model_id
+    manifest["store"] = store_settings
+    previous = manifest["files"]
+
+    current = {path.name: (path, file_sha256(path)) for path in sorted(Path(pdfs_path).glob("*.pdf"))}
+    changed = [name for name, (_, sha) in current.items() if previous.get(name, {}).get("sha256") != sha]
+    deleted = [name for name in previous if name not in current]
+    summary = {"unchanged": len(current) - len(changed), "changed": len(changed), "deleted": len(deleted),
+               "chunks_added": 0, "chunks_removed": 0}
+    print(f"Found {len(current)} PDFs: {len(changed)} new/changed, {len(deleted)} deleted, {summary['unchanged']} unchanged.")
+
+    if index_exists and manifest["files"] and not changed and not deleted and not settings_changed:
+        print("Index is up to date.")
+        if not os.path.exists(os.path.join(index_path, MATERIALIZED_FILE)):
+            _materialize(index_path, embeddings, index_format)
+        _build_entities(index_path, embeddings, index_format, crm_path)  # the CRM export may have changed
+        return summary
+
+    stale_ids = [chunk_id for name in changed + deleted for chunk_id in previous.get(name, {}).get("chunk_ids", [])]
+    files = [(name, str(current[name][0]), current[name][1]) for name in changed]
+    workers = workers or os.cpu_count() or 1
+    progress = Progress(len(files))
+    print(f"Streaming {len(files)} PDFs through {workers} parsing processes and "
+          f"{max_concurrency} concurrent embedding requests of {batch_size} chunks...")
+    with ProcessPoolExecutor(max_workers=workers) as process_pool, \
+            ThreadPoolExecutor(max_workers=max_concurrency) as thread_pool:
+        stream = partial(stream_embedded_batches, embeddings=embeddings, process_pool=process_pool,
+                         thread_pool=thread_pool, workers=workers, progress=progress, batch_size=batch_size,
+                         max_concurrency=max_concurrency, pages_per_task=pages_per_task)
+        if index_format == "mmap":
+            plan = build_plan(embedding_model=model_id, store=store_settings, chunking=[CHUNK_SIZE, CHUNK_OVERLAP],
+                              previous={name: entry["sha256"] for name, entry in previous.items()},
+                              files=[(name, sha) for name, _, sha in files])
+            new_entries = _stream_to_mmap_store(index_path, embeddings, stream, files, bool(manifest["files"]),
+                                                stale_ids, index_type, dtype, plan, checkpoint_interval, progress)
+        else:
+            new_entries = _stream_to_faiss(index_path, embeddings, stream, files, bool(manifest["files"]),
+                                           stale_ids, progress)
+    progress.report("Ingested")
+    summary["pages"] = progress.pages
+    summary["throughput"] = progress.rates()
+    if new_entries is None:
+        print("No documents to index.")
+        return summary
+    _build_bm25(index_path, embeddings, index_format)
+
+    for name in deleted:
+        previous.pop(name, None)
+    previous.update(new_entries)
+    save_manifest(index_path, manifest)
+    _materialize(index_path, embeddings, index_format)
+    _build_entities(index_path, embeddings, index_format, crm_path)
+    summary["chunks_added"] = sum(len(entry["chunk_ids"]) for entry in new_entries.values())
+    summary["chunks_removed"] = len(stale_ids)
+    return summary
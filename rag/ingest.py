@@ -0,0 +1,267 @@
+# rag/ingest.py
+
+"""
+Streaming PDF ingestion for rag/indexing.py.
+
+The corpus is never held in memory. Each stage is a generator that pulls
+from the one before it, and only a bounded number of items is in flight:
+
+    files -> page ranges -> chunks -> embedding batches -> store append
+
+    * page ranges (`pages_per_task` pages of one PDF) are extracted with pypdf
+      and split in a process pool, at most 2 ranges per worker ahead of the
+      consumer, so even a single huge PDF is read a few pages at a time;
+    * chunks are grouped into batches of `batch_size` and embedded in a
+      thread pool, at most `max_concurrency` batches ahead of the writer;
+    * the writer (build_index) appends each embedded batch to the store and
+      periodically checkpoints: the appended rows are made durable and
+      CHECKPOINT_FILE records which files are complete and how far into the
+      current file the build got. A crashed build resumes from the last
+      checkpoint instead of re-embedding everything.
+
+Chunk IDs are derived from the file hash and the chunk's position in the
+file, and pages are split independently, so a resumed file produces exactly
+the chunks it would have produced in one go.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from collections import deque
+from typing import NamedTuple
+
+import backoff
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+PAGES_PER_TASK = 16
+CHECKPOINT_FILE = "ingest_checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+_COMPARISON = re.compile(r"\b(competitor|comparison|compared to|versus|vs\.?)\b", re.IGNORECASE)
+_BRIEFING = re.compile(r"\b(client name|client:|key contacts|meeting briefing|history notes|pain point)", re.IGNORECASE)
+
+
+def classify_chunk(text: str) -> str:
+    """Heuristic document type used for per-tool metadata filters."""
+    if _COMPARISON.search(text):
+        return "comparison"
+    if _BRIEFING.search(text):
+        return "briefing"
+    return "product"
+
+
+class PageRange(NamedTuple):
+    name: str  # PDF file name
+    sha256: str
+    path: str
+    start: int
+    stop: int
+    last: bool  # the file's final range
+
+
+class ChunkRecord(NamedTuple):
+    name: str
+    sha256: str
+    index: int  # position of the chunk within its file (the chunk ID suffix)
+    page: int
+    text: str
+    metadata: dict
+
+
+class FileDone(NamedTuple):
+    name: str
+    sha256: str
+    chunks: int
+
+
+# --- Stages ---
+
+def count_pages(path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def parse_pages(task: PageRange, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> list[tuple]:
+    """
+    Extracts and splits one page range. Runs in a worker process, so it
+    returns plain (page, text, metadata) tuples rather than LangChain objects.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from pypdf import PdfReader
+
+    reader = PdfReader(task.path)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    for page in range(task.start, task.stop):
+        metadata = {"source": task.path, "page": page, "page_label": reader.page_labels[page],
+                    "total_pages": len(reader.pages)}
+        for text in splitter.split_text(reader.pages[page].extract_text().strip()):
+            chunks.append((page, text, {**metadata, "doc_type": classify_chunk(text)}))
+    return chunks
+
+
+def bounded_map(executor, fn, items, window: int):
+    """executor.map() that submits at most `window` calls ahead of the consumer. Yields (item, result) in order."""
+    pending = deque()
+    try:
+        for item in items:
+            pending.append((item, executor.submit(fn, item)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def iter_page_ranges(files, pages_per_task: int = PAGES_PER_TASK, cursor: dict | None = None):
+    """
+    Yields the PageRanges of `files` ((name, path, sha256) tuples), starting
+    the cursor's file at its checkpointed page. A file without pages yields
+    one empty range so that it is still recorded as done.
+    """
+    for name, path, sha in files:
+        total = count_pages(path)
+        first = cursor["page"] if cursor and cursor["name"] == name else 0
+        for start in range(first, total, pages_per_task) or [total]:
+            stop = min(start + pages_per_task, total)
+            yield PageRange(name, sha, path, start, stop, stop == total)
+
+
+def iter_chunks(parsed, progress, cursor: dict | None = None):
+    """Numbers the parsed chunks of each file; yields ChunkRecords, and a FileDone after a file's last range."""
+    current, index, skip = None, 0, 0
+    for task, chunks in parsed:
+        if task.name != current:
+            resuming = cursor is not None and cursor["name"] == task.name
+            current = task.name
+            index = cursor["page_first_chunk"] if resuming else 0
+            skip = cursor["chunks"] if resuming else 0  # already in the store
+        progress.pages += task.stop - task.start
+        for page, text, metadata in chunks:
+            if index >= skip:
+                progress.chunks += 1
+                yield ChunkRecord(task.name, task.sha256, index, page, text, metadata)
+            index += 1
+        if task.last:
+            yield FileDone(task.name, task.sha256, index)
+
+
+def iter_batches(items, batch_size: int):
+    """Groups ChunkRecords into (records, files finished so far) batches of up to `batch_size` records."""
+    records, finished = [], []
+    for item in items:
+        if isinstance(item, FileDone):
+            finished.append(item)
+            continue
+        records.append(item)
+        if len(records) == batch_size:
+            yield records, finished
+            records, finished = [], []
+    if records or finished:
+        yield records, finished
+
+
+def stream_embedded_batches(files, embeddings, process_pool, thread_pool, workers: int, progress,
+                            batch_size: int = 64, max_concurrency: int = 4, max_tries: int = 5,
+                            pages_per_task: int = PAGES_PER_TASK, cursor: dict | None = None):
+    """
+    Runs the pipeline over `files` and yields (records, finished files,
+    vectors) in file and page order. `cursor` is the checkpointed position
+    in the first file (see advance_cursor).
+    """
+    embed_batch = backoff.on_exception(
+        backoff.expo, Exception, max_tries=max_tries,
+        on_backoff=lambda details: print(f"Embedding batch failed, retrying (attempt {details['tries']})..."),
+    )(embeddings.embed_documents)
+
+    ranges = iter_page_ranges(files, pages_per_task, cursor)
+    parsed = bounded_map(process_pool, parse_pages, ranges, 2 * workers)
+    batches = iter_batches(iter_chunks(parsed, progress, cursor), batch_size)
+    embedded = bounded_map(thread_pool, lambda batch: embed_batch([r.text for r in batch[0]]) if batch[0] else [],
+                           batches, max_concurrency)
+    for (records, finished), vectors in embedded:
+        progress.embeddings += len(vectors)
+        yield records, finished, vectors
+
+
+# --- Checkpoints ---
+
+def advance_cursor(cursor: dict | None, records: list[ChunkRecord]) -> dict | None:
+    """
+    The resume position after `records` were written: the file, the next
+    chunk index, and the page to restart parsing from with the index of its
+    first chunk (pages are re-split whole; chunks before `chunks` are skipped).
+    """
+    for record in records:
+        if cursor is None or (cursor["name"], cursor["page"]) != (record.name, record.page):
+            cursor = {"name": record.name, "sha256": record.sha256, "page": record.page,
+                      "page_first_chunk": record.index}
+        cursor["chunks"] = record.index + 1
+    return cursor
+
+
+def build_plan(**fields) -> str:
+    """Identifies a build, so a checkpoint is only resumed by a build with the same inputs and settings."""
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def load_checkpoint(build_path: str, plan: str) -> dict | None:
+    try:
+        with open(os.path.join(build_path, CHECKPOINT_FILE)) as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get("plan") != plan:
+        return None
+    return checkpoint
+
+
+def save_checkpoint(build_path: str, plan: str, rows: int, dimensions: int | None, done: dict,
+                    cursor: dict | None):
+    """Writes the checkpoint atomically; call only after the store's rows are durable."""
+    path = os.path.join(build_path, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": CHECKPOINT_VERSION, "plan": plan, "rows": rows, "dimensions": dimensions,
+                   "done": done, "cursor": cursor}, f)
+    os.replace(path + ".tmp", path)
+
+
+# --- Progress ---
+
+class Progress:
+    """Counts pages, chunks and embeddings and prints their rates every `interval` seconds."""
+
+    def __init__(self, files: int, interval: float = 10.0):
+        self.files = files
+        self.interval = interval
+        self.files_done = 0
+        self.pages = 0
+        self.chunks = 0
+        self.embeddings = 0
+        self.started = time.monotonic()
+        self._next_report = self.started + interval
+
+    def tick(self):
+        if time.monotonic() >= self._next_report:
+            self._next_report = time.monotonic() + self.interval
+            self.report()
+
+    def rates(self) -> dict:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {"seconds": round(elapsed, 1), "pages_per_s": round(self.pages / elapsed, 1),
+                "chunks_per_s": round(self.chunks / elapsed, 1),
+                "embeddings_per_s": round(self.embeddings / elapsed, 1)}
+
+    def report(self, prefix: str = "Progress"):
+        rates = self.rates()
+        print(f"{prefix}: {self.files_done}/{self.files} files, {self.pages} pages ({rates['pages_per_s']}/s), "
+              f"{self.chunks} chunks ({rates['chunks_per_s']}/s), "
+              f"{self.embeddings} embeddings ({rates['embeddings_per_s']}/s) in {rates['seconds']}s")
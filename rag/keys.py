@@ -0,0 +1,44 @@
+# rag/keys.py
+
+"""
+Query normalization, chunk IDs and directory fingerprints shared by the
+caches, the retrieval batcher, the pipeline and the materialized views. Kept free of numpy/langchain
+imports so request-path modules can use them without loading the RAG stack.
+"""
+
+import hashlib
+import os
+import re
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Normalizes query text for exact-match lookups."""
+    return _WHITESPACE.sub(" ", text).strip().strip("?.!").lower()
+
+
+def chunk_id_of(doc) -> str:
+    """
+    A document's chunk ID. Documents from a legacy FAISS pickle have neither a
+    chunk_id nor an id; they get a stable hash of their source, page and text.
+    """
+    chunk_id = doc.metadata.get("chunk_id") or doc.id
+    if chunk_id:
+        return chunk_id
+    key = f"{doc.metadata.get('source', '')}\x00{doc.metadata.get('page', '')}\x00{doc.page_content}"
+    return "sha1-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def directory_fingerprint(path: str) -> tuple:
+    """Returns a cheap fingerprint (names, sizes, mtimes) of a directory's files."""
+    try:
+        entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return ()
+    return tuple(
+        (entry.name, stat.st_size, stat.st_mtime_ns)
+        for entry in entries
+        if entry.is_file()
+        for stat in (entry.stat(),)
+    )
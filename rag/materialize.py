@@ -0,0 +1,177 @@
+# rag/materialize.py
+
+"""
+Precomputed ("materialized") answers for the briefing and comparison tools.
+
+At index time (see rag/indexing.py) every client and product named in the
+knowledge base ("Client Name: ...", "Product Name: ...") is run through the
+same retrieval the tools use. The retrieved chunks that mention the name are
+joined and stored in materialized.json inside the index directory, with their
+chunk IDs and sources (file, page) and a content hash.
+
+At query time MaterializedViews serves those answers from an in-memory dict
+keyed by (tool, normalized name). The file is reloaded when the index
+directory changes, and an entry whose source chunks are no longer in the
+manifest (the PDF changed or was removed) is ignored, so the tool falls back
+to live retrieval - as it does for names that were never materialized.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from rag.keys import chunk_id_of, directory_fingerprint, normalize_query
+
+logger = logging.getLogger(__name__)
+
+MATERIALIZED_FILE = "materialized.json"
+MATERIALIZED_VERSION = 1
+
+# Templated queries issued by the retrieval tools.
+BRIEFING_QUERY = "Provide a detailed meeting briefing for the client: {}"
+COMPARISON_QUERY = "Provide a competitor comparison for the product: {}"
+
+# tool -> (entity kind, query template)
+MATERIALIZED_TOOLS = {
+    "get_meeting_briefing": ("client", BRIEFING_QUERY),
+    "get_competitor_comparison": ("product", COMPARISON_QUERY),
+}
+
+ENTITY_PATTERNS = {
+    "client": re.compile(r"^\s*Client(?: Name)?:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE),
+    "product": re.compile(r"^\s*Product(?: Name)?:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE),
+}
+MAX_NAME_LENGTH = 80
+
+
+def find_entities(texts) -> dict[str, dict[str, str]]:
+    """Returns {kind: {normalized name: display name}} for the names declared in `texts`."""
+    found = {kind: {} for kind in ENTITY_PATTERNS}
+    for text in texts:
+        for kind, pattern in ENTITY_PATTERNS.items():
+            for match in pattern.finditer(text):
+                name = match.group(1)
+                if len(name) <= MAX_NAME_LENGTH:
+                    found[kind].setdefault(normalize_query(name), name)
+    return found
+
+
+def join_documents(docs) -> str:
+    """Combines retrieved chunks into the context string returned to the model."""
+    return "\n---\n".join([doc.page_content for doc in docs])
+
+
+def build_materializations(index_path: str, pipeline, chunks) -> dict:
+    """
+    Runs the tool retrieval for every client and product declared in `chunks`
+    ((chunk_id, text) pairs) and writes the results to materialized.json
+    (atomically). Retrieved chunks that do not mention the name are dropped;
+    when none is left the chunks declaring the name are used. Returns counts.
+    """
+    texts = dict(chunks)
+    declared_in = {kind: {} for kind in ENTITY_PATTERNS}
+    for chunk_id, text in texts.items():
+        for kind, names in find_entities([text]).items():
+            for key in names:
+                declared_in[kind].setdefault(key, []).append(chunk_id)
+    entities = find_entities(texts.values())
+
+    entries = []
+    for tool_name, (kind, template) in MATERIALIZED_TOOLS.items():
+        names = list(entities[kind].values())
+        if not names:
+            continue
+        results = pipeline.search_batch([(tool_name, template.format(name)) for name in names])
+        for name, docs in zip(names, results):
+            key = normalize_query(name)
+            docs = [doc for doc in docs if key in normalize_query(doc.page_content)] \
+                or pipeline.store.get_by_ids(declared_in[kind][key])
+            text = join_documents(docs)
+            entries.append({
+                "tool": tool_name,
+                "entity": kind,
+                "name": name,
+                "text": text,
+                "chunk_ids": [chunk_id_of(doc) for doc in docs],
+                "sources": [{"chunk_id": chunk_id_of(doc), "source": doc.metadata.get("source"),
+                             "page": doc.metadata.get("page")} for doc in docs],
+                "content_hash": hashlib.sha256(text.encode()).hexdigest(),
+            })
+
+    path = os.path.join(index_path, MATERIALIZED_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": MATERIALIZED_VERSION, "entries": entries}, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return {kind: len(names) for kind, names in entities.items()} | {"entries": len(entries)}
+
+
+class MaterializedViews:
+    """In-memory lookup of materialized tool answers, reloaded when the index changes."""
+
+    def __init__(self, index_path: str, check_interval: float = 5.0):
+        self.index_path = index_path
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.reloads = 0
+        self._entries: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._next_check = 0.0
+        self._check_reload()
+
+    def get(self, tool_name: str, name: str) -> dict | None:
+        """The materialized entry for `name` (any spelling that normalizes the same), or None."""
+        with self._lock:
+            self._check_reload()
+            entry = self._entries.get((tool_name, normalize_query(name)))
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def names(self, kind: str) -> list[str]:
+        with self._lock:
+            return [entry["name"] for entry in self._entries.values() if entry["entity"] == kind]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "stale": self.stale, "reloads": self.reloads}
+
+    def _check_reload(self):
+        if time.monotonic() < self._next_check:
+            return
+        self._next_check = time.monotonic() + self.check_interval
+        fingerprint = directory_fingerprint(self.index_path)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._entries = self._load()
+            self.reloads += 1
+
+    def _load(self) -> dict[tuple[str, str], dict]:
+        from rag.indexing import load_manifest
+
+        try:
+            with open(os.path.join(self.index_path, MATERIALIZED_FILE)) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if data.get("version") != MATERIALIZED_VERSION:
+            return {}
+        manifest_files = load_manifest(self.index_path)["files"]
+        live_chunks = {chunk_id for entry in manifest_files.values() for chunk_id in entry.get("chunk_ids", [])}
+        entries, self.stale = {}, 0
+        for entry in data["entries"]:
+            if manifest_files and not live_chunks.issuperset(entry["chunk_ids"]):
+                self.stale += 1  # built from a PDF that has since changed; serve live retrieval instead
+                continue
+            entries[(entry["tool"], normalize_query(entry["name"]))] = entry
+        logger.info("Loaded %d materialized tool answers (%d stale).", len(entries), self.stale)
+        return entries
@@ -0,0 +1,156 @@
+# rag/pipeline.py
+
+"""
+Hybrid retrieval pipeline: dense vector search + BM25, fused with reciprocal
+rank fusion (RRF) and optionally reranked by a lightweight local scorer.
+
+Per-tool settings (`k` and metadata filters) live in TOOL_SEARCH so, for
+example, get_competitor_comparison only searches comparison documents.
+"""
+
+import logging
+import os
+
+from langchain_core.documents import Document
+
+from rag.bm25 import BM25Index, tokenize
+from rag.keys import chunk_id_of
+from rag.store import matches_filter, load_vector_store
+from server.metrics import phase
+
+logger = logging.getLogger(__name__)
+
+# Per-tool retrieval settings. `doc_type` is assigned to chunks at index time
+# (see rag/ingest.py: classify_chunk).
+TOOL_SEARCH = {
+    "get_meeting_briefing": {"k": 3, "filter": {"doc_type": "briefing"}},
+    "get_competitor_comparison": {"k": 3, "filter": {"doc_type": "comparison"}},
+    "get_product_information": {"k": 3, "filter": None},
+}
+DEFAULT_SEARCH = {"k": 3, "filter": None}
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], rrf_k: int = 60) -> list[tuple[str, float]]:
+    """Fuses several ranked ID lists; an ID's score is sum(1 / (rrf_k + rank))."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalReranker:
+    """
+    Cheap local reranker: blends the fused score with query-term coverage,
+    boosting chunks that contain every product-code token of the query.
+    """
+
+    def __init__(self, weight: float = 0.5):
+        self.weight = weight
+
+    def rerank(self, query: str, scored_docs: list[tuple[Document, float]]) -> list[tuple[Document, float]]:
+        query_terms = set(tokenize(query))
+        if not query_terms or not scored_docs:
+            return scored_docs
+        codes = {term for term in query_terms if any(c.isdigit() for c in term)}
+        top_score = max(score for _, score in scored_docs) or 1.0
+        reranked = []
+        for doc, score in scored_docs:
+            doc_terms = set(tokenize(doc.page_content))
+            coverage = len(query_terms & doc_terms) / len(query_terms)
+            code_bonus = 1.0 if codes and codes <= doc_terms else 0.0
+            reranked.append((doc, score / top_score + self.weight * (coverage + code_bonus)))
+        return sorted(reranked, key=lambda item: item[1], reverse=True)
+
+
+class RetrievalPipeline:
+    """Dense + sparse retrieval over one index directory."""
+
+    def __init__(self, store, bm25: BM25Index | None = None, reranker: LexicalReranker | None = None,
+                 fetch_k: int = 20, rrf_k: int = 60):
+        self.store = store
+        self.bm25 = bm25
+        self.reranker = reranker
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+
+    def search_for_tool(self, tool_name: str, query: str) -> list[Document]:
+        settings = TOOL_SEARCH.get(tool_name, DEFAULT_SEARCH)
+        return self.search(query, k=settings["k"], filter=settings["filter"])
+
+    def search(self, query: str, k: int = 3, filter: dict | None = None) -> list[Document]:
+        with phase("embedding"):
+            query_vector = self.store.embeddings.embed_query(query)
+        docs = self._search(query, query_vector, k, filter)
+        if not docs and filter:
+            # Chunk classification is heuristic; never return nothing just because of a filter.
+            docs = self._search(query, query_vector, k, None)
+        return docs
+
+    def search_batch(self, requests: list[tuple[str, str]]) -> list[list[Document]]:
+        """
+        Retrieval for several (tool_name, query) pairs at once: the queries are
+        embedded in one batched call and, for the mmap store, searched with one
+        matrix search. BM25 and fusion still run per query.
+        """
+        settings = [TOOL_SEARCH.get(tool_name, DEFAULT_SEARCH) for tool_name, _ in requests]
+        queries = [query for _, query in requests]
+        with phase("embedding"):
+            embeddings = self.store.embeddings
+            if hasattr(embeddings, "embed_queries"):
+                query_vectors = embeddings.embed_queries(queries)
+            else:
+                query_vectors = [embeddings.embed_query(query) for query in queries]
+        with phase("vector_search"):
+            filters = [setting["filter"] for setting in settings]
+            if hasattr(self.store, "similarity_search_with_score_by_vectors"):
+                dense = self.store.similarity_search_with_score_by_vectors(
+                    query_vectors, k=self.fetch_k, filters=filters, fetch_k=self.fetch_k * 4)
+            else:
+                dense = [self.store.similarity_search_with_score_by_vector(
+                    vector, k=self.fetch_k, filter=filter, fetch_k=self.fetch_k * 4)
+                    for vector, filter in zip(query_vectors, filters)]
+
+        results = []
+        for query, query_vector, setting, hits in zip(queries, query_vectors, settings, dense):
+            docs = self._fuse(query, hits, setting["k"], setting["filter"])
+            if not docs and setting["filter"]:
+                docs = self._search(query, query_vector, setting["k"], None)
+            results.append(docs)
+        return results
+
+    def _search(self, query: str, query_vector, k: int, filter: dict | None) -> list[Document]:
+        with phase("vector_search"):
+            dense = self.store.similarity_search_with_score_by_vector(
+                query_vector, k=self.fetch_k, filter=filter, fetch_k=self.fetch_k * 4)
+        return self._fuse(query, dense, k, filter)
+
+    def _fuse(self, query: str, dense: list[tuple[Document, float]], k: int, filter: dict | None) -> list[Document]:
+        by_id = {chunk_id_of(doc): doc for doc, _ in dense}
+        rankings = [[chunk_id_of(doc) for doc, _ in dense]]
+
+        if self.bm25 is not None:
+            with phase("bm25"):
+                sparse_ids = [chunk_id for chunk_id, _ in self.bm25.search(query, self.fetch_k * (4 if filter else 1))]
+                missing = [chunk_id for chunk_id in sparse_ids if chunk_id not in by_id]
+                for doc in self.store.get_by_ids(missing) if missing else []:
+                    by_id[chunk_id_of(doc)] = doc
+                sparse_ids = [chunk_id for chunk_id in sparse_ids
+                              if chunk_id in by_id and (not filter or matches_filter(by_id[chunk_id].metadata, filter))]
+            rankings.append(sparse_ids[:self.fetch_k])
+
+        with phase("fusion"):
+            fused = [(by_id[chunk_id], score) for chunk_id, score in reciprocal_rank_fusion(rankings, self.rrf_k)]
+            if self.reranker is not None:
+                fused = self.reranker.rerank(query, fused)
+        return [doc for doc, _ in fused[:k]]
+
+
+def load_pipeline(index_path: str, embeddings) -> RetrievalPipeline:
+    """Loads the vector store and BM25 index for `index_path`. RAG_RERANK=1 enables reranking."""
+    store = load_vector_store(index_path, embeddings)
+    bm25 = BM25Index.load(index_path)
+    if bm25 is None:
+        logger.warning("No BM25 index in '%s'; using dense retrieval only. Re-run create_index.py to add one.", index_path)
+    reranker = LexicalReranker() if os.getenv("RAG_RERANK", "0") == "1" else None
+    return RetrievalPipeline(store, bm25, reranker, fetch_k=int(os.getenv("RAG_FETCH_K", "20")))
@@ -0,0 +1,277 @@
+# rag/registry.py
+
+"""
+Registry of named indexes, so one deployment can serve several knowledge
+bases (per tenant, region or product line).
+
+    * indexes are configured by name (RAG_INDEXES="emea=indexes/emea,...",
+      plus "default" for faiss_index) or found as subdirectories of
+      RAG_INDEX_ROOT, and loaded on first use;
+    * each session selects one by name (the `index` WebSocket parameter);
+    * a rebuilt index directory (create_index.py swaps it into place
+      atomically) is noticed by its fingerprint and loaded next to the
+      current one. Tool calls switch to the new generation once it is ready,
+      and the old one is closed when the last retrieval using it finishes,
+      so live sessions never see a half-loaded index;
+    * loaded indexes are kept in LRU order, and the least recently used ones
+      are unloaded when their combined size on disk exceeds
+      `memory_cap_bytes`. Vectors are memory-mapped, so the size is an upper
+      bound on what an index can keep resident.
+
+Importing this module is cheap; the loader passed in by rag/resources.py
+does the heavy lifting.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from rag.keys import directory_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX = "default"
+_INDEX_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+def parse_index_map(spec: str) -> dict[str, str]:
+    """Parses "name=path,name=path" (as in RAG_INDEXES)."""
+    indexes = {}
+    for item in spec.split(","):
+        name, _, path = item.partition("=")
+        if name.strip() and path.strip():
+            indexes[name.strip()] = path.strip()
+    return indexes
+
+
+def directory_size(path: str) -> int:
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+class IndexHandle:
+    """The loaded resources of one generation of an index directory."""
+
+    def __init__(self, name: str, path: str, retriever, retrieval_cache=None, materialized=None, entities=None,
+                 timings: dict | None = None):
+        self.name = name
+        self.path = path
+        self.retriever = retriever
+        self.retrieval_cache = retrieval_cache
+        self.materialized = materialized
+        self.entities = entities
+        self.timings = timings or {}
+        self.fingerprint = ()
+        self.size_bytes = 0
+        self.loaded_at = time.time()
+        self.uses = 0
+        self.leases = 0  # retrievals currently using this generation
+        self.retired = False
+
+    def close(self):
+        close = getattr(getattr(self.retriever, "store", None), "close", None)
+        if close is not None:
+            close()
+
+
+class IndexRegistry:
+    """Named indexes loaded on demand, hot-reloaded when rebuilt and evicted LRU under a size cap."""
+
+    def __init__(self, loader, paths: dict[str, str], root: str | None = None,
+                 memory_cap_bytes: int | None = None, check_interval: float = 5.0):
+        self._loader = loader  # loader(name, path) -> IndexHandle
+        self.paths = dict(paths)
+        self.root = root
+        self.memory_cap_bytes = memory_cap_bytes
+        self.check_interval = check_interval
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.load_failures = 0
+        self._handles: OrderedDict[str, IndexHandle] = OrderedDict()  # least recently used first
+        self._retired: list[IndexHandle] = []  # replaced or evicted, still leased
+        self._next_check: dict[str, float] = {}
+        self._load_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def path_of(self, name: str) -> str | None:
+        if name in self.paths:
+            return self.paths[name]
+        if self.root and _INDEX_NAME.match(name):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                return path
+        return None
+
+    def exists(self, name: str) -> bool:
+        return self.path_of(name) is not None
+
+    def names(self) -> list[str]:
+        names = set(self.paths)
+        if self.root and os.path.isdir(self.root):
+            names.update(entry.name for entry in os.scandir(self.root)
+                         if entry.is_dir() and _INDEX_NAME.match(entry.name))
+        return sorted(names)
+
+    def peek(self, name: str, fresh: bool = False) -> IndexHandle | None:
+        """
+        The loaded generation of `name` without loading anything, or None.
+        With `fresh`, also None when the directory is due for a change check
+        (call get(), off the event loop, in that case).
+        """
+        with self._lock:
+            handle = self._handles.get(name)
+            if handle is None or (fresh and time.monotonic() >= self._next_check.get(name, 0.0)):
+                return None
+            self._handles.move_to_end(name)
+            return handle
+
+    def get(self, name: str) -> IndexHandle:
+        """
+        The current generation of `name`, loading it on first use or after its
+        directory changed (blocking). Raises KeyError for unknown names and the
+        loader's error when a first load fails.
+        """
+        path = self.path_of(name)
+        if path is None:
+            raise KeyError(f"Unknown index '{name}'")
+        with self._lock:
+            handle = self._handles.get(name)
+            if handle is not None:
+                self._handles.move_to_end(name)
+                if time.monotonic() < self._next_check.get(name, 0.0):
+                    return handle
+                self._next_check[name] = time.monotonic() + self.check_interval
+        fingerprint = directory_fingerprint(path)
+        if handle is not None and (fingerprint == handle.fingerprint or not fingerprint):
+            return handle  # unchanged, or mid-swap (the directory is briefly missing)
+        return self._load(name, path, fingerprint, handle)
+
+    def acquire(self, name: str, blocking: bool = True) -> IndexHandle | None:
+        """
+        Leases the current generation of `name`: it stays open until release(),
+        even if it is replaced or evicted meanwhile. The handle is checked and
+        leased in one critical section, so it cannot be closed in between.
+        Without `blocking`, returns None instead of loading the index or
+        checking its directory for changes (as peek(name, fresh=True)).
+        """
+        while True:
+            handle = self.get(name) if blocking else None
+            with self._lock:
+                if not blocking:
+                    handle = self._handles.get(name)
+                    if handle is None or time.monotonic() >= self._next_check.get(name, 0.0):
+                        return None
+                    self._handles.move_to_end(name)
+                if not handle.retired:
+                    handle.leases += 1
+                    handle.uses += 1
+                    return handle
+            # Replaced or evicted (and possibly closed) since get() returned it: take the current one.
+
+    def release(self, handle: IndexHandle):
+        with self._lock:
+            handle.leases -= 1
+            closable = self._collect_retired()
+        self._close(closable)
+
+    @contextmanager
+    def lease(self, name: str):
+        """acquire(name) for the duration of the block."""
+        handle = self.acquire(name)
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = {name: {"path": handle.path, "size_bytes": handle.size_bytes, "uses": handle.uses,
+                             "leases": handle.leases, "loaded_at": round(handle.loaded_at, 3)}
+                      for name, handle in self._handles.items()}
+            return {"available": self.names(), "loaded": loaded, "retired": len(self._retired),
+                    "memory_bytes": sum(handle.size_bytes for handle in self._handles.values()),
+                    "memory_cap_bytes": self.memory_cap_bytes, "loads": self.loads, "reloads": self.reloads,
+                    "evictions": self.evictions, "load_failures": self.load_failures}
+
+    def _load(self, name: str, path: str, fingerprint: tuple, current: IndexHandle | None) -> IndexHandle:
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        # While a new generation loads, other callers keep using the current one.
+        if not load_lock.acquire(blocking=current is None):
+            return current
+        try:
+            with self._lock:
+                latest = self._handles.get(name)
+            if latest is not None and latest is not current:
+                return latest  # loaded by another thread while this one waited
+            try:
+                handle = self._loader(name, path)
+            except Exception as e:
+                with self._lock:
+                    self.load_failures += 1
+                if current is None:
+                    raise
+                logger.warning("Could not reload index '%s'; still serving the previous version: %s", name, e)
+                return current
+            handle.fingerprint = fingerprint
+            handle.size_bytes = directory_size(path)
+            with self._lock:
+                previous = self._handles.pop(name, None)
+                self._handles[name] = handle
+                self._next_check[name] = time.monotonic() + self.check_interval
+                if previous is not None:
+                    self.reloads += 1
+                    self._retire(previous)
+                else:
+                    self.loads += 1
+                self._evict(keep=name)
+                closable = self._collect_retired()
+            self._close(closable)
+            logger.info("%s index '%s' from '%s' (%.1f MB).", "Reloaded" if previous else "Loaded", name, path,
+                        handle.size_bytes / 1e6)
+            return handle
+        finally:
+            load_lock.release()
+
+    def _evict(self, keep: str):
+        """Retires least recently used indexes until the loaded ones fit the cap (caller holds the lock)."""
+        if self.memory_cap_bytes is None:
+            return
+        total = sum(handle.size_bytes for handle in self._handles.values())
+        for name in list(self._handles):
+            if total <= self.memory_cap_bytes:
+                break
+            if name == keep:
+                continue
+            handle = self._handles.pop(name)
+            self._next_check.pop(name, None)
+            total -= handle.size_bytes
+            self.evictions += 1
+            self._retire(handle)
+            logger.info("Evicted index '%s' (least recently used) to stay under the %.1f MB cap.", name,
+                        self.memory_cap_bytes / 1e6)
+
+    def _retire(self, handle: IndexHandle):
+        handle.retired = True
+        self._retired.append(handle)
+
+    def _collect_retired(self) -> list[IndexHandle]:
+        """Removes retired generations no retrieval is using any more (caller holds the lock)."""
+        closable = [handle for handle in self._retired if handle.leases == 0]
+        self._retired = [handle for handle in self._retired if handle.leases > 0]
+        return closable
+
+    @staticmethod
+    def _close(handles: list[IndexHandle]):
+        for handle in handles:
+            try:
+                handle.close()
+            except Exception as e:
+                logger.warning("Error closing index '%s': %s", handle.name, e)
@@ -0,0 +1,177 @@
+# rag/resources.py
+
+"""
+Lifecycle-managed RAG resources: the embedding client, and per index (see
+rag/registry.py) the retrieval pipeline, result cache, materialized tool
+answers and name-resolution index.
+
+Importing this module is cheap: langchain, FAISS, numpy and the embedding
+clients are only imported inside `initialize()`, which main.py runs from the
+FastAPI lifespan hook in a background thread. A tool call that arrives before
+startup has finished simply waits for (or triggers) the same initialization.
+When initialization fails, or the default index cannot be loaded ("degraded"),
+the next call after a backoff (RAG_INIT_RETRY_SECONDS, doubling up to 5
+minutes) tries again, so a transient error does not need a restart.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from rag.registry import DEFAULT_INDEX, IndexHandle, IndexRegistry, parse_index_map
+
+logger = logging.getLogger(__name__)
+
+
+class RAGResources:
+    """Holds the process-wide embedding client, the index registry and startup timings."""
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.embeddings = None
+        # "default" is `index_path`; RAG_INDEXES and RAG_INDEX_ROOT add more (per tenant, region, product line).
+        memory_cap_mb = os.getenv("RAG_INDEX_MEMORY_MB")
+        self.indexes = IndexRegistry(
+            self._load_index,
+            {DEFAULT_INDEX: index_path, **parse_index_map(os.getenv("RAG_INDEXES", ""))},
+            root=os.getenv("RAG_INDEX_ROOT") or None,
+            memory_cap_bytes=int(float(memory_cap_mb) * 1024 * 1024) if memory_cap_mb else None,
+            check_interval=float(os.getenv("RAG_INDEX_CHECK_SECONDS", "5")),
+        )
+        self.state = "pending"  # pending | initializing | ready | degraded (no default index) | failed
+        self.error = None
+        self.timings: dict[str, float] = {}
+        self.retry_seconds = float(os.getenv("RAG_INIT_RETRY_SECONDS", "5"))
+        self.failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def retry_due(self) -> bool:
+        """True when a failed or degraded initialization may be retried."""
+        return self.state in ("failed", "degraded") and time.monotonic() >= self._retry_at
+
+    def initialize(self, warm_up=None) -> dict:
+        """
+        Imports everything and loads the embedding client and the default
+        index, recording the duration of each phase. Idempotent and
+        thread-safe; `warm_up()` (optional) runs before the resources are
+        reported ready. Other indexes load on first use. After a failure, or
+        without the default index, returns at once until the retry is due.
+        """
+        if self.state == "ready" or (self.state in ("failed", "degraded") and not self.retry_due()):
+            return self.timings
+        with self._lock:
+            if self.state == "ready" or (self.state in ("failed", "degraded") and not self.retry_due()):
+                return self.timings
+            self.state = "initializing"
+            try:
+                if self.embeddings is None:
+                    with self._phase("imports"):
+                        # Imported up front (used by _load_index) so this phase measures import cost alone.
+                        import rag.cache
+                        import rag.entities
+                        import rag.materialize
+                        import rag.pipeline
+                        from rag.embeddings import create_embeddings
+
+                    with self._phase("embeddings"):
+                        self.embeddings = create_embeddings()
+
+                default = None
+                try:
+                    default = self.indexes.get(DEFAULT_INDEX)
+                    self.timings.update(default.timings)
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {e}"
+                    logger.error("Could not load the index. Please run create_index.py first. Error: %s", e)
+
+                if warm_up is not None and default is not None:
+                    with self._phase("warmup"):
+                        warm_up()
+                if default is None:
+                    self._failed("degraded")
+                else:
+                    self.state, self.error, self.failures = "ready", None, 0
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                self._failed("failed")
+                logger.error("RAG resources failed to initialize: %s", self.error)
+        return self.timings
+
+    def _failed(self, state: str):
+        """Records a failed attempt and schedules the next one (caller holds the lock)."""
+        self.failures += 1
+        self.state = state
+        self._retry_at = time.monotonic() + min(self.retry_seconds * 2 ** (self.failures - 1), 300.0)
+
+    def _load_index(self, name: str, path: str) -> IndexHandle:
+        """Loads one index directory: pipeline, result cache, materialized answers and entity index."""
+        from rag.cache import RetrievalCache
+        from rag.entities import EntityIndex
+        from rag.indexing import load_manifest
+        from rag.materialize import MaterializedViews
+        from rag.pipeline import load_pipeline
+
+        timings = {}
+        with self._phase("index", timings):
+            retriever = load_pipeline(path, self.embeddings)
+            built_with = load_manifest(path).get("embedding_model")
+            if built_with and built_with != self.embeddings.model_id:
+                logger.warning("Index '%s' was built with '%s' but queries use '%s'.", name, built_with, self.embeddings.model_id)
+
+        with self._phase("materialized", timings):
+            materialized = MaterializedViews(path)
+
+        with self._phase("entities", timings):
+            entities = EntityIndex.load(path)
+            if entities is None:
+                logger.warning("No entity index in '%s'; names are used as heard. Re-run create_index.py.", path)
+
+        # Exact (and optionally semantic) result cache. A rebuilt index gets a new handle, and so an empty cache.
+        semantic_threshold = os.getenv("RAG_SEMANTIC_CACHE_THRESHOLD")
+        retrieval_cache = RetrievalCache(
+            max_entries=int(os.getenv("RAG_CACHE_MAX_ENTRIES", "512")),
+            ttl_seconds=float(os.getenv("RAG_CACHE_TTL_SECONDS", "600")),
+            semantic_threshold=float(semantic_threshold) if semantic_threshold else None,
+        )
+        return IndexHandle(name, path, retriever, retrieval_cache, materialized, entities, timings)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "index_loaded": self.indexes.peek(DEFAULT_INDEX) is not None,
+            "indexes_loaded": list(self.indexes.stats()["loaded"]),
+            "error": self.error,
+            "failures": self.failures,
+            "retry_in_s": round(max(0.0, self._retry_at - time.monotonic()), 1)
+            if self.state in ("failed", "degraded") else None,
+            "timings_ms": dict(self.timings),
+        }
+
+    def cache_stats(self) -> dict:
+        if self.embeddings is None:
+            return {"embeddings": None, "indexes": {}}
+        indexes = {}
+        for name in self.indexes.stats()["loaded"]:
+            handle = self.indexes.peek(name)
+            if handle is not None:
+                indexes[name] = {
+                    "retrieval": handle.retrieval_cache.stats() if handle.retrieval_cache is not None else None,
+                    "materialized": handle.materialized.stats() if handle.materialized is not None else None,
+                }
+        return {"embeddings": self.embeddings.stats(), "indexes": indexes}
+
+    @contextmanager
+    def _phase(self, name: str, timings: dict | None = None):
+        timings = self.timings if timings is None else timings
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[name] = round((time.perf_counter() - start_time) * 1000, 2)
@@ -0,0 +1,358 @@
+# rag/store.py
+
+"""
+Memory-mapped vector store.
+
+Layout of an index directory in the "mmap" format:
+
+    store.json   - format metadata (dimensions, count, dtype, index type)
+    vectors.npy  - L2-normalized vectors, opened with np.load(mmap_mode="r")
+    ann.faiss    - optional IVF-PQ or HNSW index over the same rows
+    docs.sqlite  - chunk texts and metadata, keyed by row number
+
+Vectors are memory-mapped, so every worker process on a host shares one copy
+through the page cache instead of holding a private float32 matrix, and the
+documents are read from SQLite on demand instead of unpickled at startup.
+Scores are cosine similarities (inner product of normalized vectors).
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+STORE_META = "store.json"
+VECTORS_FILE = "vectors.npy"
+ANN_FILE = "ann.faiss"
+DOCS_FILE = "docs.sqlite"
+STORE_VERSION = 1
+INDEX_TYPES = ("flat", "ivfpq", "hnsw")
+SEARCH_BLOCK_ROWS = 65536
+
+logger = logging.getLogger(__name__)
+
+
+def is_mmap_store(path: str) -> bool:
+    return os.path.exists(os.path.join(path, STORE_META))
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def matches_filter(metadata: dict, filter: dict) -> bool:
+    for key, expected in filter.items():
+        value = metadata.get(key)
+        if isinstance(expected, (list, tuple, set)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+class StoreWriter:
+    """
+    Appends (chunk_id, text, metadata, vector) records to a new store directory.
+    Vectors are spooled to a raw float32 file and only converted to the final
+    memory-mappable .npy (and optional ANN index) in `finalize()`.
+    """
+
+    def __init__(self, path: str, dtype: str = "float16"):
+        if dtype not in ("float16", "float32"):
+            raise ValueError(f"Unsupported vector dtype '{dtype}'")
+        self.path = path
+        self.dtype = dtype
+        self.dimensions = None
+        self.count = 0
+        os.makedirs(path, exist_ok=True)
+        self._raw_path = os.path.join(path, "vectors.f32.partial")
+        self._raw = open(self._raw_path, "ab")
+        self._docs = sqlite3.connect(os.path.join(path, DOCS_FILE))
+        self._docs.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " row INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE NOT NULL,"
+            " text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+
+    def append(self, chunk_ids, texts, metadatas, vectors):
+        vectors = _normalize(vectors)
+        if not len(vectors):
+            return
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+        elif vectors.shape[1] != self.dimensions:
+            raise ValueError(f"Vector dimension mismatch: {vectors.shape[1]} != {self.dimensions}")
+        rows = range(self.count, self.count + len(vectors))
+        self._docs.executemany(
+            "INSERT INTO docs VALUES (?, ?, ?, ?)",
+            [(row, chunk_id, text, json.dumps(metadata))
+             for row, chunk_id, text, metadata in zip(rows, chunk_ids, texts, metadatas)],
+        )
+        self._raw.write(vectors.tobytes())
+        self.count += len(vectors)
+
+    def checkpoint(self):
+        """Makes every record appended so far durable (see rag/ingest.py)."""
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._docs.commit()
+
+    def rewind(self, count: int, dimensions: int | None):
+        """Reopens a partial store at its last checkpoint, dropping any records appended after it."""
+        self._raw.close()
+        os.truncate(self._raw_path, count * (dimensions or 0) * np.dtype(np.float32).itemsize)
+        self._raw = open(self._raw_path, "ab")
+        self._docs.execute("DELETE FROM docs WHERE row >= ?", (count,))
+        self._docs.commit()
+        self.count, self.dimensions = count, dimensions
+
+    def finalize(self, index_type: str = "flat", **index_params) -> dict:
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}'. Expected one of: {', '.join(INDEX_TYPES)}")
+        self._raw.close()
+        self._docs.commit()
+        self._docs.close()
+
+        dimensions = self.dimensions or 0
+        raw = np.memmap(self._raw_path, dtype=np.float32, mode="r", shape=(self.count, dimensions)) \
+            if self.count else np.empty((0, dimensions), dtype=np.float32)
+        vectors = np.lib.format.open_memmap(
+            os.path.join(self.path, VECTORS_FILE), mode="w+", dtype=self.dtype, shape=(self.count, dimensions))
+        for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+            vectors[start:start + SEARCH_BLOCK_ROWS] = raw[start:start + SEARCH_BLOCK_ROWS]
+        vectors.flush()
+        del vectors, raw
+        os.remove(self._raw_path)
+
+        built_type = _build_ann(self.path, index_type, self.count, dimensions, **index_params)
+        meta = {
+            "format": "mmap",
+            "version": STORE_VERSION,
+            "dimensions": dimensions,
+            "count": self.count,
+            "dtype": self.dtype,
+            "index_type": built_type,
+            "index_params": index_params,
+        }
+        tmp_path = os.path.join(self.path, STORE_META + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, STORE_META))
+        return meta
+
+
+def _build_ann(path: str, index_type: str, count: int, dimensions: int, **params) -> str:
+    """Builds the optional ANN index from vectors.npy. Returns the type actually built."""
+    if index_type == "flat" or count == 0:
+        return "flat"
+    import faiss
+
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+    if index_type == "ivfpq":
+        nlist = params.get("nlist") or max(1, min(4096, int(np.sqrt(count))))
+        # Default to ~8 dimensions per PQ sub-quantizer (96 for 768-d Vertex vectors).
+        m = params.get("m") or next(d for d in range(max(1, dimensions // 8), 0, -1) if dimensions % d == 0)
+        # PQ with 8-bit codes needs enough points to train 256 centroids per sub-quantizer.
+        if count < max(256, 39 * nlist):
+            logger.warning("Only %d vectors; too few to train IVF%d,PQ%d. Falling back to a flat index.", count, nlist, m)
+            return "flat"
+        index = faiss.index_factory(dimensions, f"IVF{nlist},PQ{m}", faiss.METRIC_INNER_PRODUCT)
+        # Train on a bounded sample so the build box never loads the whole matrix.
+        sample = np.sort(np.random.default_rng(0).choice(count, min(count, max(64 * nlist, 65536)), replace=False))
+        index.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+    else:
+        index = faiss.index_factory(dimensions, f"HNSW{params.get('M', 32)}", faiss.METRIC_INNER_PRODUCT)
+    for start in range(0, count, SEARCH_BLOCK_ROWS):
+        index.add(np.ascontiguousarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32))
+    faiss.write_index(index, os.path.join(path, ANN_FILE))
+    return index_type
+
+
+def _read_ann(path: str):
+    """Reads the ANN index memory-mapped where FAISS supports it, else into memory."""
+    import faiss
+
+    for flags in (faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY, 0):
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError:
+            continue
+    raise RuntimeError(f"Could not read ANN index at {path}")
+
+
+class MmapVectorStore(VectorStore):
+    """Read-only vector store over a directory written by StoreWriter."""
+
+    def __init__(self, path: str, embedding, meta: dict, vectors: np.ndarray, ann=None):
+        self.path = path
+        self.embedding = embedding
+        self.meta = meta
+        self.vectors = vectors
+        self.ann = ann
+        self._lock = threading.Lock()
+        self._docs = sqlite3.connect(f"file:{os.path.join(path, DOCS_FILE)}?mode=ro", uri=True, check_same_thread=False)
+
+    @classmethod
+    def load(cls, path: str, embedding, nprobe: int = 16, ef_search: int = 64) -> "MmapVectorStore":
+        with open(os.path.join(path, STORE_META)) as f:
+            meta = json.load(f)
+        if meta.get("format") != "mmap" or meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported store format in {path}: {meta.get('format')} v{meta.get('version')}")
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r") if meta["count"] else \
+            np.empty((0, meta["dimensions"]), dtype=np.float32)
+        ann = None
+        if meta["index_type"] != "flat":
+            ann = _read_ann(os.path.join(path, ANN_FILE))
+            if meta["index_type"] == "ivfpq":
+                ann.nprobe = nprobe
+            elif meta["index_type"] == "hnsw":
+                ann.hnsw.efSearch = ef_search
+        return cls(path, embedding, meta, vectors, ann)
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    # --- Search ---
+
+    def search_vectors(self, queries, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Searches a (n, dim) query matrix; returns (scores, rows), rows padded with -1."""
+        queries = _normalize(np.atleast_2d(queries))
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        if self.ann is not None:
+            return self.ann.search(queries, k)
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter: dict | None = None,
+                                               fetch_k: int = 20, **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vectors([embedding], k, [filter], fetch_k)[0]
+
+    def similarity_search_with_score_by_vectors(self, embeddings, k: int = 4, filters: list | None = None,
+                                                fetch_k: int = 20) -> list[list[tuple[Document, float]]]:
+        """
+        Searches several query vectors with one matrix search and one document
+        lookup. `filters` holds an optional metadata filter per query.
+        """
+        filters = filters or [None] * len(embeddings)
+        scores, rows = self.search_vectors(np.asarray(embeddings, dtype=np.float32),
+                                           fetch_k if any(filters) else k)
+        unique_rows = np.unique(rows[rows >= 0])
+        docs = dict(zip(unique_rows.tolist(), self.get_rows(unique_rows)))
+        results = []
+        for query_scores, query_rows, filter in zip(scores, rows, filters):
+            hits = []
+            for score, row in zip(query_scores, query_rows):
+                doc = docs.get(int(row))
+                if doc is None or (filter and not matches_filter(doc.metadata, filter)):
+                    continue
+                hits.append((doc, float(score)))
+                if len(hits) == k:
+                    break
+            results.append(hits)
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    # --- Document access ---
+
+    def get_rows(self, rows) -> list[Document | None]:
+        """Fetches documents by row number, preserving order (None for missing rows)."""
+        wanted = [int(row) for row in rows if row >= 0]
+        if not wanted:
+            return [None] * len(rows)
+        with self._lock:
+            found = {
+                row: Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+                for row, chunk_id, text, metadata in self._docs.execute(
+                    f"SELECT row, chunk_id, text, metadata FROM docs WHERE row IN ({','.join('?' * len(wanted))})", wanted)
+            }
+        return [found.get(int(row)) for row in rows]
+
+    def get_by_ids(self, ids) -> list[Document]:
+        ids = list(ids)
+        if not ids:
+            return []
+        with self._lock:
+            found = {
+                chunk_id: Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+                for chunk_id, text, metadata in self._docs.execute(
+                    f"SELECT chunk_id, text, metadata FROM docs WHERE chunk_id IN ({','.join('?' * len(ids))})", ids)
+            }
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def iter_records(self, batch_size: int = 1024):
+        """Yields (chunk_ids, texts, metadatas, vectors) batches in row order, for rebuilds."""
+        for start in range(0, len(self), batch_size):
+            with self._lock:
+                rows = self._docs.execute(
+                    "SELECT chunk_id, text, metadata FROM docs WHERE row >= ? AND row < ? ORDER BY row",
+                    (start, start + batch_size)).fetchall()
+            yield ([r[0] for r in rows], [r[1] for r in rows], [json.loads(r[2]) for r in rows],
+                   np.asarray(self.vectors[start:start + len(rows)], dtype=np.float32))
+
+    def close(self):
+        self._docs.close()
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path: str | None = None,
+                   index_type: str = "flat", dtype: str = "float16", **kwargs) -> "MmapVectorStore":
+        if path is None:
+            raise ValueError("MmapVectorStore.from_texts requires a target `path`.")
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(i) for i in range(len(texts))]
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        writer = StoreWriter(path, dtype=dtype)
+        writer.append(ids, texts, metadatas, embedding.embed_documents(texts))
+        writer.finalize(index_type)
+        return cls.load(path, embedding)
+
+
+def load_vector_store(path: str, embedding):
+    """Loads an index directory in either the mmap format or the legacy FAISS pickle format."""
+    if is_mmap_store(path):
+        return MmapVectorStore.load(
+            path, embedding,
+            nprobe=int(os.getenv("RAG_IVF_NPROBE", "16")),
+            ef_search=int(os.getenv("RAG_HNSW_EF_SEARCH", "64")),
+        )
+    from langchain_community.vectorstores import FAISS
+    return FAISS.load_local(path, embedding, allow_dangerous_deserialization=True)
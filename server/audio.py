@@ -0,0 +1,181 @@
+# server/audio.py
+
+"""
+Compressed audio transport for the /ws/{session_id} endpoint.
+
+Raw PCM costs 256 kbit/s from the browser (16 kHz) and 384 kbit/s to it
+(24 kHz). A client that connects with `audio_codec=pcmu` exchanges G.711
+mu-law at 8 kHz instead, 64 kbit/s in each direction, and the server converts
+to and from the PCM the Live API expects:
+
+    uplink:    mu-law 8 kHz -> PCM16 8 kHz -> PCM16 16 kHz -> model
+    downlink:  model -> PCM16 24 kHz -> PCM16 8 kHz -> mu-law 8 kHz
+
+Mu-law is used rather than Opus because both ends are a 256-entry table:
+no native codec library on the server, no WebCodecs in the browser, and no
+packetization, so payloads fit the existing frames unchanged (one byte per
+sample). 8 kHz is telephone bandwidth, which speech recognition and playback
+of the model's voice tolerate well.
+
+Resampling is a windowed-sinc FIR filter whose history is carried from one
+chunk to the next, so chunk boundaries do not click. Each connection has its
+own AudioTranscoder; the work runs on a small shared thread pool (numpy
+releases the GIL) so the event loop keeps pumping other sessions' audio.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from server.metrics import AUDIO_TRANSCODE_LATENCY
+from server.outbound import OUTPUT_SAMPLE_RATE, percentile
+
+INPUT_SAMPLE_RATE = 16000  # Live API input PCM: 16 kHz, 16-bit mono
+CODEC_SAMPLE_RATE = 8000
+CODECS = ("pcm", "pcmu")
+
+transcode_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AUDIO_TRANSCODE_WORKERS", "2")),
+    thread_name_prefix="audio-transcode",
+)
+
+# --- G.711 mu-law ---
+_BIAS = 0x84
+_CLIP = 32635
+
+
+def _build_tables() -> tuple[np.ndarray, np.ndarray]:
+    """(encode table indexed by the uint16 view of a PCM16 sample, decode table indexed by mu-law byte)."""
+    samples = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32)
+    sign = (samples < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(samples), _CLIP) + _BIAS
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    encode = (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    magnitude = ((((codes & 0x0F) << 3) + _BIAS) << exponent) - _BIAS
+    decode = np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+    return encode, decode
+
+
+_ENCODE, _DECODE = _build_tables()
+
+
+def pcm16_to_mulaw(pcm) -> bytes:
+    return _ENCODE[np.frombuffer(pcm, dtype=np.uint16)].tobytes()
+
+
+def mulaw_to_pcm16(data) -> np.ndarray:
+    return _DECODE[np.frombuffer(data, dtype=np.uint8)]
+
+
+# --- Resampling ---
+
+class Resampler:
+    """
+    Streaming rational resampler (upsample by L, low-pass, downsample by M)
+    for PCM16 mono. Keeps the filter history and the decimation phase between
+    calls, so a stream can be converted chunk by chunk.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, taps_per_phase: int = 8):
+        divisor = math.gcd(in_rate, out_rate)
+        self.up, self.down = out_rate // divisor, in_rate // divisor
+        factor = max(self.up, self.down)
+        half = taps_per_phase * factor
+        n = np.arange(-half, half + 1)
+        cutoff = 0.9 / (2 * factor)  # of the upsampled rate; a little below Nyquist for the transition band
+        self.taps = (2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(len(n)) * self.up).astype(np.float32)
+        self._history = np.zeros(len(self.taps) - 1, dtype=np.float32)
+        self._phase = 0  # index of the next output sample within the next upsampled chunk
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if self.up == self.down:
+            return samples.astype(np.int16, copy=False)
+        upsampled = np.zeros(len(samples) * self.up, dtype=np.float32)
+        upsampled[::self.up] = samples
+        signal = np.concatenate((self._history, upsampled))
+        self._history = signal[len(signal) - len(self._history):]
+        filtered = np.convolve(signal, self.taps, mode="valid")  # one output per upsampled input
+        out = filtered[self._phase::self.down]
+        self._phase = (self._phase - len(filtered)) % self.down
+        return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+
+
+# --- Per-connection transcoder ---
+
+class AudioTranscoder:
+    """Mu-law transcoding for one connection, with bitrate and transcode-time stats."""
+
+    mime_type = "audio/pcmu"
+
+    def __init__(self, client_rate: int = CODEC_SAMPLE_RATE, executor: ThreadPoolExecutor | None = None):
+        self.client_rate = client_rate
+        self.executor = executor or transcode_executor
+        self._uplink = Resampler(client_rate, INPUT_SAMPLE_RATE)
+        self._downlink = Resampler(OUTPUT_SAMPLE_RATE, client_rate)
+        self._decode_ms = deque(maxlen=1024)
+        self._encode_ms = deque(maxlen=1024)
+        self.counters = {"frames_in": 0, "frames_out": 0, "bytes_in": 0, "bytes_out": 0,
+                         "pcm_bytes_in": 0, "pcm_bytes_out": 0}
+
+    def pcm_size(self, nbytes: int) -> int:
+        """Size of the model-side PCM a mu-law payload decodes to (for the inbound rate limiter)."""
+        return nbytes * 2 * INPUT_SAMPLE_RATE // self.client_rate
+
+    async def decode(self, payload) -> bytes:
+        """Client mu-law -> 16 kHz PCM16 for the model."""
+        pcm = await self._run(self._decode, bytes(payload), self._decode_ms, "decode")
+        self.counters["frames_in"] += 1
+        self.counters["bytes_in"] += len(payload)
+        self.counters["pcm_bytes_in"] += len(pcm)
+        return pcm
+
+    async def encode(self, pcm: bytes) -> bytes:
+        """24 kHz PCM16 from the model -> client mu-law."""
+        data = await self._run(self._encode, pcm, self._encode_ms, "encode")
+        self.counters["frames_out"] += 1
+        self.counters["bytes_out"] += len(data)
+        self.counters["pcm_bytes_out"] += len(pcm)
+        return data
+
+    def _decode(self, data: bytes) -> bytes:
+        return self._uplink.process(mulaw_to_pcm16(data)).tobytes()
+
+    def _encode(self, pcm: bytes) -> bytes:
+        return pcm16_to_mulaw(self._downlink.process(np.frombuffer(pcm, dtype=np.int16)))
+
+    async def _run(self, func, data, samples: deque, direction: str):
+        started = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(self.executor, func, data)
+        elapsed = time.perf_counter() - started
+        samples.append(elapsed * 1000)
+        AUDIO_TRANSCODE_LATENCY.observe(elapsed, direction)
+        return result
+
+    def stats(self) -> dict:
+        seconds_in = self.counters["bytes_in"] / self.client_rate
+        seconds_out = self.counters["bytes_out"] / self.client_rate
+        return {
+            "codec": "pcmu",
+            "sample_rate": self.client_rate,
+            "audio_seconds_in": round(seconds_in, 1),
+            "audio_seconds_out": round(seconds_out, 1),
+            "kbit_per_s_in": round(self.counters["bytes_in"] * 8 / seconds_in / 1000, 1) if seconds_in else None,
+            "kbit_per_s_out": round(self.counters["bytes_out"] * 8 / seconds_out / 1000, 1) if seconds_out else None,
+            # What the same audio costs as raw PCM on the wire (16 kHz in, 24 kHz out).
+            "pcm_kbit_per_s_in": INPUT_SAMPLE_RATE * 16 // 1000,
+            "pcm_kbit_per_s_out": OUTPUT_SAMPLE_RATE * 16 // 1000,
+            "decode_ms_p50": percentile(self._decode_ms, 0.50),
+            "decode_ms_p99": percentile(self._decode_ms, 0.99),
+            "encode_ms_p50": percentile(self._encode_ms, 0.50),
+            "encode_ms_p99": percentile(self._encode_ms, 0.99),
+            **self.counters,
+        }
@@ -0,0 +1,150 @@
+# server/frames.py
+
+"""
+Server-side pipeline for camera/screen frames sent over /ws/{session_id}.
+
+The browser captures a frame every second whether or not anything changed.
+Before a frame reaches the model it is:
+
+    1. rate-gated while frames are streaming: at most one frame is examined
+       per `burst_interval` while there is activity (the user is talking or
+       typing, a tool was called, or the scene just changed) and one per
+       `idle_interval` otherwise. A frame arriving after a pause (e.g. an
+       uploaded photo) is always examined;
+    2. decoded with Pillow (JPEG draft mode decodes at reduced scale) and
+       compared with the last forwarded frame by a 64-bit difference hash;
+       near-duplicates are dropped;
+    3. downsized to `max_size` and re-encoded as JPEG when needed.
+
+Frames are processed by one task per connection that always takes the newest
+pending frame, so decoding never delays the audio read loop and a backlog is
+never forwarded.
+"""
+
+import asyncio
+import io
+import logging
+import time
+
+from google.genai.types import Blob
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # 8x8 comparisons -> 64-bit hash
+
+
+def difference_hash(image: Image.Image) -> int:
+    """dHash: compares horizontally adjacent pixels of a 9x8 grayscale thumbnail."""
+    small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def prepare_frame(data: bytes, max_size: int, jpeg_quality: int = 80) -> tuple[bytes, int]:
+    """
+    Decodes a frame and returns (JPEG bytes no larger than `max_size`, dHash).
+    The original bytes are reused when they are already a small enough JPEG.
+    """
+    image = Image.open(io.BytesIO(data))
+    oversized = max(image.size) > max_size
+    if image.format == "JPEG" and oversized:
+        image.draft("RGB", (max_size, max_size))  # DCT scaling: decode at 1/2, 1/4 or 1/8 size
+    image.load()
+    frame_hash = difference_hash(image)
+
+    if image.format == "JPEG" and not oversized:
+        return data, frame_hash
+    image = image.convert("RGB")
+    image.thumbnail((max_size, max_size), Image.Resampling.BILINEAR)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=jpeg_quality)
+    return out.getvalue(), frame_hash
+
+
+class FramePipeline:
+    """Deduplicates, downsizes and paces the image frames of one connection."""
+
+    def __init__(self, live_request_queue, max_size: int = 768, dedupe_distance: int = 6,
+                 scene_change_distance: int = 16, burst_interval: float = 0.5, idle_interval: float = 4.0,
+                 activity_window: float = 6.0):
+        self.live_request_queue = live_request_queue
+        self.max_size = max_size
+        self.dedupe_distance = dedupe_distance
+        self.scene_change_distance = scene_change_distance
+        self.burst_interval = burst_interval
+        self.idle_interval = idle_interval
+        self.activity_window = activity_window
+        self._last_hash = None
+        self._last_checked_at = float("-inf")
+        self._last_received_at = float("-inf")
+        self.stream_gap = 2.0  # seconds without frames after which the stream counts as stopped
+        self._last_activity = float("-inf")
+        self._pending = None
+        self._wakeup = asyncio.Event()
+        self.counters = {"received": 0, "forwarded": 0, "duplicates": 0, "rate_skipped": 0, "superseded": 0,
+                         "undecodable": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def note_activity(self):
+        """User speech/text or a tool call: switch to the burst frame rate."""
+        self._last_activity = time.monotonic()
+
+    def current_interval(self) -> float:
+        active = time.monotonic() - self._last_activity < self.activity_window
+        return self.burst_interval if active else self.idle_interval
+
+    def submit(self, data: bytes, mime_type: str):
+        """Queues a frame from the client, replacing any frame not yet processed."""
+        self.counters["received"] += 1
+        self.counters["bytes_in"] += len(data)
+        now = time.monotonic()
+        streaming = now - self._last_received_at < self.stream_gap
+        self._last_received_at = now
+        if streaming and now - self._last_checked_at < self.current_interval():
+            self.counters["rate_skipped"] += 1
+            return
+        self._last_checked_at = now
+        if self._pending is not None:
+            self.counters["superseded"] += 1
+        self._pending = (data, mime_type)
+        self._wakeup.set()
+
+    async def run(self):
+        """Processes the newest pending frame off the event loop until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._pending is None:
+                continue
+            data, mime_type = self._pending
+            self._pending = None
+            try:
+                jpeg, frame_hash = await loop.run_in_executor(None, prepare_frame, data, self.max_size)
+            except Exception as e:
+                self.counters["undecodable"] += 1
+                logger.debug("Dropping undecodable %s frame: %s", mime_type, e)
+                continue
+            self._forward_if_changed(jpeg, frame_hash)
+
+    def _forward_if_changed(self, jpeg: bytes, frame_hash: int):
+        if self._last_hash is not None:
+            distance = hamming_distance(frame_hash, self._last_hash)
+            if distance <= self.dedupe_distance:
+                self.counters["duplicates"] += 1
+                return
+            if distance >= self.scene_change_distance:
+                self.note_activity()  # e.g. the user just held up their notes
+        self._last_hash = frame_hash
+        self.live_request_queue.send_realtime(Blob(data=jpeg, mime_type="image/jpeg"))
+        self.counters["forwarded"] += 1
+        self.counters["bytes_out"] += len(jpeg)
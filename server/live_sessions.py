@@ -0,0 +1,224 @@
+# server/live_sessions.py
+
+"""
+Lifecycle of live (WebSocket-connected) agent sessions.
+
+Every connection is registered with the `LiveSessionManager`, which owns its
+teardown: closing the LiveRequestQueue, cancelling *and awaiting* the
+messaging tasks, closing the run_live generator and the Runner, and flushing
+the session service. It also enforces a cap on concurrent live sessions,
+disconnects sessions idle for too long, lets a reconnect with the same
+session_id take over from a stale connection, and reports gauges.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+
+from server.outbound import percentile
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LiveSession:
+    """One connected client and everything that must be released when it goes away."""
+    session_id: str
+    websocket: WebSocket
+    runner: object
+    live_events: object
+    live_request_queue: object
+    session: object
+    outbound: object = None  # server.outbound.OutboundScheduler
+    inbound: object = None  # server.outbound.InboundRateLimiter
+    frames: object = None  # server.frames.FramePipeline
+    audio: object = None  # server.audio.AudioTranscoder when the client negotiated compressed audio
+    recorder: object = None  # server.recorder.SessionRecorder when SESSION_RECORDING=1
+    tasks: list = field(default_factory=list)
+    connected_at: float = field(default_factory=time.monotonic)
+    last_activity: float = field(default_factory=time.monotonic)
+    closed: bool = False
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def queue_depth(self) -> int:
+        queue = getattr(self.live_request_queue, "_queue", None)
+        return queue.qsize() if queue is not None else 0
+
+
+class LiveSessionManager:
+    """
+    Tracks live sessions for one worker.
+
+    `max_sessions` caps concurrent connections, `idle_seconds` disconnects
+    clients with no traffic in either direction, and, for session services
+    without their own expiry (`expire_sessions=True`, i.e. the in-memory one),
+    stored sessions are deleted `resume_seconds` after their client left.
+    """
+
+    def __init__(self, session_service, app_name: str, max_sessions: int = 200, idle_seconds: float = 900,
+                 resume_seconds: float = 1800, expire_sessions: bool = False, reap_interval: float = 30):
+        self.session_service = session_service
+        self.app_name = app_name
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.resume_seconds = resume_seconds
+        self.expire_sessions = expire_sessions
+        self.reap_interval = reap_interval
+        self._active: dict[str, LiveSession] = {}
+        self._reserved: set[str] = set()
+        self._disconnected: dict[str, float] = {}  # session_id -> monotonic time the client left
+        self._reaper = None
+        self.counters = {"opened": 0, "closed": 0, "rejected": 0, "resumed": 0, "superseded": 0, "idle_closed": 0}
+
+    async def admit(self, session_id: str) -> bool:
+        """
+        Reserves a slot for `session_id`. A live connection with the same ID is
+        closed first (the client reconnected); returns False at capacity.
+        """
+        previous = self._active.get(session_id)
+        if previous is not None:
+            self.counters["superseded"] += 1
+            await self.close(previous, reason="superseded by a new connection")
+        if session_id not in self._reserved and len(self._active) + len(self._reserved) >= self.max_sessions:
+            self.counters["rejected"] += 1
+            return False
+        self._reserved.add(session_id)
+        if self._disconnected.pop(session_id, None) is not None:
+            self.counters["resumed"] += 1
+        return True
+
+    def release(self, session_id: str):
+        """Gives back a reservation whose session never started."""
+        self._reserved.discard(session_id)
+
+    def register(self, live: LiveSession):
+        self._reserved.discard(live.session_id)
+        self._active[live.session_id] = live
+        self.counters["opened"] += 1
+
+    def is_current(self, session_id: str, live: LiveSession | None) -> bool:
+        """
+        Whether `live` (None: a connection that never registered) is still the
+        connection of `session_id`, i.e. no reconnect has taken the ID over.
+        """
+        current = self._active.get(session_id)
+        return current is live if live is not None else current is None
+
+    async def close(self, live: LiveSession, reason: str = "disconnected"):
+        """Releases everything held by `live`. Safe to call more than once."""
+        if live.closed:
+            return
+        live.closed = True
+        if self._active.get(live.session_id) is live:
+            del self._active[live.session_id]
+            self._disconnected[live.session_id] = time.monotonic()
+
+        # Ends the upstream live connection; run_live stops reading once it sees the close request.
+        live.live_request_queue.close()
+
+        current = asyncio.current_task()
+        pending = [task for task in live.tasks if task is not current and not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        try:
+            await live.live_events.aclose()
+        except Exception as e:
+            logger.warning("Error closing live events for #%s: %s", live.session_id, e)
+        close_runner = getattr(live.runner, "close", None)
+        if close_runner is not None:
+            try:
+                await close_runner()
+            except Exception as e:
+                logger.warning("Error closing runner for #%s: %s", live.session_id, e)
+        # Write-behind backends buffer state changes; persist them before the session is gone.
+        if hasattr(self.session_service, "flush"):
+            try:
+                await self.session_service.flush()
+            except Exception as e:
+                logger.warning("Error flushing session state for #%s: %s", live.session_id, e)
+
+        if live.websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await live.websocket.close(code=1000 if reason == "disconnected" else 1001, reason=reason[:120])
+            except Exception:
+                pass
+        self.counters["closed"] += 1
+        logger.info("Live session #%s closed (%s) after %.0f s.", live.session_id, reason, time.monotonic() - live.connected_at)
+
+    def start(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_loop())
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.exception("Live session reaper failed: %s", e)
+
+    async def reap(self):
+        """Closes idle connections and (if enabled) deletes sessions past their resume window."""
+        now = time.monotonic()
+        for live in list(self._active.values()):
+            if now - live.last_activity > self.idle_seconds:
+                self.counters["idle_closed"] += 1
+                await self.close(live, reason="idle timeout")
+
+        for session_id, left_at in list(self._disconnected.items()):
+            if now - left_at <= self.resume_seconds:
+                continue
+            del self._disconnected[session_id]
+            if self.expire_sessions and session_id not in self._active:
+                await self.session_service.delete_session(
+                    app_name=self.app_name, user_id=session_id, session_id=session_id)
+
+    async def shutdown(self):
+        """Stops the reaper and closes every live session (server shutdown)."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+        for live in list(self._active.values()):
+            await self.close(live, reason="server shutting down")
+
+    def stats(self) -> dict:
+        lives = list(self._active.values())
+        stats = {
+            "active_sessions": len(lives),
+            "starting_sessions": len(self._reserved),
+            "max_sessions": self.max_sessions,
+            "active_tasks": sum(1 for live in lives for task in live.tasks if not task.done()),
+            "live_queue_depth": sum(live.queue_depth() for live in lives),
+            "max_live_queue_depth": max((live.queue_depth() for live in lives), default=0),
+            "resumable_sessions": len(self._disconnected),
+            **self.counters,
+        }
+        for live in lives:
+            if live.outbound is not None:
+                for name, value in live.outbound.stats().items():
+                    if not name.startswith("first_audio"):
+                        stats[f"outbound_{name}"] = stats.get(f"outbound_{name}", 0) + value
+            if live.inbound is not None:
+                for name, value in live.inbound.counters.items():
+                    stats[f"inbound_{name}"] = stats.get(f"inbound_{name}", 0) + value
+            if live.frames is not None:
+                for name, value in live.frames.counters.items():
+                    stats[f"frames_{name}"] = stats.get(f"frames_{name}", 0) + value
+        # Compressed audio is reported per session: bitrate and transcode time vary with each client's link.
+        stats["audio_transcoding"] = {live.session_id: live.audio.stats() for live in lives if live.audio is not None}
+        first_audio = [ms for live in lives if live.outbound is not None for ms in live.outbound.first_audio_samples()]
+        stats["first_audio_queue_ms_p50"] = percentile(first_audio, 0.50)
+        stats["first_audio_queue_ms_p99"] = percentile(first_audio, 0.99)
+        cache_size = getattr(self.session_service, "cache_size", None)
+        if cache_size is not None:
+            stats["cached_sessions"] = cache_size()
+        return stats
@@ -0,0 +1,199 @@
+# server/metrics.py
+
+"""
+In-process metrics with a Prometheus text exposition (GET /metrics) and
+optional OpenTelemetry spans.
+
+The metric types are deliberately minimal (no client library dependency):
+counters and histograms keyed by label values, plus callback gauges that are
+evaluated only when /metrics is scraped. Recording is a dict lookup and a
+bisect under a lock. With METRICS_ENABLED=0 every record call returns
+immediately, and spans are only created when OTEL_TRACES=1 and the
+opentelemetry API is installed.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Latency buckets (seconds) from 1 ms to 30 s.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        lines += [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        if not ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observes the duration of the `with` block (also when it raises)."""
+        if not ENABLED:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauges read at scrape time: `callback()` returns {label value tuple: value}."""
+
+    def __init__(self, name: str, help: str, callback, labels: tuple = ()):
+        self.name, self.help, self.callback, self.label_names = name, help, callback, labels
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception:
+            return lines
+        lines += [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                  for key, value in values.items() if value is not None]
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Metric definitions ---
+TOOL_LATENCY = REGISTRY.register(Histogram(
+    "catalyst_tool_latency_seconds", "End-to-end tool call latency.", ("tool",)))
+TOOL_QUEUE_WAIT = REGISTRY.register(Histogram(
+    "catalyst_tool_queue_wait_seconds", "Time tool work waited for a tool executor thread.", ("tool",)))
+RAG_PHASE_LATENCY = REGISTRY.register(Histogram(
+    "catalyst_rag_phase_seconds", "Retrieval latency by phase (embedding, vector_search, bm25, fusion, formatting).",
+    ("phase",)))
+TOOL_RESPONSE_TOKENS = REGISTRY.register(Histogram(
+    "catalyst_tool_response_tokens", "Estimated tokens of retrieved context returned to the model, after compression.",
+    ("tool",), buckets=(25, 50, 100, 200, 400, 800, 1600, 3200)))
+RAG_BATCH_SIZE = REGISTRY.register(Histogram(
+    "catalyst_rag_batch_size", "Distinct queries per batched retrieval.", buckets=(1, 2, 4, 8, 16, 32, 64)))
+RAG_COALESCED = REGISTRY.register(Counter(
+    "catalyst_rag_coalesced_total", "Retrievals served by joining an identical in-flight retrieval."))
+PREFETCH = REGISTRY.register(Counter(
+    "catalyst_prefetch_total", "Speculative next-step tool runs by outcome (started, hits, stale, expired, ...).",
+    ("tool", "outcome")))
+BATCH_RECORDS = REGISTRY.register(Counter(
+    "catalyst_batch_records_total", "Meeting-note records processed by POST /batch/recaps.", ("status",)))
+TURN_LATENCY = REGISTRY.register(Histogram(
+    "catalyst_turn_latency_seconds", "Last user input (speech transcription or text) to first model audio sent."))
+AUDIO_TRANSCODE_LATENCY = REGISTRY.register(Histogram(
+    "catalyst_audio_transcode_seconds", "Compressed audio transcoding time per frame (decode: client to model).",
+    ("direction",)))
+WS_BYTES = REGISTRY.register(Counter(
+    "catalyst_websocket_bytes_total", "WebSocket payload bytes.", ("direction", "kind")))
+WS_MESSAGES = REGISTRY.register(Counter(
+    "catalyst_websocket_messages_total", "WebSocket messages.", ("direction", "kind")))
+
+
+def register_gauges(name: str, help: str, callback, labels: tuple = ()):
+    REGISTRY.register(GaugeCallback(name, help, callback, labels))
+
+
+# --- Tracing ---
+_tracer = None
+if os.getenv("OTEL_TRACES", "0") == "1":
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("sales-catalyst")
+    except ImportError:
+        _tracer = None
+
+
+def span(name: str, **attributes):
+    """An OpenTelemetry span when tracing is enabled, otherwise a no-op context manager."""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+@contextmanager
+def phase(name: str):
+    """Times a retrieval phase into RAG_PHASE_LATENCY and (optionally) a span."""
+    if not ENABLED and _tracer is None:
+        yield
+        return
+    with span(f"rag.{name}"), RAG_PHASE_LATENCY.time(name):
+        yield
@@ -0,0 +1,290 @@
+# server/outbound.py
+
+"""
+Per-connection flow control for the /ws/{session_id} endpoint.
+
+OutboundScheduler sits between the run_live event stream and the WebSocket.
+Events are queued instead of awaited, so a slow client never stalls the model
+stream, and a single sender task drains the queues in priority order:
+
+    1. control and text  (turn_complete / interrupted, transcriptions, replies)
+    2. audio             (small PCM chunks coalesced into larger frames,
+                          mu-law encoded when the client negotiated it)
+    3. dev-mode payloads (tool calls and tool results)
+
+Every queue is bounded: audio keeps at most `max_audio_buffer_ms` of sound
+(the oldest is dropped first), dev payloads drop the oldest entry, only the
+latest partial transcription is kept, and a client that still cannot keep up
+with control messages is disconnected. An interruption discards queued audio.
+After turn_complete, the next turn's first audio frame (the first-audio
+latency sample) is only taken once the finished turn's queued audio is sent.
+
+InboundRateLimiter applies per-mime-type token buckets to client frames and
+skips image frames while the model input queue is backed up (a newer frame
+will follow, so an old one is only extra latency). Rejected user text is
+answered with a "text/throttled" message rather than dropped silently.
+"""
+
+import asyncio
+import base64
+import json
+import time
+from collections import deque
+
+from server.metrics import TURN_LATENCY, WS_BYTES, WS_MESSAGES
+from server.protocol import KIND_AUDIO_PCM, KIND_AUDIO_PCMU, encode_frame, encode_frame_chunks
+
+PRIORITY_CONTROL = 0
+PRIORITY_AUDIO = 1
+PRIORITY_DEV = 2
+
+OUTPUT_SAMPLE_RATE = 24000  # Live API output PCM: 24 kHz, 16-bit mono
+OUTPUT_BYTES_PER_MS = OUTPUT_SAMPLE_RATE * 2 // 1000
+
+
+class OutboundOverflow(RuntimeError):
+    """Raised when a client falls so far behind that even control messages back up."""
+
+
+def percentile(samples, fraction: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 2)
+
+
+class OutboundScheduler:
+    """Bounded, prioritized outbound queues for one WebSocket connection."""
+
+    def __init__(self, websocket, binary: bool = False, max_audio_buffer_ms: int = 5000,
+                 audio_frame_ms: int = 200, max_control_messages: int = 512, max_dev_messages: int = 32,
+                 transcoder=None):
+        self.websocket = websocket
+        self.binary = binary
+        self.transcoder = transcoder  # server.audio.AudioTranscoder for compressed audio, None for PCM
+        self.max_audio_bytes = max_audio_buffer_ms * OUTPUT_BYTES_PER_MS
+        self.audio_frame_bytes = audio_frame_ms * OUTPUT_BYTES_PER_MS
+        self.max_control_messages = max_control_messages
+        self.max_dev_messages = max_dev_messages
+        self._control = deque()
+        self._audio = deque()  # (enqueued_at, bytes)
+        self._audio_bytes = 0
+        self._dev = deque()
+        self._pending_transcription = None  # the queued partial transcription message, if any
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._awaiting_first_audio = True
+        self._turn_end_chunks = 0  # queued audio chunks of completed turns, still to be sent
+        self._first_audio_ms = deque(maxlen=1024)
+        self._user_input_at = None  # last user speech/text before the model's answer
+        self.counters = {
+            "messages_sent": 0, "audio_frames_sent": 0, "audio_chunks_coalesced": 0, "bytes_sent": 0,
+            "audio_bytes_dropped": 0, "audio_bytes_flushed": 0, "dev_messages_dropped": 0,
+            "transcriptions_superseded": 0,
+        }
+
+    # --- Producers (called from agent_to_client_messaging; never block) ---
+
+    def send_json(self, message: dict, priority: int = PRIORITY_CONTROL):
+        if priority == PRIORITY_DEV:
+            if len(self._dev) >= self.max_dev_messages:
+                self._dev.popleft()
+                self.counters["dev_messages_dropped"] += 1
+            self._dev.append(message)
+        elif message.get("mime_type") == "text/transcription" and self._pending_transcription is not None:
+            # The client only shows the latest partial transcription; replace the queued one.
+            self._pending_transcription.clear()
+            self._pending_transcription.update(message)
+            self.counters["transcriptions_superseded"] += 1
+        else:
+            if len(self._control) >= self.max_control_messages:
+                raise OutboundOverflow(f"{len(self._control)} control messages queued; client is not reading")
+            self._control.append(message)
+            if message.get("mime_type") == "text/transcription":
+                self._pending_transcription = message
+        self._drained.clear()
+        self._wakeup.set()
+
+    def send_audio(self, pcm: bytes):
+        self._audio.append((time.perf_counter(), pcm))
+        self._audio_bytes += len(pcm)
+        while self._audio_bytes > self.max_audio_bytes and len(self._audio) > 1:
+            _, dropped = self._audio.popleft()
+            self._audio_bytes -= len(dropped)
+            self.counters["audio_bytes_dropped"] += len(dropped)
+            self._turn_audio_sent(1)
+        self._drained.clear()
+        self._wakeup.set()
+
+    def interrupt(self):
+        """The user barged in: queued audio is stale, drop it and send the interruption first."""
+        self.counters["audio_bytes_flushed"] += self._audio_bytes
+        self._audio.clear()
+        self._audio_bytes = 0
+        self._turn_end_chunks = 0
+        self._awaiting_first_audio = True
+
+    def turn_complete(self):
+        """The model finished its turn; its audio still queued is sent before the next turn's first frame."""
+        if self._audio:
+            self._turn_end_chunks = len(self._audio)
+        else:
+            self._awaiting_first_audio = True
+
+    def _turn_audio_sent(self, chunks: int):
+        if self._turn_end_chunks:
+            self._turn_end_chunks = max(0, self._turn_end_chunks - chunks)
+            if not self._turn_end_chunks:
+                self._awaiting_first_audio = True
+
+    def mark_user_input(self):
+        """User speech (input transcription) or text arrived; the next first audio frame ends the turn latency."""
+        self._user_input_at = time.perf_counter()
+
+    # --- Sender ---
+
+    async def run(self):
+        """Drains the queues in priority order until cancelled."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._control or self._audio or self._dev:
+                if self._control:
+                    message = self._control.popleft()
+                    if message is self._pending_transcription:
+                        self._pending_transcription = None
+                    await self._send_text(json.dumps(message))
+                elif self._audio:
+                    await self._send_audio_frame()
+                else:
+                    await self._send_text(json.dumps(self._dev.popleft()))
+            self._drained.set()
+
+    async def drain(self, timeout: float = 5.0):
+        """Waits (up to `timeout` seconds) until everything queued has been sent."""
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _send_text(self, text: str):
+        await self.websocket.send_text(text)
+        self.counters["messages_sent"] += 1
+        self.counters["bytes_sent"] += len(text)
+        WS_MESSAGES.inc(1, "out", "text")
+        WS_BYTES.inc(len(text), "out", "text")
+
+    async def _send_audio_frame(self):
+        # Coalesce whatever has queued up (without waiting for more) into one frame,
+        # but never across the end of a turn.
+        first_enqueued_at, chunk = self._audio.popleft()
+        chunks, size = [chunk], len(chunk)
+        while (self._audio and size + len(self._audio[0][1]) <= self.audio_frame_bytes
+               and (not self._turn_end_chunks or len(chunks) < self._turn_end_chunks)):
+            chunk = self._audio.popleft()[1]
+            chunks.append(chunk)
+            size += len(chunk)
+        self._audio_bytes -= size
+        self.counters["audio_chunks_coalesced"] += len(chunks) - 1
+
+        if self.transcoder is not None:
+            payload = await self.transcoder.encode(b"".join(chunks))
+            if self.binary:
+                frame = encode_frame(KIND_AUDIO_PCMU, payload)
+                await self.websocket.send_bytes(frame)
+                sent, kind = len(frame), "binary"
+            else:
+                text = json.dumps({"mime_type": self.transcoder.mime_type,
+                                   "data": base64.b64encode(payload).decode("ascii")})
+                await self.websocket.send_text(text)
+                sent, kind = len(text), "text"
+        elif self.binary:
+            frame = encode_frame_chunks(KIND_AUDIO_PCM, chunks)
+            await self.websocket.send_bytes(frame)
+            sent, kind = len(frame), "binary"
+        else:
+            text = json.dumps({"mime_type": "audio/pcm", "data": base64.b64encode(b"".join(chunks)).decode("ascii")})
+            await self.websocket.send_text(text)
+            sent, kind = len(text), "text"
+        self.counters["bytes_sent"] += sent
+        self.counters["audio_frames_sent"] += 1
+        WS_MESSAGES.inc(1, "out", kind)
+        WS_BYTES.inc(sent, "out", kind)
+
+        if self._awaiting_first_audio:
+            self._awaiting_first_audio = False
+            now = time.perf_counter()
+            self._first_audio_ms.append((now - first_enqueued_at) * 1000)
+            if self._user_input_at is not None:
+                TURN_LATENCY.observe(now - self._user_input_at)
+                self._user_input_at = None
+        self._turn_audio_sent(len(chunks))
+
+    def first_audio_samples(self) -> list[float]:
+        """Queueing delay (ms) of the first audio frame of recent turns."""
+        return list(self._first_audio_ms)
+
+    def stats(self) -> dict:
+        return {
+            "queued_control": len(self._control),
+            "queued_audio_bytes": self._audio_bytes,
+            "queued_dev": len(self._dev),
+            "first_audio_queue_ms_p50": percentile(self._first_audio_ms, 0.50),
+            "first_audio_queue_ms_p99": percentile(self._first_audio_ms, 0.99),
+            **self.counters,
+        }
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class InboundRateLimiter:
+    """
+    Per-connection limits on client frames. Audio is metered in bytes (16 kHz
+    PCM16 is 32 000 B/s in real time), images and text in messages.
+    """
+
+    def __init__(self, audio_bytes_per_second: float = 64000, image_fps: float = 2, text_per_second: float = 5,
+                 max_image_backlog: int = 8):
+        self.buckets = {
+            "audio": TokenBucket(audio_bytes_per_second, audio_bytes_per_second),
+            "image": TokenBucket(image_fps, max(1.0, image_fps * 2)),
+            "text": TokenBucket(text_per_second, text_per_second * 2),
+        }
+        self.max_image_backlog = max_image_backlog
+        self.counters = {"accepted": 0, "rate_limited": 0, "stale_images_skipped": 0}
+
+    def allow(self, mime_type: str, size: int, backlog: int = 0) -> bool:
+        """Whether to forward a client frame; `backlog` is the live request queue depth."""
+        category = mime_type.split("/", 1)[0]
+        if category == "image" and backlog > self.max_image_backlog:
+            self.counters["stale_images_skipped"] += 1
+            return False
+        bucket = self.buckets.get(category)
+        if bucket is not None and not bucket.take(size if category == "audio" else 1):
+            self.counters["rate_limited"] += 1
+            return False
+        self.counters["accepted"] += 1
+        return True
+
+    def retry_after_ms(self, mime_type: str) -> int:
+        """How long until a frame of this type would be accepted again."""
+        bucket = self.buckets.get(mime_type.split("/", 1)[0])
+        if bucket is None or bucket.tokens >= 1:
+            return 0
+        return int((1 - bucket.tokens) / bucket.rate * 1000) + 1
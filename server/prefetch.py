@@ -0,0 +1,243 @@
+# server/prefetch.py
+
+"""
+Speculative prefetch of the agent's next tool call.
+
+The agent's workflows are sequential (briefing -> product information ->
+competitor comparison; recap -> invite -> email), so once a tool succeeds
+the next call is usually predictable. After every successful tool call
+`Prefetcher.after()` asks `predict(tool_name, state)` for the likely next
+calls and runs them in the background for that session:
+
+    * a speculative run sees a copy of the session state that records which
+      keys it reads and writes; the real session is never touched;
+    * the result is kept per session for `ttl` seconds. When the model makes
+      that call, `take()` returns it (waiting for it if it is still running)
+      and applies the recorded state writes - provided the keys it read still
+      hold the same values; otherwise it is discarded and the tool runs
+      normally;
+    * everything a session prefetched is cancelled when it disconnects
+      (`drop_session()`).
+"""
+
+import asyncio
+import contextvars
+import inspect
+import json
+import logging
+import time
+
+from rag.keys import normalize_query
+from server.metrics import PREFETCH
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class _RecordingState(dict):
+    """A copy of session state that records the keys read (with their values) and written."""
+
+    def __init__(self, state):
+        super().__init__(state or {})
+        self.reads: dict = {}
+        self.writes: dict = {}
+
+    def __bool__(self):
+        return True  # tools replace a falsy (empty) state with a fresh dict, which would bypass recording
+
+    def _record(self, key):
+        if key not in self.reads and key not in self.writes:
+            self.reads[key] = dict.get(self, key, _MISSING)
+
+    def get(self, key, default=None):
+        self._record(key)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self._record(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self._record(key)
+        return super().__contains__(key)
+
+    def __setitem__(self, key, value):
+        self.writes[key] = value
+        super().__setitem__(key, value)
+
+
+class _SpeculativeSession:
+    """Stands in for the session (via the session context variable) during a speculative run."""
+
+    def __init__(self, session):
+        self.id = session.id
+        self.state = _RecordingState(session.state)
+
+
+class _Entry:
+    __slots__ = ("tool_name", "task", "expires_at")
+
+    def __init__(self, tool_name: str, task: asyncio.Task, expires_at: float):
+        self.tool_name = tool_name
+        self.task = task
+        self.expires_at = expires_at
+
+
+class Prefetcher:
+    """Runs the predicted next tool calls of each session in the background and serves their results."""
+
+    def __init__(self, session_var: contextvars.ContextVar, predict, ttl: float = 30.0, max_inflight: int = 16,
+                 enabled: bool = True):
+        self.session_var = session_var
+        self.predict = predict  # predict(tool_name, state) -> [(next tool name, kwargs)]
+        self.ttl = ttl
+        self.max_inflight = max_inflight
+        self.enabled = enabled
+        self.inflight = 0
+        self.counters = {"started": 0, "hits": 0, "joined": 0, "stale": 0, "expired": 0, "failed": 0,
+                         "cancelled": 0, "skipped": 0}
+        self._tools: dict[str, tuple] = {}  # name -> (undecorated function, signature)
+        self._sessions: dict[str, dict[tuple, _Entry]] = {}
+
+    def register(self, func):
+        """Makes a tool function available for speculative runs (called by the tool decorator)."""
+        self._tools[func.__name__] = (func, inspect.signature(func))
+
+    # --- Serving ---
+
+    async def take(self, session, tool_name: str, args: tuple, kwargs: dict):
+        """(True, result) when this call was prefetched (waiting for it if still running), else (False, None)."""
+        entry = self._pop(session, tool_name, args, kwargs)
+        if entry is None:
+            return False, None
+        if not entry.task.done():
+            self._count("joined", tool_name)
+            try:
+                await asyncio.shield(entry.task)
+            except Exception:
+                pass
+        return self._apply(session, entry)
+
+    def take_nowait(self, session, tool_name: str, args: tuple, kwargs: dict):
+        """Like take() for synchronous tools: only a finished prefetch is used."""
+        entry = self._pop(session, tool_name, args, kwargs)
+        if entry is None:
+            return False, None
+        if not entry.task.done():
+            self._sessions.setdefault(session.id, {})[self._key(tool_name, args, kwargs)] = entry  # still useful later
+            return False, None
+        return self._apply(session, entry)
+
+    def _pop(self, session, tool_name: str, args: tuple, kwargs: dict) -> _Entry | None:
+        entries = self._sessions.get(getattr(session, "id", None))
+        if not entries or tool_name not in self._tools:
+            return None
+        self._expire(entries)
+        try:
+            key = self._key(tool_name, args, kwargs)
+        except TypeError:
+            return None  # arguments the tool itself will reject
+        return entries.pop(key, None)
+
+    def _apply(self, session, entry: _Entry):
+        if entry.task.cancelled() or entry.task.exception() is not None:
+            self._count("failed", entry.tool_name)
+            return False, None
+        result, reads, writes = entry.task.result()
+        state = session.state or {}
+        if any(state.get(key, _MISSING) != value for key, value in reads.items()):
+            self._count("stale", entry.tool_name)
+            return False, None
+        if writes:
+            if not session.state:
+                session.state = {}
+            session.state.update(writes)
+        self._count("hits", entry.tool_name)
+        return True, result
+
+    # --- Prefetching ---
+
+    def after(self, session, tool_name: str, result):
+        """Starts the predicted follow-up calls of a successful tool call. Must run on the event loop."""
+        if not self.enabled or getattr(session, "id", None) is None:
+            return
+        if not isinstance(result, dict) or result.get("status") != "success":
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        entries = self._sessions.setdefault(session.id, {})
+        self._expire(entries)
+        state = session.state or {}
+        for next_tool, kwargs in self.predict(tool_name, state):
+            if next_tool not in self._tools:
+                continue
+            key = self._key(next_tool, (), kwargs)
+            existing = entries.get(key)
+            if existing is not None and (not existing.task.done() or self._still_valid(existing, state)):
+                continue
+            if self.inflight >= self.max_inflight:
+                self._count("skipped", next_tool)
+                continue
+            speculative = _SpeculativeSession(session)
+            context = contextvars.copy_context()
+            context.run(self.session_var.set, speculative)
+            task = context.run(loop.create_task, self._run(next_tool, kwargs, speculative))
+            self.inflight += 1
+            task.add_done_callback(self._finished)
+            entries[key] = _Entry(next_tool, task, time.monotonic() + self.ttl)
+            self._count("started", next_tool)
+
+    async def _run(self, tool_name: str, kwargs: dict, speculative: _SpeculativeSession):
+        func, _ = self._tools[tool_name]
+        result = await func(**kwargs) if inspect.iscoroutinefunction(func) else func(**kwargs)
+        return result, dict(speculative.state.reads), dict(speculative.state.writes)
+
+    def _finished(self, task: asyncio.Task):
+        self.inflight -= 1
+        if not task.cancelled() and task.exception() is not None:
+            # Only matters if the result is used (then the tool simply runs again).
+            logger.debug("Speculative tool run failed: %s", task.exception())
+
+    @staticmethod
+    def _still_valid(entry: _Entry, state: dict) -> bool:
+        if entry.task.cancelled() or entry.task.exception() is not None:
+            return False
+        _, reads, _ = entry.task.result()
+        return all(state.get(key, _MISSING) == value for key, value in reads.items())
+
+    # --- Housekeeping ---
+
+    def drop_session(self, session_id: str):
+        """Cancels and forgets everything prefetched for a session (on disconnect)."""
+        for entry in self._sessions.pop(session_id, {}).values():
+            if not entry.task.done():
+                entry.task.cancel()
+                self._count("cancelled", entry.tool_name)
+
+    def stats(self) -> dict:
+        return {**self.counters, "inflight": self.inflight, "sessions": len(self._sessions),
+                "cached": sum(len(entries) for entries in self._sessions.values())}
+
+    def _expire(self, entries: dict):
+        now = time.monotonic()
+        for key in [key for key, entry in entries.items() if entry.expires_at <= now]:
+            entry = entries.pop(key)
+            if not entry.task.done():
+                entry.task.cancel()
+            self._count("expired", entry.tool_name)
+
+    def _key(self, tool_name: str, args: tuple, kwargs: dict) -> tuple:
+        _, signature = self._tools[tool_name]
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {name: normalize_query(value) if isinstance(value, str) else value
+                     for name, value in bound.arguments.items()}
+        return tool_name, json.dumps(arguments, sort_keys=True, default=str)
+
+    def _count(self, outcome: str, tool_name: str):
+        self.counters[outcome] += 1
+        PREFETCH.inc(1, tool_name, outcome)
+
@@ -0,0 +1,70 @@
+# server/protocol.py
+
+"""
+Binary frame protocol for the /ws/{session_id} endpoint.
+
+Text and control messages stay JSON. Audio and image payloads can instead be
+sent as binary WebSocket frames: a 2-byte header (kind, version) followed by
+the raw payload. The header is kept at two bytes so the PCM payload stays
+16-bit aligned and the browser can view it as an Int16Array without copying.
+"""
+
+import struct
+
+PROTOCOL_VERSION = 1
+
+FRAME_HEADER = struct.Struct("!BB")  # kind, version
+HEADER_SIZE = FRAME_HEADER.size
+
+# --- Frame kinds ---
+KIND_AUDIO_PCM = 0x01
+KIND_IMAGE_JPEG = 0x02
+KIND_IMAGE_PNG = 0x03
+KIND_AUDIO_PCMU = 0x04  # G.711 mu-law, 8 kHz (audio_codec=pcmu, see server/audio.py)
+
+MIME_BY_KIND = {
+    KIND_AUDIO_PCM: "audio/pcm",
+    KIND_IMAGE_JPEG: "image/jpeg",
+    KIND_IMAGE_PNG: "image/png",
+    KIND_AUDIO_PCMU: "audio/pcmu",
+}
+KIND_BY_MIME = {mime_type: kind for kind, mime_type in MIME_BY_KIND.items()}
+
+
+class FrameError(ValueError):
+    """Raised when a binary frame is malformed or of an unknown kind."""
+
+
+def encode_frame(kind: int, payload) -> bytearray:
+    """Builds a binary frame, copying the payload exactly once."""
+    view = memoryview(payload)
+    frame = bytearray(HEADER_SIZE + view.nbytes)
+    FRAME_HEADER.pack_into(frame, 0, kind, PROTOCOL_VERSION)
+    frame[HEADER_SIZE:] = view.cast("B")
+    return frame
+
+
+def decode_frame(data) -> tuple[str, memoryview]:
+    """Parses a binary frame into (mime_type, payload view) without copying."""
+    view = memoryview(data)
+    if view.nbytes < HEADER_SIZE:
+        raise FrameError(f"Frame too short: {view.nbytes} bytes")
+    kind, version = FRAME_HEADER.unpack_from(view)
+    if version != PROTOCOL_VERSION:
+        raise FrameError(f"Unsupported protocol version: {version}")
+    mime_type = MIME_BY_KIND.get(kind)
+    if mime_type is None:
+        raise FrameError(f"Unknown frame kind: {kind:#04x}")
+    return mime_type, view[HEADER_SIZE:]
+
+
+def encode_frame_chunks(kind: int, chunks) -> bytearray:
+    """Builds one frame from several payload chunks (e.g. coalesced PCM), copying each once."""
+    views = [memoryview(chunk).cast("B") for chunk in chunks]
+    frame = bytearray(HEADER_SIZE + sum(view.nbytes for view in views))
+    FRAME_HEADER.pack_into(frame, 0, kind, PROTOCOL_VERSION)
+    offset = HEADER_SIZE
+    for view in views:
+        frame[offset:offset + view.nbytes] = view
+        offset += view.nbytes
+    return frame
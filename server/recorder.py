@@ -0,0 +1,180 @@
+# server/recorder.py
+
+"""
+Opt-in session recording (SESSION_RECORDING=1), so a slow turn reported by a
+rep can be replayed offline (bench/replay.py).
+
+Every live session appends to RECORDING_DIR/{session_id}-{started}.ndjson, one
+JSON array per line with the milliseconds since the session started first:
+
+    [0, "session", {"session_id", "started_at", "is_audio", "binary", ...}]
+    [t, "in", mime_type, size, detail]    client frame; detail is the text of a
+                                          text/plain message, the CRC-32 of an
+                                          image, None for audio
+    [t, "out", {"author", "parts", ...}]  model event; parts are ["text", text],
+                                          ["audio", mime, size], ["call", name, args]
+                                          or ["response", name]
+    [t, "tool", name, args, result, timings]   tool call through time_tool
+
+Audio is recorded by size only: the log stays small (tens of kB per minute)
+and holds no voice. Lines are queued to one writer thread that appends them
+in batches, so recording never does file I/O on the event loop.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+RECORDING_VERSION = 1
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class RecordingWriter:
+    """Appends queued lines to their files from a daemon thread, every `interval` seconds."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.lines_written = 0
+        self.write_errors = 0
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def put(self, path: str, line: str):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+        self._queue.put((path, line))
+
+    def flush(self):
+        with self._lock:
+            batches: dict[str, list[str]] = {}
+            while True:
+                try:
+                    path, line = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batches.setdefault(path, []).append(line)
+            for path, lines in batches.items():
+                try:
+                    with open(path, "a") as f:
+                        f.write("\n".join(lines) + "\n")
+                    self.lines_written += len(lines)
+                except OSError as e:
+                    self.write_errors += 1
+                    logger.warning("Could not write session recording '%s': %s", path, e)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+class SessionRecorder:
+    """Records one live session's client frames, model events and tool calls."""
+
+    def __init__(self, session_id: str, directory: str, writer: RecordingWriter, **metadata):
+        os.makedirs(directory, exist_ok=True)
+        started_at = time.time()
+        self.session_id = session_id
+        self.path = os.path.join(directory, f"{_UNSAFE.sub('_', session_id)}-{int(started_at * 1000)}.ndjson")
+        self.writer = writer
+        self._started = time.perf_counter()
+        self._append("session", {"session_id": session_id, "started_at": round(started_at, 3),
+                                 "version": RECORDING_VERSION, **metadata})
+
+    def inbound(self, mime_type: str, payload):
+        """A client frame: text messages are kept, images by checksum, audio by size."""
+        if mime_type == "text/plain":
+            self._append("in", mime_type, len(payload), payload)
+        elif mime_type.startswith("image/"):
+            self._append("in", mime_type, len(payload), zlib.crc32(payload))
+        else:
+            self._append("in", mime_type, len(payload), None)
+
+    def event(self, event):
+        """A run_live event, without its audio."""
+        record = {"author": event.author}
+        for flag in ("partial", "turn_complete", "interrupted"):
+            if getattr(event, flag, None):
+                record[flag] = True
+        parts = []
+        if event.content and event.content.parts:
+            record["role"] = event.content.role
+            for part in event.content.parts:
+                if part.text:
+                    parts.append(["text", part.text])
+                elif part.inline_data and part.inline_data.data is not None:
+                    parts.append(["audio", part.inline_data.mime_type, len(part.inline_data.data)])
+                elif part.function_call:
+                    parts.append(["call", part.function_call.name, dict(part.function_call.args or {})])
+                elif part.function_response:
+                    parts.append(["response", part.function_response.name])
+        record["parts"] = parts
+        self._append("out", record)
+
+    def tool(self, name: str, args: dict, result, timings: dict):
+        self._append("tool", name, args, result, timings)
+
+    def _append(self, kind: str, *fields):
+        elapsed_ms = round((time.perf_counter() - self._started) * 1000, 1)
+        try:
+            line = json.dumps([elapsed_ms, kind, *fields], separators=(",", ":"), default=str)
+        except ValueError as e:  # e.g. a circular structure in a tool result
+            logger.debug("Not recording %s line: %s", kind, e)
+            return
+        self.writer.put(self.path, line)
+
+
+# --- Active recordings (one per connected session) ---
+
+ENABLED = os.getenv("SESSION_RECORDING", "0") == "1"
+RECORDING_DIR = os.getenv("RECORDING_DIR", "recordings")
+writer = RecordingWriter()
+_recorders: dict[str, SessionRecorder] = {}
+
+
+def start_recording(session_id: str, **metadata) -> SessionRecorder | None:
+    """Starts recording a connection (None when recording is off); replaces an earlier connection's recorder."""
+    if not ENABLED:
+        return None
+    try:
+        recorder = SessionRecorder(session_id, RECORDING_DIR, writer, **metadata)
+    except OSError as e:
+        logger.warning("Could not start recording session %s: %s", session_id, e)
+        return None
+    _recorders[session_id] = recorder
+    logger.info("Recording session %s to '%s'.", session_id, recorder.path)
+    return recorder
+
+
+def recorder_for(session_id) -> SessionRecorder | None:
+    return _recorders.get(session_id) if _recorders else None
+
+
+def stop_recording(recorder: SessionRecorder | None):
+    if recorder is not None and _recorders.get(recorder.session_id) is recorder:
+        del _recorders[recorder.session_id]
+
+
+def read_recording(path: str) -> list[list]:
+    """The lines of a recording (a line cut off by a crash is skipped)."""
+    lines = []
+    with open(path) as f:
+        for line in f:
+            try:
+                lines.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return lines
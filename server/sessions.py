@@ -0,0 +1,637 @@
+# server/sessions.py
+
+"""
+Persistent session service shared by every worker/replica.
+
+`PersistentSessionService` implements ADK's BaseSessionService on top of a
+small storage backend (SQLite for single-host deployments, Redis for several
+hosts). Live Session objects are kept in an in-process read cache; the tools
+mutate `session.state` directly (e.g. the recap written by get_meeting_recap),
+so a background flusher diffs each cached session against its last persisted
+snapshot and writes only the changed state keys and new events, batched across
+sessions (write-behind). Sessions idle for longer than the TTL are evicted from
+the cache and from storage.
+
+Backend selection (see `create_session_service`):
+    SESSION_BACKEND=memory   ADK's InMemorySessionService (single process only)
+    SESSION_BACKEND=sqlite   SESSION_DB_PATH, default sessions.sqlite
+    SESSION_BACKEND=redis    REDIS_URL; "memory://" uses the in-process stand-in
+"""
+
+import asyncio
+import fnmatch
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from google.adk.events import Event
+from google.adk.sessions import Session
+from google.adk.sessions.base_session_service import (
+    BaseSessionService,
+    GetSessionConfig,
+    ListSessionsResponse,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _dump(value) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _encode_state(state: dict) -> dict[str, str]:
+    """JSON-encodes persistent state; `temp:` keys live only for the current invocation."""
+    return {key: _dump(value) for key, value in state.items() if not key.startswith("temp:")}
+
+
+@dataclass
+class SessionDelta:
+    """Changes to one session since its last flush."""
+    app_name: str
+    user_id: str
+    session_id: str
+    update_time: float
+    set_state: dict[str, str] = field(default_factory=dict)  # key -> JSON value
+    removed_state: list[str] = field(default_factory=list)
+    new_events: list[str] = field(default_factory=list)  # Event JSON
+
+
+# --- Storage Backends ---
+
+class SQLiteSessionBackend:
+    """
+    Sessions in a local SQLite database (WAL mode, so several worker processes
+    on one host can share the file). All calls run on a single dedicated thread.
+    """
+
+    def __init__(self, path: str = "sessions.sqlite", max_events: int = 500):
+        self.path = path
+        self.max_events = max_events
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-db")
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    app_name TEXT, user_id TEXT, id TEXT, update_time REAL,
+                    PRIMARY KEY (app_name, user_id, id));
+                CREATE TABLE IF NOT EXISTS session_state (
+                    app_name TEXT, user_id TEXT, id TEXT, key TEXT, value TEXT,
+                    PRIMARY KEY (app_name, user_id, id, key));
+                CREATE TABLE IF NOT EXISTS session_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    app_name TEXT, user_id TEXT, id TEXT, event TEXT);
+                CREATE INDEX IF NOT EXISTS session_events_by_session ON session_events (app_name, user_id, id, seq);
+                CREATE INDEX IF NOT EXISTS sessions_by_update_time ON sessions (update_time);
+            """)
+        return self._conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def create(self, app_name, user_id, session_id, state: dict[str, str], update_time: float) -> bool:
+        def create():
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute("INSERT OR IGNORE INTO sessions VALUES (?, ?, ?, ?)",
+                                      (app_name, user_id, session_id, update_time))
+                if cursor.rowcount == 0:
+                    return False
+                conn.executemany("INSERT OR REPLACE INTO session_state VALUES (?, ?, ?, ?, ?)",
+                                 [(app_name, user_id, session_id, key, value) for key, value in state.items()])
+            return True
+        return await self._run(create)
+
+    async def load(self, app_name, user_id, session_id, num_recent_events=None):
+        def load():
+            conn = self._connect()
+            row = conn.execute("SELECT update_time FROM sessions WHERE app_name=? AND user_id=? AND id=?",
+                               (app_name, user_id, session_id)).fetchone()
+            if row is None:
+                return None
+            state = dict(conn.execute("SELECT key, value FROM session_state WHERE app_name=? AND user_id=? AND id=?",
+                                      (app_name, user_id, session_id)))
+            limit = num_recent_events if num_recent_events is not None else self.max_events
+            events = [event for (event,) in conn.execute(
+                "SELECT event FROM session_events WHERE app_name=? AND user_id=? AND id=? ORDER BY seq DESC LIMIT ?",
+                (app_name, user_id, session_id, limit))]
+            return {"update_time": row[0], "state": state, "events": events[::-1]}
+        return await self._run(load)
+
+    async def update_time(self, app_name, user_id, session_id) -> float | None:
+        def read():
+            row = self._connect().execute("SELECT update_time FROM sessions WHERE app_name=? AND user_id=? AND id=?",
+                                          (app_name, user_id, session_id)).fetchone()
+            return row[0] if row else None
+        return await self._run(read)
+
+    async def apply(self, deltas: list[SessionDelta]):
+        def apply():
+            conn = self._connect()
+            with conn:  # one transaction for the whole batch
+                for delta in deltas:
+                    ids = (delta.app_name, delta.user_id, delta.session_id)
+                    conn.execute("INSERT INTO sessions VALUES (?, ?, ?, ?) ON CONFLICT DO UPDATE SET update_time=excluded.update_time",
+                                 (*ids, delta.update_time))
+                    conn.executemany("INSERT OR REPLACE INTO session_state VALUES (?, ?, ?, ?, ?)",
+                                     [(*ids, key, value) for key, value in delta.set_state.items()])
+                    conn.executemany("DELETE FROM session_state WHERE app_name=? AND user_id=? AND id=? AND key=?",
+                                     [(*ids, key) for key in delta.removed_state])
+                    conn.executemany("INSERT INTO session_events (app_name, user_id, id, event) VALUES (?, ?, ?, ?)",
+                                     [(*ids, event) for event in delta.new_events])
+                    if delta.new_events:
+                        conn.execute("""DELETE FROM session_events WHERE app_name=? AND user_id=? AND id=? AND seq <=
+                                        (SELECT seq FROM session_events WHERE app_name=? AND user_id=? AND id=?
+                                         ORDER BY seq DESC LIMIT 1 OFFSET ?)""", (*ids, *ids, self.max_events))
+        await self._run(apply)
+
+    async def delete(self, app_name, user_id, session_id):
+        def delete():
+            conn = self._connect()
+            with conn:
+                for table in ("sessions", "session_state", "session_events"):
+                    conn.execute(f"DELETE FROM {table} WHERE app_name=? AND user_id=? AND id=?",
+                                 (app_name, user_id, session_id))
+        await self._run(delete)
+
+    async def list(self, app_name, user_id=None) -> list[tuple[str, str, float]]:
+        def list_sessions():
+            query, params = "SELECT user_id, id, update_time FROM sessions WHERE app_name=?", [app_name]
+            if user_id is not None:
+                query, params = query + " AND user_id=?", params + [user_id]
+            return self._connect().execute(query, params).fetchall()
+        return await self._run(list_sessions)
+
+    async def evict_expired(self, cutoff: float) -> int:
+        def evict():
+            conn = self._connect()
+            with conn:
+                expired = conn.execute("SELECT app_name, user_id, id FROM sessions WHERE update_time < ?",
+                                       (cutoff,)).fetchall()
+                for table in ("sessions", "session_state", "session_events"):
+                    conn.executemany(f"DELETE FROM {table} WHERE app_name=? AND user_id=? AND id=?", expired)
+            return len(expired)
+        return await self._run(evict)
+
+    async def close(self):
+        def close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(close)
+        self._executor.shutdown(wait=True)
+
+
+class RedisSessionBackend:
+    """
+    Sessions in Redis (or anything speaking its protocol). Per session:
+    `<prefix>:<app>:<user>:<id>:meta` (hash), `:state` (hash of JSON values) and
+    `:events` (list, trimmed to `max_events`). Expiry is left to Redis: every
+    write refreshes a sliding TTL on the session's keys.
+    """
+
+    def __init__(self, client, ttl_seconds: float = 86400, max_events: int = 500, prefix: str = "session"):
+        self.client = client
+        self.ttl_seconds = int(ttl_seconds)
+        self.max_events = max_events
+        self.prefix = prefix
+
+    def _key(self, app_name, user_id, session_id, part):
+        return f"{self.prefix}:{app_name}:{user_id}:{session_id}:{part}"
+
+    def _index_key(self, app_name, user_id):
+        return f"{self.prefix}-index:{app_name}:{user_id}"
+
+    def _refresh(self, pipe, app_name, user_id, session_id):
+        for part in ("meta", "state", "events"):
+            pipe.expire(self._key(app_name, user_id, session_id, part), self.ttl_seconds)
+        pipe.sadd(self._index_key(app_name, user_id), session_id)
+        pipe.expire(self._index_key(app_name, user_id), self.ttl_seconds)
+
+    async def create(self, app_name, user_id, session_id, state: dict[str, str], update_time: float) -> bool:
+        meta_key = self._key(app_name, user_id, session_id, "meta")
+        if not await self.client.hsetnx(meta_key, "update_time", repr(update_time)):
+            return False
+        pipe = self.client.pipeline()
+        if state:
+            pipe.hset(self._key(app_name, user_id, session_id, "state"), mapping=state)
+        self._refresh(pipe, app_name, user_id, session_id)
+        await pipe.execute()
+        return True
+
+    async def load(self, app_name, user_id, session_id, num_recent_events=None):
+        limit = num_recent_events if num_recent_events is not None else self.max_events
+        pipe = self.client.pipeline()
+        pipe.hget(self._key(app_name, user_id, session_id, "meta"), "update_time")
+        pipe.hgetall(self._key(app_name, user_id, session_id, "state"))
+        if limit:
+            pipe.lrange(self._key(app_name, user_id, session_id, "events"), -limit, -1)
+        results = await pipe.execute()
+        update_time, state = results[0], results[1]
+        if update_time is None:
+            return None
+        events = results[2] if limit else []
+        return {"update_time": float(_text(update_time)),
+                "state": {_text(key): _text(value) for key, value in state.items()},
+                "events": [_text(event) for event in events]}
+
+    async def update_time(self, app_name, user_id, session_id) -> float | None:
+        value = await self.client.hget(self._key(app_name, user_id, session_id, "meta"), "update_time")
+        return float(_text(value)) if value is not None else None
+
+    async def apply(self, deltas: list[SessionDelta]):
+        pipe = self.client.pipeline()
+        for delta in deltas:
+            ids = (delta.app_name, delta.user_id, delta.session_id)
+            pipe.hset(self._key(*ids, "meta"), "update_time", repr(delta.update_time))
+            if delta.set_state:
+                pipe.hset(self._key(*ids, "state"), mapping=delta.set_state)
+            if delta.removed_state:
+                pipe.hdel(self._key(*ids, "state"), *delta.removed_state)
+            if delta.new_events:
+                pipe.rpush(self._key(*ids, "events"), *delta.new_events)
+                pipe.ltrim(self._key(*ids, "events"), -self.max_events, -1)
+            self._refresh(pipe, *ids)
+        await pipe.execute()
+
+    async def delete(self, app_name, user_id, session_id):
+        pipe = self.client.pipeline()
+        pipe.delete(*(self._key(app_name, user_id, session_id, part) for part in ("meta", "state", "events")))
+        pipe.srem(self._index_key(app_name, user_id), session_id)
+        await pipe.execute()
+
+    async def list(self, app_name, user_id=None) -> list[tuple[str, str, float]]:
+        if user_id is not None:
+            user_ids = [user_id]
+        else:
+            prefix = self._index_key(app_name, "")
+            user_ids = [_text(key)[len(prefix):] async for key in self.client.scan_iter(match=prefix + "*")]
+        sessions = []
+        for uid in user_ids:
+            for session_id in await self.client.smembers(self._index_key(app_name, uid)):
+                session_id = _text(session_id)
+                update_time = await self.update_time(app_name, uid, session_id)
+                if update_time is None:  # expired; drop it from the index
+                    await self.client.srem(self._index_key(app_name, uid), session_id)
+                    continue
+                sessions.append((uid, session_id, update_time))
+        return sessions
+
+    async def evict_expired(self, cutoff: float) -> int:
+        return 0  # Redis expires keys itself
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class InMemoryRedis:
+    """
+    In-process stand-in for the subset of `redis.asyncio.Redis` used by
+    RedisSessionBackend (hashes, lists, sets, expiry, pipelines). Lets the Redis
+    code path run locally and in CI without a server: REDIS_URL=memory://
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+
+    def _live(self, key):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def _hash(self, key):
+        return self._live(key) if self._live(key) is not None else self._data.setdefault(key, {})
+
+    def _list(self, key):
+        return self._live(key) if self._live(key) is not None else self._data.setdefault(key, [])
+
+    def _set(self, key):
+        return self._live(key) if self._live(key) is not None else self._data.setdefault(key, set())
+
+    async def hget(self, key, name):
+        return (self._live(key) or {}).get(name)
+
+    async def hgetall(self, key):
+        return dict(self._live(key) or {})
+
+    async def hset(self, key, name=None, value=None, mapping=None):
+        values = dict(mapping or {})
+        if name is not None:
+            values[name] = value
+        target = self._hash(key)
+        added = sum(1 for name in values if name not in target)
+        target.update(values)
+        return added
+
+    async def hsetnx(self, key, name, value):
+        target = self._hash(key)
+        if name in target:
+            return 0
+        target[name] = value
+        return 1
+
+    async def hdel(self, key, *names):
+        target = self._live(key) or {}
+        return sum(1 for name in names if target.pop(name, None) is not None)
+
+    async def rpush(self, key, *values):
+        target = self._list(key)
+        target.extend(values)
+        return len(target)
+
+    async def ltrim(self, key, start, end):
+        target = self._live(key)
+        if target is not None:
+            end = None if end == -1 else end + 1
+            target[:] = target[start:end]
+        return True
+
+    async def lrange(self, key, start, end):
+        end = None if end == -1 else end + 1
+        return list((self._live(key) or [])[start:end])
+
+    async def sadd(self, key, *members):
+        target = self._set(key)
+        added = len(set(members) - target)
+        target.update(members)
+        return added
+
+    async def srem(self, key, *members):
+        target = self._live(key) or set()
+        removed = len(target & set(members))
+        target.difference_update(members)
+        return removed
+
+    async def smembers(self, key):
+        return set(self._live(key) or set())
+
+    async def expire(self, key, seconds):
+        if self._live(key) is None:
+            return False
+        self._expires[key] = time.time() + seconds
+        return True
+
+    async def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._live(key) is not None:
+                deleted += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return deleted
+
+    async def scan_iter(self, match="*"):
+        for key in list(self._data):
+            if self._live(key) is not None and fnmatch.fnmatchcase(key, match):
+                yield key
+
+    def pipeline(self):
+        return _InMemoryPipeline(self)
+
+    async def aclose(self):
+        pass
+
+
+class _InMemoryPipeline:
+    """Queues commands and runs them in order on `execute()`, like a non-transactional Redis pipeline."""
+
+    def __init__(self, client: InMemoryRedis):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        commands, self._commands = self._commands, []
+        return [await method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+# --- Session Service ---
+
+@dataclass
+class _CachedSession:
+    session: Session
+    persisted_state: dict[str, str]  # key -> JSON value as last written
+    persisted_events: int
+    last_access: float
+
+
+class PersistentSessionService(BaseSessionService):
+    """
+    BaseSessionService over a SQLite/Redis backend with an in-process read
+    cache, write-behind flushing of state deltas and events, and idle TTL.
+
+    The Session object handed out for a given session ID is shared within the
+    process and tracked for changes; `flush()` persists them immediately.
+    """
+
+    def __init__(self, backend, flush_interval: float = 0.5, ttl_seconds: float = 86400,
+                 cache_idle_seconds: float = 300):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.ttl_seconds = ttl_seconds
+        self.cache_idle_seconds = cache_idle_seconds
+        self._cache: dict[tuple[str, str, str], _CachedSession] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher = None
+        self._last_sweep = 0.0
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "flushes": 0, "flushed_sessions": 0, "evicted": 0}
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await self._sweep()
+            except Exception as e:
+                logger.warning("Session flush failed (will retry): %s", e)
+
+    def _track(self, session: Session, persisted_events: int | None = None) -> Session:
+        self._cache[(session.app_name, session.user_id, session.id)] = _CachedSession(
+            session=session,
+            persisted_state=_encode_state(session.state),
+            persisted_events=len(session.events) if persisted_events is None else persisted_events,
+            last_access=time.monotonic(),
+        )
+        self._ensure_flusher()
+        return session
+
+    async def create_session(self, *, app_name: str, user_id: str, state=None, session_id=None) -> Session:
+        session_id = (session_id or "").strip() or str(uuid.uuid4())
+        now = time.time()
+        encoded = _encode_state(state or {})
+        if not await self.backend.create(app_name, user_id, session_id, encoded, now):
+            raise ValueError(f"Session with id {session_id} already exists.")
+        session = Session(app_name=app_name, user_id=user_id, id=session_id,
+                          state=dict(state or {}), last_update_time=now)
+        return self._track(session)
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str,
+                          config: GetSessionConfig | None = None) -> Session | None:
+        key = (app_name, user_id, session_id)
+        cached = self._cache.get(key)
+        if cached is not None and config is None:
+            # Another worker may have written the session since we cached it.
+            stored_update = await self.backend.update_time(app_name, user_id, session_id)
+            if stored_update is not None and stored_update <= cached.session.last_update_time:
+                cached.last_access = time.monotonic()
+                self.stats["cache_hits"] += 1
+                return cached.session
+            if stored_update is None and not self._is_dirty(cached):
+                self._cache.pop(key, None)
+                return None
+            await self.flush()
+        self.stats["cache_misses"] += 1
+
+        record = await self.backend.load(app_name, user_id, session_id,
+                                         config.num_recent_events if config else None)
+        if record is None:
+            return None
+        events = [Event.model_validate_json(event) for event in record["events"]]
+        if config and config.after_timestamp:
+            events = [event for event in events if event.timestamp >= config.after_timestamp]
+        session = Session(app_name=app_name, user_id=user_id, id=session_id,
+                          state={key: json.loads(value) for key, value in record["state"].items()},
+                          events=events, last_update_time=record["update_time"])
+        if config is not None:
+            return session  # partial views are not cached or tracked
+        return self._track(session)
+
+    async def list_sessions(self, *, app_name: str, user_id: str | None = None) -> ListSessionsResponse:
+        await self.flush()
+        sessions = [Session(app_name=app_name, user_id=uid, id=session_id, last_update_time=update_time)
+                    for uid, session_id, update_time in await self.backend.list(app_name, user_id)]
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        self._cache.pop((app_name, user_id, session_id), None)
+        await self.backend.delete(app_name, user_id, session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        # The base class applies state_delta to session.state and appends the
+        # event; the flusher picks both up on its next pass.
+        event = await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+        cached = self._cache.get((session.app_name, session.user_id, session.id))
+        if cached is not None and cached.session is session:
+            cached.last_access = time.monotonic()
+        elif not event.partial:
+            # A session object we are not tracking (swept from the cache while a
+            # runner still held it, or a config-filtered view): track it again and
+            # rewrite its full state with the next flush.
+            self._track(session, persisted_events=len(session.events) - 1)
+            self._cache[(session.app_name, session.user_id, session.id)].persisted_state = {}
+        return event
+
+    def _is_dirty(self, cached: _CachedSession) -> bool:
+        return len(cached.session.events) != cached.persisted_events or \
+            _encode_state(cached.session.state) != cached.persisted_state
+
+    async def flush(self):
+        """Writes the state/event changes of every cached session in one backend batch."""
+        async with self._flush_lock:
+            deltas, snapshots = [], []
+            now = time.time()
+            for cached in list(self._cache.values()):
+                session = cached.session
+                current = _encode_state(session.state)
+                changed = {key: value for key, value in current.items() if cached.persisted_state.get(key) != value}
+                removed = [key for key in cached.persisted_state if key not in current]
+                new_events = session.events[cached.persisted_events:]
+                if not changed and not removed and not new_events:
+                    continue
+                session.last_update_time = max(session.last_update_time, now)
+                deltas.append(SessionDelta(session.app_name, session.user_id, session.id, session.last_update_time,
+                                           set_state=changed, removed_state=removed,
+                                           new_events=[_event_json(event) for event in new_events]))
+                snapshots.append((cached, current, len(session.events)))
+            if not deltas:
+                return
+            await self.backend.apply(deltas)
+            for cached, current, event_count in snapshots:
+                cached.persisted_state = current
+                cached.persisted_events = event_count
+            self.stats["flushes"] += 1
+            self.stats["flushed_sessions"] += len(deltas)
+
+    async def _sweep(self):
+        """Drops idle, fully flushed sessions from the cache and expired sessions from storage."""
+        idle_before = time.monotonic() - self.cache_idle_seconds
+        for key, cached in list(self._cache.items()):
+            if cached.last_access < idle_before and not self._is_dirty(cached):
+                del self._cache[key]
+        if time.monotonic() - self._last_sweep >= 60:
+            self._last_sweep = time.monotonic()
+            self.stats["evicted"] += await self.backend.evict_expired(time.time() - self.ttl_seconds)
+
+    def cache_size(self) -> int:
+        return len(self._cache)
+
+    async def close(self):
+        """Stops the flusher, writes any pending changes and closes the backend."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        await self.backend.close()
+
+
+def _event_json(event: Event) -> str:
+    return event.model_dump_json(exclude_none=True)
+
+
+def create_session_service(backend: str | None = None) -> BaseSessionService:
+    """Builds the session service selected by SESSION_BACKEND (memory | sqlite | redis)."""
+    backend = (backend or os.getenv("SESSION_BACKEND", "sqlite")).lower()
+    ttl_seconds = float(os.getenv("SESSION_TTL_SECONDS", "86400"))
+    max_events = int(os.getenv("SESSION_MAX_EVENTS", "500"))
+    flush_interval = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+
+    if backend == "memory":
+        from google.adk.sessions.in_memory_session_service import InMemorySessionService
+        return InMemorySessionService()
+    if backend == "sqlite":
+        store = SQLiteSessionBackend(os.getenv("SESSION_DB_PATH", "sessions.sqlite"), max_events=max_events)
+    elif backend == "redis":
+        url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        if url == "memory://":
+            client = InMemoryRedis()
+        else:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError as e:
+                raise ImportError("SESSION_BACKEND=redis requires the 'redis' package (pip install redis).") from e
+            client = redis_asyncio.Redis.from_url(url)
+        store = RedisSessionBackend(client, ttl_seconds=ttl_seconds, max_events=max_events)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND '{backend}'. Expected memory, sqlite or redis.")
+    return PersistentSessionService(store, flush_interval=flush_interval, ttl_seconds=ttl_seconds)
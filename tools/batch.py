@@ -0,0 +1,119 @@
+# tools/batch.py
+
+"""
+Batch generation of meeting recaps, follow-up invites and emails (POST
+/batch/recaps), for sales ops processing a whole team's meeting notes at
+once instead of one live voice session per meeting.
+
+Each record runs the same tool functions as the live agent, in order
+(get_meeting_recap -> create_invite_from_recap -> create_email_from_recap),
+against a stand-in session: a fresh state dict set in `session_context` for
+that record only, so records never see each other's state. Records run on a
+bounded thread pool (BATCH_WORKERS) with at most two per worker in flight,
+which keeps a large batch from stalling the event loop that pumps live audio
+and keeps memory flat however many records are sent. Results are yielded as
+they complete, tagged with the record's position.
+
+The tools are called undecorated: batch records are not live tool calls, so
+they are not prefetched, recorded or counted in the tool latency histogram.
+"""
+
+import asyncio
+import contextvars
+import inspect
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from server.metrics import BATCH_RECORDS
+from tools.sales_tools import (
+    FOCUS_PRODUCT,
+    create_email_from_recap,
+    create_invite_from_recap,
+    get_meeting_recap,
+    rag,
+    session_context,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="recap-batch")
+
+_recap = inspect.unwrap(get_meeting_recap)
+_invite = inspect.unwrap(create_invite_from_recap)
+_email = inspect.unwrap(create_email_from_recap)
+
+
+class BatchSession:
+    """Stands in for the live session of one batch record (the tools only use `id` and `state`)."""
+
+    def __init__(self, session_id: str, state: dict):
+        self.id = session_id
+        self.state = state
+
+
+def process_record(record: dict) -> dict:
+    """Runs recap -> invite -> email for one record; call with session_context set to its BatchSession."""
+    recap = _recap(record["discussion_points"], record["action_items"], record["follow_up_date"],
+                   record["client_name"])
+    invite = _invite()
+    email = _email()
+    for result in (recap, invite, email):
+        if result.get("status") != "success":
+            return {"status": "error", "message": result.get("message", "Tool failed.")}
+    return {"status": "success", "recap": recap["recap_data"], "invite": invite["invite_details"],
+            "email": email["email_draft"]}
+
+
+def _load_index(index_name: str):
+    """Loads the knowledge base whose contacts the invites and emails use; without it they go to the rep only."""
+    try:
+        if not rag.ready:
+            rag.initialize()
+        rag.indexes.get(index_name)
+    except Exception as e:
+        logger.warning("Batch runs without knowledge base '%s' (no client contacts): %s", index_name, e)
+
+
+async def run_batch(records: list[dict], index_name: str):
+    """Yields one result dict per record, in completion order, with its `index` and `id`."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(batch_executor, _load_index, index_name)
+    batch_id = uuid.uuid4().hex[:8]
+    window = 2 * BATCH_WORKERS
+    pending: dict[asyncio.Future, tuple[int, dict, float]] = {}
+    records = iter(enumerate(records))
+
+    def submit(position: int, record: dict):
+        state = {"knowledge_base": index_name, "product_in_focus": record.get("product") or FOCUS_PRODUCT}
+        context = contextvars.copy_context()
+        context.run(session_context.set, BatchSession(f"batch-{batch_id}-{position}", state))
+        future = loop.run_in_executor(batch_executor, context.run, process_record, record)
+        pending[future] = (position, record, time.perf_counter())
+
+    try:
+        for position, record in records:
+            submit(position, record)
+            if len(pending) >= window:
+                break
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                position, record, started = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.exception("Batch record %d failed", position)
+                    result = {"status": "error", "message": f"{type(e).__name__}: {e}"}
+                BATCH_RECORDS.inc(1, result["status"])
+                yield {"index": position, "id": record.get("id"), **result,
+                       "ms": round((time.perf_counter() - started) * 1000, 2)}
+                next_record = next(records, None)
+                if next_record is not None:
+                    submit(*next_record)
+    finally:
+        for future in pending:
+            future.cancel()
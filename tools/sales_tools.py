@@ -1,45 +1,161 @@
 # sales_tools/tools.py
 
 from google.adk.tools import FunctionTool
+import os
 import json
+import logging
+import contextvars
 from contextvars import ContextVar
-from langchain_google_vertexai import VertexAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from concurrent.futures import ThreadPoolExecutor
 import time
 import asyncio
-from functools import wraps
-
-# --- RAG Setup (No changes needed here) ---
-embeddings = VertexAIEmbeddings(model_name="text-embedding-005")
-# Ensure the FAISS index has been created by running create_index.py
-try:
-    db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-    retriever = db.as_retriever(search_kwargs={'k': 3})
-except Exception as e:
-    print(f"Could not load FAISS index. Please run create_index.py first. Error: {e}")
-    retriever = None
+import inspect
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+from rag.batcher import RetrievalBatcher
+from rag.compress import compress, estimate_tokens, source_of, token_budget
+from rag.keys import chunk_id_of
+from rag.materialize import BRIEFING_QUERY, COMPARISON_QUERY
+from rag.registry import DEFAULT_INDEX
+from rag.resources import RAGResources
+from server.metrics import TOOL_LATENCY, TOOL_QUEUE_WAIT, TOOL_RESPONSE_TOKENS, phase, span
+from server.prefetch import Prefetcher
+from server.recorder import recorder_for
+
+logger = logging.getLogger(__name__)
+
+# --- RAG Setup ---
+INDEX_PATH = "faiss_index"
+# Embedding client, hybrid retrieval pipeline and caches are loaded lazily: main.py
+# initializes them from its lifespan hook, so importing this module stays cheap.
+# The embedding provider is selected by EMBEDDING_PROVIDER and must match the index.
+# INDEX_PATH is the "default" index; RAG_INDEXES / RAG_INDEX_ROOT add named ones,
+# selected per session (see rag/registry.py).
+rag = RAGResources(INDEX_PATH)
+
+# The product discussed when the conversation has not named one yet.
+FOCUS_PRODUCT = "Loctite ESB 5100"
+
+# Templated queries issued by the retrieval tools (defined in rag/materialize.py), used for startup warm-up.
+WARMUP_QUERIES = [
+    ("get_meeting_briefing", BRIEFING_QUERY.format("Volta Motors")),
+    ("get_competitor_comparison", COMPARISON_QUERY.format(FOCUS_PRODUCT)),
+]
 
 session_context = ContextVar('session_object', default=None)
 
-# --- Decorator and State Management (No changes needed here) ---
+REP_EMAIL = "alex.richter@henkel.com"
+
+# --- Tool Execution Pool ---
+# Blocking retrieval work (embedding call + FAISS search) runs on this bounded pool
+# so a slow embedding request never stalls the event loop pumping audio for other sessions.
+tool_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RAG_TOOL_WORKERS", "8")),
+    thread_name_prefix="rag-tool",
+)
+_tool_timing = ContextVar('tool_timing', default=None)
+
+async def run_in_tool_executor(func, *args):
+    """
+    Runs `func(*args)` on the tool pool, preserving ContextVars (e.g. session_context)
+    and recording queue wait vs. execution time for the enclosing `time_tool`.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    timing = _tool_timing.get()
+    submitted_at = time.perf_counter()
+
+    def run():
+        started_at = time.perf_counter()
+        try:
+            return context.run(func, *args)
+        finally:
+            if timing is not None:
+                timing["queue_wait_ms"] += (started_at - submitted_at) * 1000
+                timing["execution_ms"] += (time.perf_counter() - started_at) * 1000
+
+    return await loop.run_in_executor(tool_executor, run)
+
+# --- Speculative Prefetch ---
+def _predict_next_calls(tool_name: str, state: dict) -> list[tuple[str, dict]]:
+    """
+    The calls the agent's workflows (see agents/catalyst_agent.py) usually make
+    after `tool_name`: the competitor comparison follows the briefing and product
+    questions, and the invite and email follow the recap.
+    """
+    if tool_name in ("get_meeting_briefing", "get_product_information"):
+        return [("get_competitor_comparison", {"product_name": state.get("product_in_focus", FOCUS_PRODUCT)})]
+    if tool_name == "get_meeting_recap":
+        return [("create_invite_from_recap", {}), ("create_email_from_recap", {})]
+    if tool_name == "create_invite_from_recap":
+        return [("create_email_from_recap", {})]
+    return []
+
+# Results are kept per session for PREFETCH_TTL_SECONDS and cancelled when the session disconnects.
+prefetcher = Prefetcher(
+    session_context, _predict_next_calls,
+    ttl=float(os.getenv("PREFETCH_TTL_SECONDS", "30")),
+    max_inflight=int(os.getenv("PREFETCH_MAX_INFLIGHT", "16")),
+    enabled=os.getenv("PREFETCH", "1") == "1",
+)
+
+# --- Decorator and State Management ---
 def time_tool(func):
-    """A decorator that prints the execution time of a tool function."""
+    """
+    A decorator that records the latency of a tool function in the
+    catalyst_tool_latency_seconds histogram (see server/metrics.py) and, when
+    tracing is on, wraps it in a span. For async tools, time spent waiting for
+    the tool pool is recorded separately. Calls the prefetcher already made
+    for the session are answered from its result, and every successful call
+    starts prefetching the likely next one. When the session is being recorded
+    (server/recorder.py), the call, its result and timings are logged.
+    """
+    prefetcher.register(func)
+    signature = inspect.signature(func)
+
+    def record(session, args, kwargs, result, timings: dict):
+        recorder = recorder_for(getattr(session, "id", None))
+        if recorder is not None:
+            recorder.tool(func.__name__, dict(signature.bind_partial(*args, **kwargs).arguments), result, timings)
+
     @wraps(func)
     async def async_wrapper(*args, **kwargs):
+        session = session_context.get()
+        timing = {"queue_wait_ms": 0.0, "execution_ms": 0.0}
+        token = _tool_timing.set(timing)
         start_time = time.perf_counter()
-        result = await func(*args, **kwargs)
-        end_time = time.perf_counter()
-        duration = (end_time - start_time) * 1000
-        print(f"[PERFORMANCE] Tool '{func.__name__}' executed in {duration:.2f} ms")
+        try:
+            with span(f"tool.{func.__name__}"):
+                prefetched, result = await prefetcher.take(session, func.__name__, args, kwargs)
+                if not prefetched:
+                    result = await func(*args, **kwargs)
+        finally:
+            _tool_timing.reset(token)
+        duration = time.perf_counter() - start_time
+        TOOL_LATENCY.observe(duration, func.__name__)
+        TOOL_QUEUE_WAIT.observe(timing["queue_wait_ms"] / 1000, func.__name__)
+        logger.debug(
+            "Tool '%s' executed in %.2f ms (queue wait %.2f ms, execution %.2f ms)",
+            func.__name__, duration * 1000, timing["queue_wait_ms"], timing["execution_ms"],
+        )
+        record(session, args, kwargs, result, {"duration_ms": round(duration * 1000, 2), "prefetched": prefetched,
+                                               **{name: round(ms, 2) for name, ms in timing.items()}})
+        prefetcher.after(session, func.__name__, result)
         return result
 
     @wraps(func)
     def sync_wrapper(*args, **kwargs):
+        session = session_context.get()
         start_time = time.perf_counter()
-        result = func(*args, **kwargs)
-        end_time = time.perf_counter()
-        duration = (end_time - start_time) * 1000
-        print(f"[PERFORMANCE] Tool '{func.__name__}' executed in {duration:.2f} ms")
+        with span(f"tool.{func.__name__}"):
+            prefetched, result = prefetcher.take_nowait(session, func.__name__, args, kwargs)
+            if not prefetched:
+                result = func(*args, **kwargs)
+        duration = time.perf_counter() - start_time
+        TOOL_LATENCY.observe(duration, func.__name__)
+        logger.debug("Tool '%s' executed in %.2f ms", func.__name__, duration * 1000)
+        record(session, args, kwargs, result, {"duration_ms": round(duration * 1000, 2), "prefetched": prefetched})
+        prefetcher.after(session, func.__name__, result)
         return result
     
     if asyncio.iscoroutinefunction(func):
@@ -55,70 +171,232 @@ def _get_and_init_state():
         session.state = {}
     return session.state
 
+def _index_name() -> str:
+    """The knowledge base selected for the current session (the `index` WebSocket parameter)."""
+    session = session_context.get()
+    state = session.state if session is not None and session.state else {}
+    return state.get("knowledge_base") or DEFAULT_INDEX
+
+def _retrieve_batch(requests: list[tuple[str, str]], index_name: str = DEFAULT_INDEX) -> list:
+    """
+    Runs the retrieval pipeline of one index for several (tool_name, query) pairs;
+    results are served from the index's retrieval cache when possible and the misses
+    are embedded and searched together.
+    """
+    with rag.indexes.lease(index_name) as index:
+        search_batch = getattr(index.retriever, "search_batch", None)
+        if search_batch is None:
+            search_batch = lambda misses: [index.retriever.search_for_tool(tool_name, query) for tool_name, query in misses]
+        return index.retrieval_cache.get_or_compute_many(requests, search_batch, embed_many=rag.embeddings.embed_queries)
+
+def _retrieve(tool_name: str, query: str, index_name: str = DEFAULT_INDEX):
+    """Runs the retrieval pipeline for one tool query (blocking)."""
+    return _retrieve_batch([(tool_name, query)], index_name)[0]
+
+# Concurrent tool calls (across all sessions) are coalesced into batched retrievals, one batcher per index.
+_batchers: dict[str, RetrievalBatcher] = {}
+
+def _batcher(index_name: str) -> RetrievalBatcher:
+    batcher = _batchers.get(index_name)
+    if batcher is None:
+        batcher = _batchers.setdefault(index_name, RetrievalBatcher(
+            partial(_retrieve_batch, index_name=index_name),
+            run=run_in_tool_executor,
+            timing=_tool_timing,
+            window_ms=float(os.getenv("RAG_BATCH_WINDOW_MS", "3")),
+            max_batch=int(os.getenv("RAG_BATCH_MAX", "32")),
+        ))
+    return batcher
+
+async def _retrieve_async(tool_name: str, query: str, index_name: str = DEFAULT_INDEX):
+    """Retrieval for a tool call: through the batcher, or directly on the tool pool when batching is off."""
+    if os.getenv("RAG_BATCHING", "1") == "1":
+        return await _batcher(index_name).retrieve(tool_name, query)
+    return await run_in_tool_executor(_retrieve, tool_name, query, index_name)
+
+def _passages(docs) -> list[tuple[str, dict]]:
+    """(text, metadata) pairs of retrieved chunks, for response shaping."""
+    return [(doc.page_content, {**doc.metadata, "chunk_id": chunk_id_of(doc)}) for doc in docs]
+
+def _shape_response(tool_name: str, query: str, passages: list[tuple[str, dict]], lead: str | None) -> dict:
+    """
+    The response fields of a retrieval tool: a spoken lead-in (`message`) plus
+    the passages compressed into `facts` and `sources` within the tool's token
+    budget (see rag/compress.py). With RAG_COMPRESSION=0 the passages are
+    appended to the message verbatim, as before. Without a lead, the message
+    is the content alone (the facts, one per line).
+    """
+    with phase("formatting"):
+        if os.getenv("RAG_COMPRESSION", "1") != "1":
+            context = "\n---\n".join(text for text, _ in passages)
+            TOOL_RESPONSE_TOKENS.observe(estimate_tokens(context), tool_name)
+            message = f"{lead}\n{context}" if lead is not None else context
+            return {"message": message, "sources": [source_of(metadata) for _, metadata in passages]}
+        shaped = compress(query, passages, token_budget(tool_name))
+    TOOL_RESPONSE_TOKENS.observe(shaped["tokens"], tool_name)
+    if lead is None:
+        return {"message": "\n".join(shaped["facts"]), "sources": shaped["sources"]}
+    return {"message": lead, "facts": shaped["facts"], "sources": shaped["sources"]}
+
+@asynccontextmanager
+async def _knowledge_base():
+    """
+    The session's index, loaded (together with RAG initialization, if startup
+    hasn't finished) on the tool pool when needed and leased for the block, so a
+    reload or eviction during the tool call cannot close it; None if it is unavailable.
+    """
+    if not rag.ready:
+        await run_in_tool_executor(rag.initialize)
+    index_name = _index_name()
+    index = rag.indexes.acquire(index_name, blocking=False)
+    if index is None:
+        acquiring = asyncio.ensure_future(run_in_tool_executor(rag.indexes.acquire, index_name))
+        try:
+            index = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The pool thread still takes the lease; hand it back once it has.
+            acquiring.add_done_callback(
+                lambda done: done.cancelled() or done.exception() or rag.indexes.release(done.result()))
+            raise
+        except Exception as e:
+            logger.error("Knowledge base '%s' is not available: %s", index_name, e)
+    try:
+        yield index
+    finally:
+        if index is not None:
+            rag.indexes.release(index)
+
+def _materialized(index, tool_name: str, name: str) -> list[tuple[str, dict]] | None:
+    """The passages precomputed at index time for a known client/product (see rag/materialize.py)."""
+    if index.materialized is None:
+        return None
+    entry = index.materialized.get(tool_name, name)
+    if entry is None:
+        return None
+    texts = entry["text"].split("\n---\n")
+    sources = entry.get("sources") or [{"chunk_id": chunk_id} for chunk_id in entry["chunk_ids"]]
+    return list(zip(texts, sources)) if len(texts) == len(sources) else [(entry["text"], {})]
+
+def _entities():
+    """The name-resolution index of the session's knowledge base, if it is loaded."""
+    index = rag.indexes.peek(_index_name())
+    return index.entities if index is not None else None
+
+def _resolve(name: str, kind: str) -> str:
+    """Maps an ASR-garbled client/contact/product name to the known spelling (see rag/entities.py)."""
+    entities = _entities()
+    if entities is None or not name:
+        return name
+    resolved = entities.canonical(name, kind)
+    if resolved != name:
+        logger.debug("Resolved %s '%s' -> '%s'", kind, name, resolved)
+    return resolved
+
+def _client_contacts(client_name: str) -> list:
+    """Known contacts (from the documents and the CRM export) of a client."""
+    entities = _entities()
+    return entities.contacts_for(client_name) if entities is not None else []
+
+def _remember(key: str, value):
+    """Stores a value in the session state when the tool runs inside a session."""
+    session = session_context.get()
+    if session is not None:
+        if not session.state:
+            session.state = {}
+        session.state[key] = value
+
+def _warm_up():
+    """Pre-embeds and caches the common templated queries."""
+    for tool_name, query in WARMUP_QUERIES:
+        _retrieve(tool_name, query)
+
+def initialize_resources(warm_up: bool = False) -> dict:
+    """Loads the RAG resources (blocking); returns per-phase timings in ms."""
+    return rag.initialize(_warm_up if warm_up else None)
+
+def get_cache_stats() -> dict:
+    """
+    Returns hit/miss counters for the embedding cache, per index the retrieval
+    cache and batcher, and the prefetcher's outcomes.
+    """
+    stats = rag.cache_stats()
+    for index_name, batcher in list(_batchers.items()):
+        stats["indexes"].setdefault(index_name, {})["batching"] = batcher.stats()
+    stats["prefetch"] = prefetcher.stats()
+    return stats
+
 # ==============================================================================
 # MODIFIED FUNCTIONS: Now using RAG
 # ==============================================================================
 
 @time_tool
-def get_meeting_briefing(client_name: str) -> dict:
+async def get_meeting_briefing(client_name: str) -> dict:
     """
     Searches the knowledge base for a meeting briefing for a specific client.
     """
-    print(f"Tool (RAG): Fetching meeting brief for {client_name}")
-    if not retriever:
-        return {"status": "error", "message": "Knowledge base is not available."}
-
-    # Use the client name to form a query for the retriever
-    query = f"Provide a detailed meeting briefing for the client: {client_name}"
-    docs = retriever.invoke(query)
-    
-    # Combine the content from the retrieved documents
-    retrieved_context = "\n---\n".join([doc.page_content for doc in docs])
-    # print(f"Briefing context: {retrieved_context}")
-
-    # Construct the message based on the retrieved information
-    # message = (
-    #     f"Okay, I have your meeting briefing for {client_name}. "
-    #     f"Here are the key points from our records:\n{retrieved_context}"
-    # )
-
-    return {"status": "success", "message": retrieved_context}
+    logger.debug("Tool (RAG): Fetching meeting brief for %s", client_name)
+    async with _knowledge_base() as index:
+        if index is None:
+            return {"status": "error", "message": "Knowledge base is not available."}
+        client_name = _resolve(client_name, "client")
+        _remember("last_client_name", client_name)
+
+        query = BRIEFING_QUERY.format(client_name)
+        # Known clients are served from the passages precomputed at index time
+        passages = _materialized(index, "get_meeting_briefing", client_name)
+        if passages is None:
+            docs = await _retrieve_async("get_meeting_briefing", query, index.name)
+            passages = _passages(docs)
+
+        # Keep only the facts most relevant to the briefing, within the token budget. The briefing
+        # has no spoken lead-in: its message is the briefing itself.
+        return {"status": "success", **_shape_response("get_meeting_briefing", query, passages, None)}
 
 @time_tool
-def get_competitor_comparison(product_name: str) -> dict:
+async def get_competitor_comparison(product_name: str) -> dict:
     """
     Searches the knowledge base for a side-by-side comparison for a product against its competitors.
     """
-    print(f"Tool (RAG): Getting strategic comparison for {product_name}")
-    if not retriever:
-        return {"status": "error", "message": "Knowledge base is not available."}
+    logger.debug("Tool (RAG): Getting strategic comparison for %s", product_name)
+    async with _knowledge_base() as index:
+        if index is None:
+            return {"status": "error", "message": "Knowledge base is not available."}
+        product_name = _resolve(product_name, "product")
+        _remember("product_in_focus", product_name)
         
-    # Form a clear query for the retriever
-    query = f"Provide a competitor comparison for the product: {product_name}"
-    docs = retriever.invoke(query)
-    
-    # Combine the content from the retrieved documents
-    retrieved_context = "\n---\n".join([doc.page_content for doc in docs])
+        query = COMPARISON_QUERY.format(product_name)
+        # Known products are served from the passages precomputed at index time
+        passages = _materialized(index, "get_competitor_comparison", product_name)
+        if passages is None:
+            docs = await _retrieve_async("get_competitor_comparison", query, index.name)
+            passages = _passages(docs)
 
-    if not retrieved_context:
-        return {"status": "error", "message": f"I couldn't find comparison data for '{product_name}'."}
+        if not passages:
+            return {"status": "error", "message": f"I couldn't find comparison data for '{product_name}'."}
 
-    message = f"Alright, here is the comparison for {product_name} based on our knowledge base:\n{retrieved_context}"
-    return {"status": "success", "message": message}
+        lead = f"Alright, here is the comparison for {product_name} based on our knowledge base:"
+        return {"status": "success", **_shape_response("get_competitor_comparison", query, passages, lead)}
 
 # ==============================================================================
 # UNCHANGED FUNCTIONS
 # ==============================================================================
 
 @time_tool
-def get_meeting_recap(discussion_points: list[str], action_items: list[str], follow_up_date: str) -> dict:
-    """Analyzes extracted meeting notes to generate a structured recap."""
+def get_meeting_recap(discussion_points: list[str], action_items: list[str], follow_up_date: str,
+                      client_name: str = "") -> dict:
+    """
+    Analyzes extracted meeting notes to generate a structured recap. `client_name`
+    is optional; it defaults to the client of the last briefing.
+    """
 
     state = _get_and_init_state()
-    # client_name = state.get("last_client_name", "the client")
-    client_name = 'Volta Motors'
+    if client_name:
+        client_name = _resolve(client_name, "client")
+        state["last_client_name"] = client_name
+    else:
+        client_name = state.get("last_client_name", "the client")
 
-    print(f"Tool: >>>>> EXECUTING get_meeting_recap for {client_name} <<<<<")
+    logger.debug("Tool: EXECUTING get_meeting_recap for %s", client_name)
 
     # Save raw data to state for other tools in the sequence
     state["last_discussion_points"] = discussion_points
@@ -152,19 +430,18 @@ def create_invite_from_recap() -> dict:
     state = _get_and_init_state()
     
     # Get details from state, with defaults
-    # client_name = state.get("last_client_name", "Volta Motors")
-    client_name = 'Volta Motors'
+    client_name = state.get("last_client_name", "the client")
     follow_up_date = state.get("last_follow_up_date", "a future date")
-    product = state.get("product_in_focus", "Loctite ESB 5100")
+    product = state.get("product_in_focus", FOCUS_PRODUCT)
 
-    print(f"Tool: >>>>> EXECUTING create_invite_from_recap for {follow_up_date} <<<<<")
+    logger.debug("Tool: EXECUTING create_invite_from_recap for %s", follow_up_date)
 
     # Define the structured invite data
     invite_data = {
         "subject": f"Follow-Up: {product} Trial Results",
         "start_time": f"{follow_up_date} 10:00 AM",
         "location": client_name,
-        "attendees": ["alex.richter@henkel.com", "david.chen@voltamotors.com", "maria.rodriguez@voltamotors.com"],
+        "attendees": [REP_EMAIL] + [contact.email for contact in _client_contacts(client_name) if contact.email],
         "body": f"This is a follow-up to discuss the trial results of the {product} sample for the Gasketing application. We will also cover product availability and PO details."
     }
 
@@ -189,19 +466,22 @@ def create_email_from_recap() -> dict:
     state = _get_and_init_state()
 
     # Get all necessary details from state
-    # client_name = state.get("last_client_name", "Volta Motors")
-    client_name = 'Volta Motors'
-    product = state.get("product_in_focus", "Loctite ESB 5100")
+    client_name = state.get("last_client_name", "the client")
+    product = state.get("product_in_focus", FOCUS_PRODUCT)
     discussion_points = state.get("last_discussion_points", [])
     follow_up_date = state.get("last_follow_up_date", "our upcoming call")
 
-    print(f"Tool: >>>>> EXECUTING create_email_from_recap for {client_name} <<<<<")
+    logger.debug("Tool: EXECUTING create_email_from_recap for %s", client_name)
+
+    contacts = _client_contacts(client_name)
+    first_names = [contact.name.split()[0] for contact in contacts]
+    greeting = " and ".join([", ".join(first_names[:-1]), first_names[-1]] if len(first_names) > 1 else first_names) or "all"
 
     # Format the discussion points into a list
     recap_points_formatted = "\n".join([f"- {point}" for point in discussion_points]) if discussion_points else "- Our key discussion points."
 
     # Draft the full email body
-    full_email_body = f"""Dear David and Maria,
+    full_email_body = f"""Dear {greeting},
 
 Thank you again for your time today. It was a pleasure discussing your needs for the {client_name} EV battery enclosures.
 
@@ -223,7 +503,7 @@ Henkel
 """
     # Define the structured email data
     email_data = {
-        "recipients": ["david.chen@voltamotors.com", "maria.rodriguez@voltamotors.com"],
+        "recipients": [contact.email for contact in contacts if contact.email],
         "subject": f"Follow-up: {product} for {client_name} EV Battery Enclosures",
         "attachments": ["Loctite_ESB_5100_TDS.pdf", "Success-story-loctite-esb-5100-serviceable-batteries.pdf", "Battery-Engineering-Center.pdf"],
         "body": full_email_body
@@ -240,12 +520,15 @@ Henkel
     }
 
 @time_tool
-def get_product_information(question: str) -> dict:
+async def get_product_information(question: str) -> dict:
     """Searches the knowledge base for a technical product question."""
-    print(f"Tool: Received question for RAG: '{question}'")
-    docs = retriever.invoke(question)
-    retrieved_context = "\n---\n".join([doc.page_content for doc in docs])
-    return {"status": "success", "message": retrieved_context}
+    logger.debug("Tool: Received question for RAG: '%s'", question)
+    async with _knowledge_base() as index:
+        if index is None:
+            return {"status": "error", "message": "Knowledge base is not available."}
+        docs = await _retrieve_async("get_product_information", question, index.name)
+        lead = "Here is what our knowledge base says:"
+        return {"status": "success", **_shape_response("get_product_information", question, _passages(docs), lead)}
 
 
 # --- Final Tool Definitions ---